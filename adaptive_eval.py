@@ -0,0 +1,190 @@
+import os
+import csv
+import json
+import argparse
+import numpy as np
+from stable_baselines3 import PPO
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from traffic_generator import TrafficGenerator
+from baseline_cache import BaselineCache
+from episode_sets import EPISODE_POOL_IDS
+from evaluation import run_policy_episode, model_env_modes, KPI_KEYS
+
+# Adaptive paired evaluation of a PPO model against an STL variant. Episodes are drawn from a
+# large pool, stratified by Scenario: a few per scenario first, then proportionally to the
+# scenario probabilities of TrafficGenerator. Both controllers run every drawn episode and
+# the per-episode difference PPO - STL of every KPI is kept (paired: the demand variance
+# between episodes cancels out).
+# The mean difference is the stratified mean (stratum means weighted by the scenario
+# probabilities), its confidence interval a stratified percentile bootstrap. The evaluation
+# stops once, for every KPI, the interval is narrower than target_width times the STL mean
+# or lies on one side of zero. The check is repeated while the episodes come in, so the
+# nominal level is slightly optimistic: --min-episodes and --check-every keep it close.
+
+LOG_DIR = os.path.join("logs", "adaptive_eval")
+
+STL_VARIANTS = {"stl": [], "stl1": [1], "stl2": [2], "stl12": [1, 2]}
+
+
+def stratified_order(pool, traffic_gen, min_per_stratum, max_episodes, seed):
+    # drawing order of the pool episodes, fixed in advance: only the stopping point depends on the results
+    rng = np.random.default_rng(seed)
+    pools = {scenario: [] for scenario in traffic_gen.scenario_probs}
+    for episode_id in pool:
+        pools[traffic_gen.episode_scenario(episode_id)].append(episode_id)
+    for ids in pools.values():
+        rng.shuffle(ids)
+
+    weights = traffic_gen.scenario_probs
+    counts = {scenario: 0 for scenario in pools}
+    order = []
+    while len(order) < max_episodes and any(counts[s] < len(pools[s]) for s in pools):
+        available = [s for s in pools if counts[s] < len(pools[s])]
+        below_min = [s for s in available if counts[s] < min_per_stratum]
+        if below_min:
+            scenario = below_min[0]
+        else:
+            # largest deficit against the proportional allocation
+            n = len(order) + 1
+            scenario = max(available, key=lambda s: weights[s] * n - counts[s])
+        order.append((pools[scenario][counts[scenario]], scenario))
+        counts[scenario] += 1
+    return order
+
+
+def strata(values, scenarios, weights):
+    # (weight, values) of every scenario present, weights renormalized over them
+    values = np.asarray(values)
+    present = sorted(set(scenarios), key=lambda s: s.value)
+    total = sum(weights[s] for s in present)
+    return [(weights[s] / total, values[[x == s for x in scenarios]]) for s in present]
+
+
+def stratified_mean(values, scenarios, weights):
+    return float(sum(w * stratum.mean() for w, stratum in strata(values, scenarios, weights)))
+
+
+def stratified_bootstrap(values, scenarios, weights, n_boot, confidence, rng):
+    # stratified mean of values and its percentile bootstrap interval (resampling within the strata)
+    boot = np.zeros(n_boot)
+    for w, stratum in strata(values, scenarios, weights):
+        idx = rng.integers(0, len(stratum), size=(n_boot, len(stratum)))
+        boot += w * stratum[idx].mean(axis=1)
+    alpha = 1.0 - confidence
+    low, high = np.quantile(boot, [alpha / 2, 1 - alpha / 2])
+    return stratified_mean(values, scenarios, weights), float(low), float(high)
+
+
+def summarize(rows, weights, target_width, n_boot, confidence, rng):
+    scenarios = [row["scenario"] for row in rows]
+    summary = {}
+    for key in KPI_KEYS:
+        diff, low, high = stratified_bootstrap([row[f"diff_{key}"] for row in rows], scenarios, weights, n_boot, confidence, rng)
+        stl_mean = stratified_mean([row[f"stl_{key}"] for row in rows], scenarios, weights)
+        if low > 0 or high < 0:
+            status = "PPO worse" if low > 0 else "PPO better"
+        elif high - low <= target_width * abs(stl_mean):
+            status = "equivalent"
+        else:
+            status = "open"
+        summary[key] = {"diff": diff, "low": low, "high": high, "stl_mean": stl_mean,
+                        "relative": diff / stl_mean if stl_mean else float("nan"), "status": status}
+    return summary
+
+
+def print_summary(summary, n_episodes, confidence):
+    print(f"--- {n_episodes} episodes, {confidence:.0%} intervals of PPO - STL ---")
+    print(f"{'KPI':>18} {'diff':>10} {'low':>10} {'high':>10} {'rel':>7} {'status':>11}")
+    for key, s in summary.items():
+        print(f"{key:>18} {s['diff']:>10.2f} {s['low']:>10.2f} {s['high']:>10.2f} {s['relative']:>7.1%} {s['status']:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paired PPO/STL evaluation on a stratified episode pool, stopped by bootstrap confidence intervals")
+    parser.add_argument("--id", type=int, required=True, help="Training ID")
+    parser.add_argument("--stl", type=str, choices=list(STL_VARIANTS), default="stl12", help="STL variant of the comparison")
+    parser.add_argument("--target-width", type=float, default=0.02, help="Interval width, as a fraction of the STL mean, at which a KPI is settled")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--min-per-scenario", type=int, default=3, help="Episodes of every scenario before the first check")
+    parser.add_argument("--min-episodes", type=int, default=20)
+    parser.add_argument("--max-episodes", type=int, default=400)
+    parser.add_argument("--check-every", type=int, default=5, help="Episodes between two stopping checks")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="Bootstrap resamples")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the drawing order and of the bootstrap")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    model_name = f"PPO_{args.id}"
+    model = PPO.load(os.path.join("models", "ppo", f"train_id_{args.id}", f"{model_name}.zip"))
+    action_mode, obs_source = model_env_modes(model, CONFIG_4WAY_160M)
+
+    traffic_gen = TrafficGenerator(CONFIG_4WAY_160M, 0.5)
+    order = stratified_order(EPISODE_POOL_IDS, traffic_gen, args.min_per_scenario, args.max_episodes, args.seed)
+    weights = traffic_gen.scenario_probs
+
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=LOG_DIR,
+                  episode_list=[episode_id for episode_id, _ in order],
+                  enable_measure=True,
+                  action_mode=action_mode,
+                  obs_source=obs_source)
+    baseline_cache = BaselineCache()
+    enhancements = STL_VARIANTS[args.stl]
+    rng = np.random.default_rng(args.seed)
+
+    rows = []
+    summary = None
+    summary_episodes = 0
+    basename = os.path.join(LOG_DIR, f"{model_name}_vs_{args.stl}")
+    try:
+        for episode_id, scenario in order:
+            ppo = run_policy_episode(env, lambda obs: model.predict(obs, deterministic=True)[0])
+
+            cache_key, cache_fields = baseline_cache.key(episode_id, enhancements, CONFIG_4WAY_160M, env.sim_step)
+            measures = baseline_cache.load(cache_key)
+            if measures is None:
+                env.run_smart_traffic_light(enhancements)
+                measures = env.get_measures()
+                if env.last_gridlock is None:
+                    baseline_cache.store(cache_key, cache_fields, measures)
+
+            row = {"episode_id": episode_id, "scenario": scenario}
+            for key in KPI_KEYS:
+                stl_value = float(np.mean([m[key] for m in measures]))
+                row[f"ppo_{key}"] = ppo[key]
+                row[f"stl_{key}"] = stl_value
+                row[f"diff_{key}"] = ppo[key] - stl_value
+            rows.append(row)
+            print(f"Episode {episode_id} ({scenario.value}): travel time {row['diff_totalTravelTime']:+.1f} s against {args.stl.upper()}")
+
+            if len(rows) >= args.min_episodes and len(rows) % args.check_every == 0:
+                summary = summarize(rows, weights, args.target_width, args.bootstrap, args.confidence, rng)
+                summary_episodes = len(rows)
+                print_summary(summary, len(rows), args.confidence)
+                if all(s["status"] != "open" for s in summary.values()):
+                    print(f"Every KPI settled after {len(rows)} episodes")
+                    break
+        else:
+            print(f"Episode limit reached ({len(rows)} episodes)")
+
+    except KeyboardInterrupt:
+        print("\nUser interruption.")
+
+    finally:
+        env.close()
+        if rows:
+            if summary_episodes < len(rows):
+                summary = summarize(rows, weights, args.target_width, args.bootstrap, args.confidence, rng)
+                print_summary(summary, len(rows), args.confidence)
+            with open(basename + ".csv", 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows([{**row, "scenario": row["scenario"].value} for row in rows])
+            with open(basename + ".json", 'w') as f:
+                json.dump({"model": model_name, "stl": args.stl, "episodes": len(rows), "confidence": args.confidence,
+                           "target_width": args.target_width, "kpis": summary}, f, indent=2)
+            print(f"Results saved in {basename}.csv/.json")
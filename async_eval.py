@@ -0,0 +1,125 @@
+import io
+import os
+import csv
+import json
+import queue
+import multiprocessing as mp
+from stable_baselines3.common.callbacks import BaseCallback
+from fast_vec_env import _main_module_hidden
+from policy_export import actor_arrays
+import eval_worker
+
+# In-training evaluation that never blocks the learner. Every `every_rollouts` rollouts the
+# actor weights are sent to an evaluation process (eval_worker.evaluator), which plays the
+# evaluation episodes with NumpyPolicy while training goes on. The results are picked up at the
+# following rollout ends and recorded under eval/*; the snapshot with the best score
+# (lowest mean waiting time, as the sweep trials) is written to best_model.zip.
+# The full model of a snapshot is kept in memory until its result arrives; with max_pending
+# snapshots waiting, new ones are skipped instead of queued.
+
+BEST_MODEL_FILE = "best_model.zip"
+BEST_EVAL_FILE = "best_eval.json"
+EVALUATIONS_FILE = "evaluations.csv"
+
+
+def eval_score(kpis):
+    return -kpis["totalWaitingTime"]
+
+
+class AsyncEvalCallback(BaseCallback):
+    def __init__(self, eval_dir, env_kwargs, episodes, every_rollouts=20, max_pending=2, cpu_set=None, verbose=1):
+        super().__init__(verbose)
+        self.eval_dir = eval_dir
+        self.env_kwargs = dict(env_kwargs, workspace_root=os.path.join(eval_dir, "workspace"), log_folder=eval_dir)
+        self.episodes = list(episodes)
+        self.every_rollouts = every_rollouts
+        self.max_pending = max_pending
+        self.cpu_set = cpu_set
+        self._rollouts = 0
+        self._pending = {}
+        self._process = None
+
+        os.makedirs(eval_dir, exist_ok=True)
+        # a resumed run keeps the best model of the interrupted one
+        self.best_score = None
+        best_eval_path = os.path.join(eval_dir, BEST_EVAL_FILE)
+        if os.path.exists(best_eval_path):
+            with open(best_eval_path) as f:
+                self.best_score = json.load(f)["score"]
+
+    def _on_training_start(self):
+        ctx = mp.get_context("forkserver")
+        self._snapshots = ctx.Queue()
+        self._results = ctx.Queue()
+        args = (self._snapshots, self._results, self.env_kwargs, self.episodes, self.cpu_set)
+        with _main_module_hidden():
+            self._process = ctx.Process(target=eval_worker.evaluator, args=args, daemon=True)
+            self._process.start()
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        self._collect()
+        self._rollouts += 1
+        if self._rollouts % self.every_rollouts == 0:
+            self._snapshot()
+
+    def _on_training_end(self):
+        # training is over: the last snapshot is evaluated before returning
+        self._snapshot()
+        self._snapshots.put(None)
+        while self._pending and self._process.is_alive():
+            self._collect(block=True)
+        self._collect()
+        self._process.join()
+        # no rollout follows: the results collected here would never reach the logger otherwise
+        self.logger.dump(self.num_timesteps)
+
+    def _snapshot(self):
+        if not self._process.is_alive() or self.num_timesteps in self._pending:
+            return
+        if len(self._pending) >= self.max_pending:
+            if self.verbose > 0:
+                print(f"Evaluation busy: snapshot at {self.num_timesteps} timesteps skipped")
+            return
+        model_buffer = io.BytesIO()
+        self.model.save(model_buffer)
+        self._pending[self.num_timesteps] = model_buffer.getvalue()
+        self._snapshots.put((self.num_timesteps, actor_arrays(self.model)))
+
+    def _collect(self, block=False):
+        while True:
+            try:
+                timesteps, kpis, wall_time = self._results.get(timeout=5) if block else self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._record(timesteps, kpis, wall_time, self._pending.pop(timesteps))
+            block = False
+
+    def _record(self, timesteps, kpis, wall_time, model_bytes):
+        score = eval_score(kpis)
+        for key, value in kpis.items():
+            self.logger.record(f"eval/{key}", value)
+        self.logger.record("eval/score", score)
+        self.logger.record("eval/snapshot_timesteps", timesteps)
+        self.logger.record("eval/wall_time", wall_time)
+
+        evaluations_path = os.path.join(self.eval_dir, EVALUATIONS_FILE)
+        write_header = not os.path.exists(evaluations_path)
+        with open(evaluations_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=["timesteps", "score", "wall_time"] + list(kpis))
+            if write_header:
+                writer.writeheader()
+            writer.writerow({"timesteps": timesteps, "score": score, "wall_time": wall_time, **kpis})
+
+        if self.best_score is None or score > self.best_score:
+            self.best_score = score
+            tmp_path = os.path.join(self.eval_dir, f".tmp_{BEST_MODEL_FILE}")
+            with open(tmp_path, 'wb') as f:
+                f.write(model_bytes)
+            os.replace(tmp_path, os.path.join(self.eval_dir, BEST_MODEL_FILE))
+            with open(os.path.join(self.eval_dir, BEST_EVAL_FILE), 'w') as f:
+                json.dump({"timesteps": timesteps, "score": score, "kpis": kpis}, f, indent=2)
+            if self.verbose > 0:
+                print(f"New best evaluation at {timesteps} timesteps: waiting time {kpis['totalWaitingTime']:.1f} s")
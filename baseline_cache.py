@@ -0,0 +1,82 @@
+import os
+import json
+import hashlib
+import dataclasses
+from importlib import metadata
+from traffic_generator import GENERATOR_VERSION
+from lazy_imports import lazy_import
+
+libsumo = lazy_import("libsumo")
+
+# Cache of the Smart Traffic Light measures. The STL baselines do not depend on the PPO
+# model, so they are computed once per episode and configuration and reused by test.py.
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "stl_baselines")
+TEMPLATE_XML_PATH = "sumo_xml_template_files" # configs without a template_dir
+
+_sumo_version = None
+
+
+def sumo_version():
+    global _sumo_version
+    if _sumo_version is None:
+        try:
+            _sumo_version = libsumo.getVersion()[1]
+        except Exception:
+            _sumo_version = metadata.version("libsumo")
+    return _sumo_version
+
+
+def sim_config_hash(sim_config, template_xml_path=None):
+    # SimConfig fields plus the content of its network, route, additional and .sumocfg files,
+    # read from the template folder of the config (generated networks live outside the default one)
+    if template_xml_path is None:
+        template_xml_path = sim_config.template_dir or TEMPLATE_XML_PATH
+    digest = hashlib.sha1(json.dumps(dataclasses.asdict(sim_config), sort_keys=True).encode())
+    for file_name in [sim_config.net_file, sim_config.rou_file, sim_config.add_file, sim_config.name + ".sumocfg"]:
+        path = os.path.join(template_xml_path, sim_config.name, file_name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class BaselineCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._config_hashes = {}
+
+    def key(self, episode_id, enhancements, sim_config, sim_step, measure_mode="poll"):
+        config_key = (sim_config.template_dir, sim_config.name)
+        if config_key not in self._config_hashes:
+            self._config_hashes[config_key] = sim_config_hash(sim_config)
+
+        fields = {
+            "episode_id": episode_id,
+            "enhancements": sorted(enhancements),
+            "sim_config": self._config_hashes[config_key],
+            "sim_step": sim_step,
+            "generator_version": GENERATOR_VERSION,
+            "sumo_version": sumo_version(),
+        }
+        # kept out of the polling keys, written before the tripinfo engine existed
+        if measure_mode != "poll":
+            fields["measure_mode"] = measure_mode
+        return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest(), fields
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)["measures"]
+
+    def store(self, key, fields, measures):
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"key": fields, "measures": measures}, f)
+        os.replace(tmp_path, self._path(key))
@@ -0,0 +1,58 @@
+import os
+import time
+import argparse
+import numpy as np
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+
+# Reset latency and total wall time of SumoEnv with and without prefetching of the next episode.
+# Between two resets the env runs a few actions, which is when the prefetch stage works: a gain
+# on the reset only counts if the steps do not get slower by the same amount, so the time of
+# the whole reset + actions cycle is reported as well.
+
+def measure_resets(prefetch, episodes, steps_per_episode, log_dir):
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=log_dir,
+                  rank="bench_reset",
+                  episode_offset=10_000,
+                  prefetch=prefetch)
+
+    reset_times = []
+    step_times = []
+    hits = 0
+    try:
+        for _ in range(episodes):
+            _, info = env.reset()
+            reset_times.append(info["reset_time"])
+            hits += info["prefetch_hit"]
+            start = time.perf_counter()
+            for step in range(steps_per_episode):
+                env.step(step % 2)
+            step_times.append(time.perf_counter() - start)
+    finally:
+        env.close()
+
+    # the first reset can never be a prefetch hit
+    return np.array(reset_times[1:]), np.array(step_times[1:]), hits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SumoEnv reset latency and episode wall time with and without prefetching")
+    parser.add_argument("--episodes", type=int, default=10, help="Resets measured for each mode")
+    parser.add_argument("--steps", type=int, default=30, help="Actions run between two resets")
+    args = parser.parse_args()
+
+    log_dir = os.path.join("logs", "bench_reset")
+    os.makedirs(log_dir, exist_ok=True)
+
+    print(f"{'prefetch':>9} {'reset mean (ms)':>16} {'reset p95 (ms)':>15} {'steps (ms)':>11} {'total (ms)':>11} {'hits':>6}")
+    totals = {}
+    for prefetch in [False, True]:
+        reset_times, step_times, hits = measure_resets(prefetch, args.episodes, args.steps, log_dir)
+        reset_ms, step_ms = reset_times * 1000, step_times * 1000
+        totals[prefetch] = (reset_ms + step_ms).mean()
+        print(f"{str(prefetch):>9} {reset_ms.mean():>16.1f} {np.percentile(reset_ms, 95):>15.1f} {step_ms.mean():>11.1f} {totals[prefetch]:>11.1f} {hits:>6}")
+    print(f"Net gain of the prefetch per reset + {args.steps} actions: {totals[False] - totals[True]:.1f} ms")
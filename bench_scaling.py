@@ -0,0 +1,114 @@
+import os
+import csv
+import time
+import argparse
+import numpy as np
+import libsumo
+from sumo_env import SumoEnv
+from network_generator import generate_network
+
+# Per-step cost of SumoEnv against network size and vehicle count, on generated grid networks.
+# For every network and demand scale a few actions are run and split into simulation time
+# (libsumo.simulationStep, reward bookkeeping) and observation time (DTSE builder).
+
+LOG_DIR = os.path.join("logs", "bench_scaling")
+
+
+def measure(config, decisions, warmup):
+    env = SumoEnv(sim_config=config,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=LOG_DIR,
+                  rank="scaling",
+                  episode_offset=20_000)
+    try:
+        env.reset()
+        # the network is filled before measuring
+        for step in range(warmup):
+            env.step(step % 2)
+
+        step_times, observe_times, vehicles, sim_steps = [], [], [], []
+        for step in range(decisions):
+            start_time = libsumo.simulation.getTime()
+            start = time.perf_counter()
+            env.step(step % 2)
+            step_times.append(time.perf_counter() - start)
+            sim_steps.append((libsumo.simulation.getTime() - start_time) / env.sim_step)
+
+            start = time.perf_counter()
+            env._compute_observation()
+            observe_times.append(time.perf_counter() - start)
+            vehicles.append(libsumo.vehicle.getIDCount())
+    finally:
+        env.close()
+
+    observe_ms = 1000 * np.mean(observe_times)
+    return {
+        "network": config.name,
+        "edges": config.num_edges,
+        "demand_scale": config.demand_scale,
+        "vehicles": float(np.mean(vehicles)),
+        "step_ms": 1000 * np.mean(step_times),
+        # step() builds the observation once, the rest is spread over its simulation steps
+        "sim_step_ms": (1000 * np.mean(step_times) - observe_ms) / np.mean(sim_steps),
+        "observe_ms": observe_ms,
+    }
+
+
+def plot(rows, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not available, chart skipped")
+        return
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for network in dict.fromkeys(row["network"] for row in rows):
+        points = sorted((row["vehicles"], row["sim_step_ms"], row["edges"]) for row in rows if row["network"] == network)
+        axes[0].plot([p[0] for p in points], [p[1] for p in points], marker="o", label=network)
+    axes[0].set_xlabel("vehicles in the network")
+    axes[0].set_ylabel("ms per simulation step")
+    axes[0].legend()
+
+    for scale in sorted({row["demand_scale"] for row in rows}):
+        points = sorted((row["edges"], row["sim_step_ms"]) for row in rows if row["demand_scale"] == scale)
+        axes[1].plot([p[0] for p in points], [p[1] for p in points], marker="o", label=f"demand x{scale}")
+    axes[1].set_xlabel("edges")
+    axes[1].set_ylabel("ms per simulation step")
+    axes[1].legend()
+
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"Chart saved in {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SumoEnv per-step cost against network size and vehicle count")
+    parser.add_argument("--grids", type=int, nargs="+", default=[1, 2, 3, 5], help="Grid sizes K (K x K junctions)")
+    parser.add_argument("--lanes", type=int, nargs="+", default=[2], help="Lanes per edge")
+    parser.add_argument("--arm-length", type=int, default=160)
+    parser.add_argument("--demand-scales", type=float, nargs="+", default=[0.5, 1.0, 2.0, 4.0])
+    parser.add_argument("--decisions", type=int, default=30, help="Measured actions per configuration")
+    parser.add_argument("--warmup", type=int, default=30, help="Actions run before measuring")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    rows = []
+    for grid_size in args.grids:
+        for lanes in args.lanes:
+            for demand_scale in args.demand_scales:
+                config = generate_network(grid_size, args.arm_length, lanes, demand_scale)
+                row = measure(config, args.decisions, args.warmup)
+                rows.append(row)
+                print(f"{row['network']:>22} x{demand_scale:<4} {row['vehicles']:>7.0f} veh {row['sim_step_ms']:>8.2f} ms/sim step {row['observe_ms']:>7.2f} ms/obs")
+
+    report_file = os.path.join(LOG_DIR, "bench_scaling.csv")
+    with open(report_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results saved in {report_file}")
+    plot(rows, os.path.join(LOG_DIR, "bench_scaling.png"))
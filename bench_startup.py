@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Launch time of N env workers: SB3 SubprocVecEnv against FastSubprocVecEnv. Every mode runs
+# in a fresh interpreter, so the forkserver of one mode does not serve the other.
+
+LOG_DIR = os.path.join("logs", "bench_startup")
+
+
+def launch(mode, num_workers):
+    start = time.time()
+    from train import make_env
+    if mode == "sb3":
+        from stable_baselines3.common.vec_env import SubprocVecEnv
+        vec_env = SubprocVecEnv([make_env(i, LOG_DIR, workspace_root=os.path.join("sumo_workspace", "bench_startup")) for i in range(num_workers)])
+    else:
+        from fast_vec_env import FastSubprocVecEnv, log_startup_profile
+        vec_env = FastSubprocVecEnv([make_env(i, LOG_DIR, workspace_root=os.path.join("sumo_workspace", "bench_startup")) for i in range(num_workers)])
+        log_startup_profile(vec_env, LOG_DIR)
+    ready = time.time() - start
+    vec_env.close()
+    return ready
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup time of the env workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--mode", type=str, choices=["sb3", "fast"], required=False, help="Run a single mode (used internally)")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    if args.mode:
+        print(json.dumps({"ready_s": launch(args.mode, args.workers[0])}))
+        sys.exit(0)
+
+    print(f"{'workers':>8} {'sb3 (s)':>9} {'fast (s)':>9}")
+    for num_workers in args.workers:
+        times = {}
+        for mode in ["sb3", "fast"]:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode, "--workers", str(num_workers)],
+                                    check=True, capture_output=True, text=True).stdout
+            times[mode] = json.loads(output.strip().splitlines()[-1])["ready_s"]
+        print(f"{num_workers:>8} {times['sb3']:>9.2f} {times['fast']:>9.2f}")
@@ -0,0 +1,147 @@
+import io
+import os
+import time
+import pickle
+import shutil
+import threading
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback
+
+CHECKPOINT_PREFIX = "ckpt_"
+MODEL_FILE = "model.zip"
+STATE_FILE = "training_state.pkl"
+
+
+def list_checkpoints(checkpoint_dir):
+    if not os.path.exists(checkpoint_dir):
+        return []
+
+    # only fully written checkpoints have the final name (see PeriodicCheckpoint._write)
+    names = sorted(d for d in os.listdir(checkpoint_dir) if d.startswith(CHECKPOINT_PREFIX))
+    return [os.path.join(checkpoint_dir, d) for d in names]
+
+
+def latest_checkpoint(checkpoint_dir):
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if checkpoints else None
+
+
+def read_training_state(checkpoint_path):
+    with open(os.path.join(checkpoint_path, STATE_FILE), 'rb') as f:
+        return pickle.load(f)
+
+
+def load_checkpoint(checkpoint_path, env, **kwargs):
+    # model.zip also holds the optimizer state
+    return PPO.load(os.path.join(checkpoint_path, MODEL_FILE), env=env, **kwargs)
+
+
+def collect_training_state(model, episode_counter):
+    env = model.get_env() # VecMonitor
+    return {
+        "num_timesteps": model.num_timesteps,
+        "num_envs": env.num_envs,
+        "episodes_done": int(episode_counter.episode_count),
+        "workers": {
+            "episode_id": env.get_attr("episode_id"),
+            "episode_count": env.get_attr("episode_count"),
+        },
+        "monitor": {
+            "episode_count": env.episode_count,
+            "elapsed": time.time() - env.t_start,
+        },
+        "rng": {
+            "numpy": np.random.get_state(),
+            "torch": torch.get_rng_state(),
+        },
+    }
+
+
+def restore_training_state(model, state, episode_counter):
+    env = model.get_env()
+    if env.num_envs != state["num_envs"]:
+        raise ValueError(f"Checkpoint was written with {state['num_envs']} envs, current run has {env.num_envs}")
+
+    # The episodes in progress at checkpoint time are abandoned: after the reset done by
+    # learn() every worker continues from the episode following the saved one.
+    for i in range(env.num_envs):
+        env.set_attr("episode_id", state["workers"]["episode_id"][i], indices=[i])
+        env.set_attr("episode_count", state["workers"]["episode_count"][i], indices=[i])
+
+    env.episode_count = state["monitor"]["episode_count"]
+    env.t_start = time.time() - state["monitor"]["elapsed"]
+    episode_counter.episode_count = state["episodes_done"]
+
+    np.random.set_state(state["rng"]["numpy"])
+    torch.set_rng_state(state["rng"]["torch"])
+
+
+class PeriodicCheckpoint(BaseCallback):
+    # Every `every_rollouts` rollouts the model is serialized in memory, between rollout
+    # collection and the PPO update; the files are written by a background thread, renamed
+    # into place only when complete and only the last `keep_last` checkpoints are kept.
+    def __init__(self, checkpoint_dir, episode_counter, every_rollouts=10, keep_last=3, verbose=1):
+        super().__init__(verbose)
+        self.checkpoint_dir = checkpoint_dir
+        self.episode_counter = episode_counter
+        self.every_rollouts = every_rollouts
+        self.keep_last = keep_last
+        self._rollouts = 0
+        self._writer = None
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        self._rollouts += 1
+        if self._rollouts % self.every_rollouts == 0:
+            self.save()
+
+    def _on_training_end(self):
+        self.save()
+        self.wait()
+
+    def wait(self):
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+    def save(self):
+        # at most one write in flight
+        self.wait()
+
+        model_buffer = io.BytesIO()
+        self.model.save(model_buffer)
+        state = collect_training_state(self.model, self.episode_counter)
+
+        self._writer = threading.Thread(target=self._write, args=(model_buffer.getvalue(), state), daemon=True)
+        self._writer.start()
+
+    def _write(self, model_bytes, state):
+        name = f"{CHECKPOINT_PREFIX}{state['num_timesteps']:012d}"
+        final_path = os.path.join(self.checkpoint_dir, name)
+        if os.path.exists(final_path):
+            return
+
+        tmp_path = os.path.join(self.checkpoint_dir, f".tmp_{name}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        with open(os.path.join(tmp_path, MODEL_FILE), 'wb') as f:
+            f.write(model_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(tmp_path, STATE_FILE), 'wb') as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, final_path)
+
+        for old_checkpoint in list_checkpoints(self.checkpoint_dir)[:-self.keep_last]:
+            shutil.rmtree(old_checkpoint, ignore_errors=True)
+
+        if self.verbose > 0:
+            print(f"Checkpoint saved: {final_path} ({state['episodes_done']} episodes)")
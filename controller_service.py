@@ -0,0 +1,253 @@
+import os
+import json
+import math
+import time
+import bisect
+import asyncio
+import argparse
+import libsumo
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from traffic_light import TrafficLight
+from policy_export import NumpyPolicy
+
+# Real-time controller service. A local SUMO instance (driven through libsumo) stands in
+# for the field controller: the simulation clock is paced against the wall clock and the
+# controller has to observe, decide and actuate within a latency budget.
+
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+STAGES = ["observe", "infer", "actuate", "total"]
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1) # last bucket is +inf
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, value_ms):
+        self.counts[bisect.bisect_left(self.buckets_ms, value_ms)] += 1
+        self.count += 1
+        self.sum_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def to_dict(self):
+        return {
+            "buckets_ms": self.buckets_ms + ["inf"],
+            "counts": self.counts,
+            "count": self.count,
+            "mean_ms": self.sum_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+        }
+
+
+class PolicyController:
+    # RL policy exported with policy_export.py. The signal follows SumoEnv.step: on a change
+    # the yellow and red phases of program "1" run for their programmed duration, then the
+    # chosen green is held for exactly action_step seconds before the next decision.
+    def __init__(self, env, policy):
+        self.env = env
+        self.policy = policy
+        self.decision_interval = env.action_step
+        self._transition = [] # phases still to set before the green, the last one is the green
+        self._phase_end = None
+
+    def observe(self):
+        return self.env._observe()
+
+    def infer(self, obs):
+        return int(self.policy.predict(obs))
+
+    def actuate(self, action):
+        tl_id = self.env.sim_config.tl_id
+        target_phase = action * 3
+        current_phase = libsumo.trafficlight.getPhase(tl_id)
+
+        # every intermediate phase up to the target green, as SumoEnv.step
+        self._transition = []
+        next_phase = (current_phase + 1) % 6
+        while current_phase != target_phase and next_phase != target_phase:
+            self._transition.append(next_phase)
+            next_phase = (next_phase + 1) % 6
+        self._transition.append(target_phase)
+
+        transition_time = 0.0
+        for phase in self._transition[:-1]:
+            transition_time += self._phase_time(tl_id, phase)
+        # the next decision comes after the transition and action_step of green
+        self.decision_interval = transition_time + self.env.action_step
+        self._next_phase(tl_id)
+
+    def tick(self):
+        # called after every simulation step: moves the transition on when a phase is over
+        if self._transition and libsumo.simulation.getTime() >= self._phase_end:
+            self._next_phase(self.env.sim_config.tl_id)
+
+    def _phase_time(self, tl_id, phase):
+        # programmed duration rounded up to whole simulation steps, as the step loop of SumoEnv
+        logic = next(l for l in libsumo.trafficlight.getAllProgramLogics(tl_id) if l.programID == libsumo.trafficlight.getProgram(tl_id))
+        return math.ceil(logic.phases[phase].duration / self.env.sim_step) * self.env.sim_step
+
+    def _next_phase(self, tl_id):
+        # setPhase also restarts the green timer of the program, so the green lasts the whole action_step
+        phase = self._transition.pop(0)
+        libsumo.trafficlight.setPhase(tl_id, phase)
+        self._phase_end = libsumo.simulation.getTime() + self._phase_time(tl_id, phase) if self._transition else None
+
+
+class SmartTrafficLightController:
+    # STL baseline, it decides at every simulation step
+    def __init__(self, env, enhancements):
+        self.tl = TrafficLight(env.sim_config.tl_id, enhancements)
+        self.decision_interval = env.sim_step
+
+    def observe(self):
+        return None
+
+    def infer(self, obs):
+        self.tl.performStep()
+
+    def actuate(self, action):
+        pass
+
+    def tick(self):
+        pass
+
+
+class ControllerService:
+    def __init__(self, env, controller, speedup, latency_budget_ms, metrics_path, report_every):
+        self.env = env
+        self.controller = controller
+        self.speedup = speedup
+        self.latency_budget_ms = latency_budget_ms
+        self.metrics_path = metrics_path
+        self.report_every = report_every
+
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.decisions = 0
+        self.deadline_misses = 0
+        self.max_clock_lag_ms = 0.0
+        self.running = False
+
+    def _decide(self):
+        t0 = time.perf_counter()
+        obs = self.controller.observe()
+        t1 = time.perf_counter()
+        action = self.controller.infer(obs)
+        t2 = time.perf_counter()
+        self.controller.actuate(action)
+        t3 = time.perf_counter()
+
+        for stage, value in zip(STAGES, [t1 - t0, t2 - t1, t3 - t2, t3 - t0]):
+            self.histograms[stage].add(value * 1000)
+
+        self.decisions += 1
+        if (t3 - t0) * 1000 > self.latency_budget_ms:
+            self.deadline_misses += 1
+
+    def metrics(self):
+        return {
+            "sim_time": libsumo.simulation.getTime() if self.running else None,
+            "decisions": self.decisions,
+            "deadline_misses": self.deadline_misses,
+            "deadline_miss_rate": self.deadline_misses / self.decisions if self.decisions else 0.0,
+            "latency_budget_ms": self.latency_budget_ms,
+            "max_clock_lag_ms": self.max_clock_lag_ms,
+            "latency": {stage: h.to_dict() for stage, h in self.histograms.items()},
+        }
+
+    def write_metrics(self):
+        tmp_path = self.metrics_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metrics(), f, indent=2)
+        os.replace(tmp_path, self.metrics_path)
+
+    async def _report_periodically(self):
+        while self.running:
+            await asyncio.sleep(self.report_every)
+            self.write_metrics()
+            print(f"[Controller] t={libsumo.simulation.getTime():.1f}s decisions={self.decisions} "
+                  f"misses={self.deadline_misses} mean={self.histograms['total'].to_dict()['mean_ms']:.3f}ms")
+
+    async def run(self):
+        self.env.reset()
+        self.running = True
+        reporter = asyncio.create_task(self._report_periodically())
+
+        loop = asyncio.get_running_loop()
+        wall_start = loop.time()
+        next_decision = 0.0
+
+        try:
+            # a demand stream still has vehicles to inject when the network is empty
+            while self.env._traffic_left() and libsumo.simulation.getTime() < self.env.episode_duration:
+                self.env._simulation_step()
+                if self.env.gridlock is not None and self.env.gridlock.gridlocked:
+                    self.env._log_gridlock("controller")
+                    break
+                self.controller.tick()
+                sim_time = libsumo.simulation.getTime()
+
+                if sim_time >= next_decision:
+                    self._decide()
+                    next_decision += self.controller.decision_interval
+
+                if self.speedup > 0:
+                    # pace the simulation clock against the wall clock
+                    delay = wall_start + sim_time / self.speedup - loop.time()
+                    if delay < 0:
+                        self.max_clock_lag_ms = max(self.max_clock_lag_ms, -delay * 1000)
+                    await asyncio.sleep(max(delay, 0))
+                else:
+                    await asyncio.sleep(0)
+        finally:
+            self.running = False
+            reporter.cancel()
+            self.write_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time traffic signal controller service")
+    parser.add_argument("--policy", type=str, required=False, help="Actor exported with policy_export.py (.npz)")
+    parser.add_argument("--stl", type=int, nargs="*", required=False, help="Use the STL controller with the given enhancements")
+    parser.add_argument("--episode", type=int, default=64578, help="Episode ID simulated by the local SUMO instance")
+    parser.add_argument("--obs-stack", type=int, default=1, help="Stacked frames expected by the policy")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Simulated seconds per wall second (0 = as fast as possible)")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Latency budget of one decision")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between metrics exports")
+    parser.add_argument("--metrics", type=str, default=os.path.join("logs", "controller", "controller_metrics.json"), help="Metrics output file")
+    args = parser.parse_args()
+
+    if (args.policy is None) == (args.stl is None):
+        parser.error("exactly one of --policy and --stl is required")
+
+    log_dir = os.path.dirname(args.metrics) or "."
+    os.makedirs(log_dir, exist_ok=True)
+
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=log_dir,
+                  rank="controller",
+                  episode_list=[args.episode],
+                  obs_stack=args.obs_stack)
+
+    if args.policy is not None:
+        policy = NumpyPolicy.load(args.policy)
+        if policy.obs_dim != env.observation_space.shape[0]:
+            parser.error(f"policy expects {policy.obs_dim} inputs, env produces {env.observation_space.shape[0]}")
+        controller = PolicyController(env, policy)
+    else:
+        controller = SmartTrafficLightController(env, args.stl)
+
+    service = ControllerService(env, controller, args.speedup, args.budget_ms, args.metrics, args.report_every)
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        print("\nUser interruption.")
+    finally:
+        env.close()
+        print(json.dumps({k: v for k, v in service.metrics().items() if k != "latency"}, indent=2))
@@ -0,0 +1,118 @@
+import os
+import struct
+import hashlib
+
+# Decision traces: one binary file per controller run, holding a fixed-width record for every
+# decision. With the episode id and the run settings in the header the run can be replayed
+# from the trace alone (replay_trace.py), the footer closes it with a digest of the outcome.
+#
+#   header  magic, version, controller, STL enhancements, flags, episode id,
+#           sim step, base sim step, action step, episode duration, reward scale,
+#           sim config name, fidelity, demand profile (empty: one scenario per episode),
+#           injection window, observation source
+#   record  time, phase before the decision, action, reward, waiting time, CO2,
+#           max waiting time, starvation penalty
+#           RL: action is the env action (duration mode: phase + 2 * duration index).
+#           STL: action is the phase set by the TrafficLight and the reward terms are 0.
+#   footer  magic, record count, end time, end reason, sha256 of the records and outcome
+
+MAGIC = b"RLTR"
+FOOTER_MAGIC = b"TEND"
+VERSION = 2 # 2: demand profile, injection window and observation source
+
+HEADER = struct.Struct("<4sHBBB3xIddddd32s16s16sd16s")
+RECORD = struct.Struct("<dBBddddd")
+FOOTER = struct.Struct("<4sIdB3x32s")
+
+CONTROLLERS = ["rl", "stl"]
+END_REASONS = ["terminated", "truncated", "gridlock", "aborted"]
+
+FLAG_MEASURES = 1
+FLAG_GRIDLOCK_DETECTION = 2
+FLAG_DURATION_ACTIONS = 4
+
+
+def enhancements_mask(enhancements):
+    mask = 0
+    for e in enhancements:
+        mask |= 1 << (e - 1)
+    return mask
+
+
+def enhancements_list(mask):
+    return [e for e in (1, 2) if mask & (1 << (e - 1))]
+
+
+class DecisionTraceWriter:
+    def __init__(self, path, controller, episode_id, sim_step, base_sim_step, action_step, episode_duration,
+                 reward_scale, config_name, fidelity, enhancements=[], measures=False, gridlock_detection=False, duration_actions=False,
+                 demand_profile=None, injection_window=60, obs_source="dtse"):
+        flags = ((FLAG_MEASURES if measures else 0) | (FLAG_GRIDLOCK_DETECTION if gridlock_detection else 0)
+                 | (FLAG_DURATION_ACTIONS if duration_actions else 0))
+        self.path = path
+        self.n_records = 0
+        self.digest = hashlib.sha256()
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, CONTROLLERS.index(controller), enhancements_mask(enhancements), flags,
+                                    episode_id, sim_step, base_sim_step, action_step, episode_duration, reward_scale,
+                                    config_name.encode(), fidelity.encode(), (demand_profile or "").encode(), injection_window,
+                                    obs_source.encode()))
+
+    def record(self, time, phase, action, reward=0.0, waiting_time=0.0, co2=0.0, max_waiting_time=0.0, penalty=0.0):
+        data = RECORD.pack(time, phase, action, reward, waiting_time, co2, max_waiting_time, penalty)
+        self.digest.update(data)
+        self.file.write(data)
+        self.n_records += 1
+
+    def close(self, end_time, reason, outcome=b""):
+        # outcome: extra bytes describing the end state (e.g. the vehicle measures)
+        self.digest.update(struct.pack("<d", end_time))
+        self.digest.update(outcome)
+        self.file.write(FOOTER.pack(FOOTER_MAGIC, self.n_records, end_time, END_REASONS.index(reason), self.digest.digest()))
+        self.file.close()
+
+
+def read_trace(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    (magic, version, controller, mask, flags, episode_id, sim_step, base_sim_step, action_step,
+     episode_duration, reward_scale, config_name, fidelity, demand_profile, injection_window, obs_source) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a decision trace")
+    if version != VERSION:
+        raise ValueError(f"{path}: unsupported trace version {version}, record it again")
+    header = {
+        "controller": CONTROLLERS[controller],
+        "enhancements": enhancements_list(mask),
+        "measures": bool(flags & FLAG_MEASURES),
+        "gridlock_detection": bool(flags & FLAG_GRIDLOCK_DETECTION),
+        "duration_actions": bool(flags & FLAG_DURATION_ACTIONS),
+        "episode_id": episode_id,
+        "sim_step": sim_step,
+        "base_sim_step": base_sim_step,
+        "action_step": action_step,
+        "episode_duration": episode_duration,
+        "reward_scale": reward_scale,
+        "config_name": config_name.rstrip(b"\0").decode(),
+        "fidelity": fidelity.rstrip(b"\0").decode(),
+        "demand_profile": demand_profile.rstrip(b"\0").decode() or None,
+        "injection_window": injection_window,
+        "obs_source": obs_source.rstrip(b"\0").decode(),
+    }
+
+    body = data[HEADER.size:]
+    footer = None
+    if len(body) >= FOOTER.size and body[-FOOTER.size:-FOOTER.size + 4] == FOOTER_MAGIC:
+        magic, n_records, end_time, reason, digest = FOOTER.unpack(body[-FOOTER.size:])
+        footer = {"n_records": n_records, "end_time": end_time, "reason": END_REASONS[reason], "digest": digest.hex()}
+        body = body[:-FOOTER.size]
+    # a trace without footer comes from a run that did not end (crash, kill): records are kept
+    body = body[:len(body) - len(body) % RECORD.size]
+    records = list(RECORD.iter_unpack(body))
+    return header, records, footer
+
+
+def trace_path(folder, episode_id, controller, enhancements=[]):
+    name = controller + "".join(map(str, enhancements))
+    return os.path.join(folder, f"ep{episode_id}_{name}.trace")
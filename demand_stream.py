@@ -0,0 +1,115 @@
+import random
+import numpy as np
+from traffic_generator import TrafficGenerator, Scenario
+from vehicle_generator import *
+
+# Streaming demand for long-horizon episodes. The day is a sequence of one hour segments, each
+# with the demand shape of a Scenario. Vehicles are yielded in departure order and only one
+# segment at a time is built, so memory does not grow with the episode length.
+# Every segment reseeds the global RNGs from (episode id, segment), like TrafficGenerator does
+# per episode: the stream of an episode is the same however it is consumed.
+
+SEGMENT_LENGTH = 3600  # s
+SHAPE_LENGTH = 3300    # departure window of the one hour Scenario shapes
+
+DEMAND_PROFILES = {
+    # working day: quiet night, morning rush on the main road, evening wave
+    "day": ([Scenario.LOW] * 6 + [Scenario.MEDIUM, Scenario.UNBALANCED, Scenario.UNBALANCED, Scenario.MEDIUM]
+            + [Scenario.MEDIUM] * 6 + [Scenario.HIGH, Scenario.WAVE, Scenario.HIGH, Scenario.MEDIUM]
+            + [Scenario.MEDIUM, Scenario.LOW, Scenario.LOW, Scenario.LOW]),
+    # segments drawn with the scenario probabilities of TrafficGenerator
+    "random_6h": [None] * 6,
+    "random_24h": [None] * 24,
+}
+
+
+def segment_seed(episode_index, segment):
+    return int(np.random.SeedSequence([episode_index, segment]).generate_state(1)[0])
+
+
+class DemandStream:
+    def __init__(self, traffic_gen: TrafficGenerator, episode_index, profile="day"):
+        self.traffic_gen = traffic_gen
+        self.episode_index = episode_index
+        self.segments = DEMAND_PROFILES[profile]
+        self.duration = len(self.segments) * SEGMENT_LENGTH
+        self.scenarios = []
+        self.vehicle_count = 0
+        self._iterator = self._vehicles()
+        self._next = next(self._iterator, None)
+
+    def _segment_vehicles(self, k):
+        random.seed(segment_seed(self.episode_index, k))
+        np.random.seed(segment_seed(self.episode_index, k))
+
+        scenario = self.segments[k]
+        if scenario is None:
+            scenario = random.choices(list(self.traffic_gen.scenario_probs), weights=list(self.traffic_gen.scenario_probs.values()), k=1)[0]
+        self.scenarios.append(scenario)
+
+        n_vehicles = self.traffic_gen._get_vehicle_count(scenario)
+        departs = self.traffic_gen._get_depart_times(n_vehicles, scenario)
+        if k < len(self.segments) - 1:
+            # the drain buffer of the shapes is kept only at the end of the day
+            departs = np.round(departs * (SEGMENT_LENGTH / SHAPE_LENGTH) / self.traffic_gen.simulation_step) * self.traffic_gen.simulation_step
+        departs = departs + k * SEGMENT_LENGTH
+        routes = self.traffic_gen._get_routes(n_vehicles, scenario)
+
+        v_types = list(self.traffic_gen.vehicle_distribution.keys())
+        v_probs = np.array(list(self.traffic_gen.vehicle_distribution.values()))
+        v_probs = v_probs / v_probs.sum()
+        random_vtype_strings = np.random.choice(v_types, size=n_vehicles, p=v_probs)
+
+        vehicles = []
+        for i, vtype_str in enumerate(random_vtype_strings):
+            new_vehicle = eval(vtype_str).generateRandom("vehicle" + str(self.vehicle_count + i))
+            new_vehicle.depart = departs[i]
+            new_vehicle.routeID = routes[i]
+            new_vehicle.departLane = "free"
+            vehicles.append(new_vehicle)
+        self.vehicle_count += n_vehicles
+
+        vehicles.sort(key=lambda v: v.depart)
+        return vehicles
+
+    def _vehicles(self):
+        for k in range(len(self.segments)):
+            yield from self._segment_vehicles(k)
+
+    def take_until(self, time):
+        # vehicles departing before time, in departure order
+        vehicles = []
+        while self._next is not None and self._next.depart < time:
+            vehicles.append(self._next)
+            self._next = next(self._iterator, None)
+        return vehicles
+
+    @property
+    def exhausted(self):
+        return self._next is None
+
+
+if __name__ == "__main__":
+    import argparse
+    import tracemalloc
+    from sim_config import CONFIG_4WAY_160M
+
+    parser = argparse.ArgumentParser(description="Generate a demand stream without SUMO and report its memory use")
+    parser.add_argument("--profile", type=str, choices=list(DEMAND_PROFILES), default="day")
+    parser.add_argument("--episode", type=int, default=1)
+    parser.add_argument("--window", type=float, default=60, help="Injection window (s)")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    stream = DemandStream(TrafficGenerator(CONFIG_4WAY_160M, 0.5), args.episode, args.profile)
+    max_window = 0
+    t = 0.0
+    while not stream.exhausted:
+        max_window = max(max_window, len(stream.take_until(t + args.window)))
+        t += args.window
+    current, peak = tracemalloc.get_traced_memory()
+
+    print(f"Profile {args.profile}: {stream.vehicle_count} vehicles in {stream.duration / 3600:.0f} h")
+    print(f"Scenarios: {', '.join(s.value for s in stream.scenarios)}")
+    print(f"Max vehicles in a {args.window:.0f} s window: {max_window}")
+    print(f"Peak Python memory: {peak / 2**20:.1f} MiB")
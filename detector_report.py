@@ -0,0 +1,95 @@
+import os
+import csv
+import time
+import argparse
+import numpy as np
+from stable_baselines3 import PPO
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from episode_sets import EPISODE_TEST_IDS
+from evaluation import run_policy_episode, KPI_KEYS
+
+# DTSE against detector observations:
+#  cost     seconds per env step (observation + reward) with a fixed alternating policy,
+#           measures off, so only the observation source differs
+#  quality  KPIs of the models trained on each source, on the test episodes
+
+LOG_DIR = os.path.join("logs", "detector_report")
+
+
+def make_env(obs_source, episodes, enable_measure):
+    return SumoEnv(sim_config=CONFIG_4WAY_160M,
+                   sim_step=0.5,
+                   action_step=10,
+                   episode_duration=3600,
+                   log_folder=LOG_DIR,
+                   rank=f"detectors_{obs_source}",
+                   episode_list=episodes,
+                   enable_measure=enable_measure,
+                   obs_source=obs_source)
+
+
+def step_cost(obs_source, episodes):
+    env = make_env(obs_source, episodes, enable_measure=False)
+    steps = 0
+    elapsed = 0.0
+    try:
+        for _ in episodes:
+            env.reset()
+            done = truncated = False
+            action = 0
+            while not (done or truncated):
+                start = time.perf_counter()
+                _, _, done, truncated, _ = env.step(action)
+                elapsed += time.perf_counter() - start
+                steps += 1
+                action = 1 - action
+    finally:
+        env.close()
+    return elapsed / steps
+
+
+def evaluate(train_id, obs_source, episodes):
+    model = PPO.load(os.path.join("models", "ppo", f"train_id_{train_id}", f"PPO_{train_id}.zip"))
+    env = make_env(obs_source, episodes, enable_measure=True)
+    try:
+        results = [run_policy_episode(env, lambda obs: model.predict(obs, deterministic=True)[0]) for _ in episodes]
+    finally:
+        env.close()
+    return {key: float(np.mean([r[key] for r in results])) for key in ["wall_time", "decisions"] + KPI_KEYS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost and policy quality of the DTSE and detector observation sources")
+    parser.add_argument("--dtse-ids", type=int, nargs="*", default=[], help="Training IDs of models trained on DTSE")
+    parser.add_argument("--detector-ids", type=int, nargs="*", default=[], help="Training IDs of models trained on detectors")
+    parser.add_argument("--episodes", type=int, nargs="+", default=EPISODE_TEST_IDS, help="Episode IDs (default: test episodes)")
+    parser.add_argument("--cost-episodes", type=int, default=2, help="Episodes of the cost measurement")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    print("--- Cost per env step ---")
+    costs = {source: step_cost(source, args.episodes[:args.cost_episodes]) for source in ["dtse", "detectors"]}
+    for source, cost in costs.items():
+        print(f"{source:>10}: {cost * 1000:.2f} ms/step ({costs['dtse'] / cost:.2f}x)")
+
+    rows = []
+    for obs_source, ids in [("dtse", args.dtse_ids), ("detectors", args.detector_ids)]:
+        for train_id in ids:
+            row = {"model": f"PPO_{train_id}", "obs_source": obs_source, "step_ms": costs[obs_source] * 1000}
+            row.update(evaluate(train_id, obs_source, args.episodes))
+            rows.append(row)
+
+    if rows:
+        report_file = os.path.join(LOG_DIR, "detector_report.csv")
+        with open(report_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+        print(f"{'model':>10} {'source':>10} {'time (s)':>9} {'travel':>8} {'waiting':>8} {'CO2 (mg)':>10}")
+        for row in rows:
+            print(f"{row['model']:>10} {row['obs_source']:>10} {row['wall_time']:>9.1f} {row['totalTravelTime']:>8.1f} "
+                  f"{row['totalWaitingTime']:>8.1f} {row['totalCO2Emissions']:>10.0f}")
+        print(f"Report saved in {report_file}")
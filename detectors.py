@@ -0,0 +1,129 @@
+import os
+import numpy as np
+from collections import deque
+import xml.etree.ElementTree as ET
+from lazy_imports import lazy_import
+
+libsumo = lazy_import("libsumo")
+
+# Detector observation source of SumoEnv (obs_source="detectors"). The workspace copy of the
+# additional file keeps the induction loops of the template (their output goes to os.devnull:
+# file="NUL" creates a real file outside Windows) and gets a lane-area (E2) detector over the
+# observed length of every observed lane. The values are read through libsumo subscriptions,
+# so a step costs O(detectors) whatever the number of vehicles.
+#
+#   E2 (per observed lane)  queue, vehicles, occupancy, jam length, mean speed
+#   E1 (per loop)           vehicles passed in the last step, occupancy
+#
+# The reward needs the waiting time of the halted vehicles. Every lane keeps the halting start
+# times of its queue: a rise of the E2 halting count adds vehicles at the tail, a drop removes
+# them from the head (the queue leaves the stop line first), so the waiting time of the queue
+# and its longest wait follow getWaitingTime of the vehicles on the observed lanes.
+
+VEHICLE_SPACE = 7.5 # m of lane per queued vehicle, to normalize counts
+E2_FEATURES = 5
+E1_FEATURES = 2
+
+
+def template_loops(sim_config):
+    add_path = os.path.join(sim_config.template_dir, sim_config.name, sim_config.add_file)
+    return [e.get("id") for e in ET.parse(add_path).getroot().iter("inductionLoop")]
+
+
+def detector_obs_size(sim_config):
+    return len(sim_config.obs_lanes) * E2_FEATURES + len(template_loops(sim_config)) * E1_FEATURES
+
+
+def e2_id(lane_id):
+    return f"E2_{lane_id}"
+
+
+def write_detector_additional(sim_config, workspace_path, lane_area=True):
+    # rewrites the workspace additional file, a hardlink of the template: written aside and renamed
+    net_dir = os.path.join(workspace_path, sim_config.name)
+    add_path = os.path.join(net_dir, sim_config.add_file)
+    root = ET.parse(add_path).getroot()
+    for loop in root.iter("inductionLoop"):
+        loop.set("file", os.devnull)
+
+    if lane_area:
+        net = ET.parse(os.path.join(net_dir, sim_config.net_file)).getroot()
+        lane_lengths = {lane.get("id"): float(lane.get("length")) for lane in net.iter("lane")}
+        for lane_id in sim_config.obs_lanes:
+            # the last lane_length meters before the stop line, as the DTSE grid
+            length = lane_lengths[lane_id]
+            ET.SubElement(root, "laneAreaDetector", id=e2_id(lane_id), lane=lane_id,
+                          pos=f"{max(0.0, length - sim_config.lane_length):.2f}", endPos=f"{length:.2f}",
+                          period="86400", file=os.devnull)
+
+    tmp_path = add_path + ".tmp"
+    ET.indent(root)
+    ET.ElementTree(root).write(tmp_path, encoding="UTF-8", xml_declaration=True)
+    os.replace(tmp_path, add_path)
+
+
+class DetectorObserver:
+    def __init__(self, sim_config):
+        self.sim_config = sim_config
+        self.lanes = list(sim_config.obs_lanes)
+        self.loops = template_loops(sim_config)
+        self.capacity = sim_config.lane_length / VEHICLE_SPACE
+        self.obs_size = len(self.lanes) * E2_FEATURES + len(self.loops) * E1_FEATURES
+
+    def subscribe(self):
+        # after every SUMO start
+        c = libsumo.constants
+        self.e2_vars = [c.LAST_STEP_VEHICLE_HALTING_NUMBER, c.LAST_STEP_VEHICLE_NUMBER, c.LAST_STEP_OCCUPANCY,
+                        c.JAM_LENGTH_METERS, c.LAST_STEP_MEAN_SPEED]
+        self.e1_vars = [c.LAST_STEP_VEHICLE_NUMBER, c.LAST_STEP_OCCUPANCY]
+        for lane_id in self.lanes:
+            libsumo.lanearea.subscribe(e2_id(lane_id), self.e2_vars)
+        for loop_id in self.loops:
+            libsumo.inductionloop.subscribe(loop_id, self.e1_vars)
+        self.max_speed = {lane_id: libsumo.lane.getMaxSpeed(lane_id) for lane_id in self.lanes}
+        self.halted_since = {lane_id: deque() for lane_id in self.lanes}
+        self.halted_sum = {lane_id: 0.0 for lane_id in self.lanes}
+
+    def waiting(self, now, delta_t):
+        # total and max waiting time (s) of the halted vehicles on the observed lanes
+        results = libsumo.lanearea.getAllSubscriptionResults()
+        halting = self.e2_vars[0]
+        total = 0.0
+        max_waiting = 0.0
+        for lane_id in self.lanes:
+            queue = self.halted_since[lane_id]
+            n = int(results[e2_id(lane_id)][halting])
+            while len(queue) < n:
+                # halted during the last step, as getWaitingTime counts it
+                queue.append(now - delta_t)
+                self.halted_sum[lane_id] += now - delta_t
+            while len(queue) > n:
+                self.halted_sum[lane_id] -= queue.popleft()
+            if queue:
+                total += len(queue) * now - self.halted_sum[lane_id]
+                max_waiting = max(max_waiting, now - queue[0])
+        return total, max_waiting
+
+    def observe(self, out):
+        e2_results = libsumo.lanearea.getAllSubscriptionResults()
+        e1_results = libsumo.inductionloop.getAllSubscriptionResults()
+        halting, vehicles, occupancy, jam, speed = self.e2_vars
+
+        e2 = out[:len(self.lanes) * E2_FEATURES].reshape(len(self.lanes), E2_FEATURES)
+        for i, lane_id in enumerate(self.lanes):
+            r = e2_results[e2_id(lane_id)]
+            e2[i, 0] = min(1.0, r[halting] / self.capacity)
+            e2[i, 1] = min(1.0, r[vehicles] / self.capacity)
+            e2[i, 2] = r[occupancy] / 100.0
+            e2[i, 3] = min(1.0, r[jam] / self.sim_config.lane_length)
+            # -1 when the detector is empty, like an empty DTSE cell
+            e2[i, 4] = r[speed] / self.max_speed[lane_id] if r[vehicles] > 0 else -1.0
+
+        e1 = out[len(self.lanes) * E2_FEATURES:self.obs_size].reshape(len(self.loops), E1_FEATURES)
+        loop_vehicles, loop_occupancy = self.e1_vars
+        for i, loop_id in enumerate(self.loops):
+            r = e1_results[loop_id]
+            e1[i, 0] = min(1.0, r[loop_vehicles])
+            e1[i, 1] = r[loop_occupancy] / 100.0
+        np.clip(out[:self.obs_size], -1.0, 1.0, out=out[:self.obs_size])
+        return out
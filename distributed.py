@@ -0,0 +1,392 @@
+import io
+import os
+import sys
+import time
+import queue
+import socket
+import argparse
+import threading
+import subprocess
+import numpy as np
+import torch
+from gymnasium import spaces
+from multiprocessing.connection import Listener, Client
+from stable_baselines3 import PPO
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.logger import configure
+from stable_baselines3.common.policies import ActorCriticPolicy
+from stable_baselines3.common.utils import obs_as_tensor
+from stable_baselines3.common.vec_env import VecMonitor
+from fast_vec_env import FastSubprocVecEnv
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from train import setup_run_directories, TIMESTEPS
+from episode_sets import actor_offset, check_actor_ids
+
+# Multi-node rollout collection. Remote actor processes run a set of SumoEnv instances with
+# the latest policy weights and stream trajectory chunks (GAE already computed) over TCP to
+# a central learner, which runs the PPO updates and broadcasts the new weights.
+
+# multiprocessing.connection unpickles what it receives: whoever knows the key can run code on
+# the learner. The default key only protects a learner bound to the loopback interface.
+AUTHKEY_VAR = "RLTSC_AUTHKEY"
+AUTHKEY = os.environ.get(AUTHKEY_VAR, "rl-tsc").encode()
+LOCAL_ADDRESSES = ["127.0.0.1", "localhost", "::1"]
+BUFFER_FIELDS = ["observations", "actions", "rewards", "returns", "episode_starts", "values", "log_probs", "advantages"]
+
+ACTOR_TIMEOUT = 600 # seconds without any connected actor after which the learner gives up
+
+ENV_KWARGS = {
+    "sim_step": 0.5,
+    "action_step": 10,
+    "episode_duration": 3600,
+}
+
+
+def _serialize_weights(policy):
+    buffer = io.BytesIO()
+    torch.save(policy.state_dict(), buffer)
+    return buffer.getvalue()
+
+
+def _deserialize_weights(policy, data):
+    policy.load_state_dict(torch.load(io.BytesIO(data), map_location="cpu"))
+
+
+# ------------------------------------------------------------------ actor
+
+def make_actor_env(rank, episode_offset, log_dir, env_kwargs):
+    def _init():
+        env = SumoEnv(sim_config=CONFIG_4WAY_160M, log_folder=log_dir, rank=rank, episode_offset=episode_offset, prefetch=True, **env_kwargs)
+        return env
+    return _init
+
+
+class RolloutActor:
+    def __init__(self, host, port, num_envs):
+        self.conn = Client((host, port), authkey=AUTHKEY)
+        self.conn.send(("hello", {"num_envs": num_envs, "host": socket.gethostname()}))
+
+        _, config = self.conn.recv()
+        self.actor_id = config["actor_id"]
+        self.n_steps = config["n_steps"]
+        self.gamma = config["gamma"]
+        self.gae_lambda = config["gae_lambda"]
+        os.makedirs(config["log_dir"], exist_ok=True)
+
+        env_fns = [make_actor_env(f"actor{self.actor_id}_{i}", offset, config["log_dir"], config["env_kwargs"])
+                   for i, offset in enumerate(config["episode_offsets"])]
+        self.envs = VecMonitor(FastSubprocVecEnv(env_fns))
+        self.policy = ActorCriticPolicy(self.envs.observation_space, self.envs.action_space, lambda _: 0.0, **config["policy_kwargs"])
+        self.policy.set_training_mode(False)
+        self.version = None
+
+        print(f"[Actor {self.actor_id}] {num_envs} envs, episode offsets {config['episode_offsets']}")
+
+    def _handle_message(self, message):
+        if message[0] == "weights":
+            _, self.version, data = message
+            _deserialize_weights(self.policy, data)
+            return True
+        return message[0] != "stop"
+
+    def _collect(self, last_obs, last_episode_starts):
+        buffer = RolloutBuffer(self.n_steps, self.envs.observation_space, self.envs.action_space, device="cpu",
+                               gamma=self.gamma, gae_lambda=self.gae_lambda, n_envs=self.envs.num_envs)
+        finished = []
+
+        # same bookkeeping as OnPolicyAlgorithm.collect_rollouts
+        for _ in range(self.n_steps):
+            with torch.no_grad():
+                actions, values, log_probs = self.policy(obs_as_tensor(last_obs, "cpu"))
+            actions = actions.cpu().numpy()
+
+            new_obs, rewards, dones, infos = self.envs.step(actions)
+
+            for idx, done in enumerate(dones):
+                if "episode" in infos[idx]:
+                    finished.append(infos[idx]["episode"]["r"])
+                if done and infos[idx].get("terminal_observation") is not None and infos[idx].get("TimeLimit.truncated", False):
+                    terminal_obs = self.policy.obs_to_tensor(infos[idx]["terminal_observation"])[0]
+                    with torch.no_grad():
+                        terminal_value = self.policy.predict_values(terminal_obs)[0]
+                    rewards[idx] += self.gamma * terminal_value.item()
+
+            if isinstance(self.envs.action_space, spaces.Discrete):
+                actions = actions.reshape(-1, 1)
+
+            buffer.add(last_obs, actions, rewards, last_episode_starts, values, log_probs)
+            last_obs = new_obs
+            last_episode_starts = dones
+
+        with torch.no_grad():
+            last_values = self.policy.predict_values(obs_as_tensor(last_obs, "cpu"))
+        buffer.compute_returns_and_advantage(last_values=last_values, dones=last_episode_starts)
+
+        chunk = {field: getattr(buffer, field) for field in BUFFER_FIELDS}
+        return chunk, finished, last_obs, last_episode_starts
+
+    def run(self):
+        # wait for the first weights
+        running = self._handle_message(self.conn.recv())
+        last_obs = self.envs.reset()
+        last_episode_starts = np.ones((self.envs.num_envs,), dtype=bool)
+
+        try:
+            while running:
+                start = time.perf_counter()
+                version = self.version
+                chunk, finished, last_obs, last_episode_starts = self._collect(last_obs, last_episode_starts)
+                stats = {"env_steps": self.n_steps * self.envs.num_envs, "collect_time": time.perf_counter() - start, "episode_rewards": finished}
+                self.conn.send(("chunk", version, chunk, stats))
+
+                while running and self.conn.poll():
+                    running = self._handle_message(self.conn.recv())
+        except (EOFError, ConnectionError):
+            print(f"[Actor {self.actor_id}] Learner disconnected")
+        finally:
+            self.envs.close()
+            self.conn.close()
+
+
+# ------------------------------------------------------------------ learner
+
+class ActorConnection:
+    def __init__(self, actor_id, conn, num_envs):
+        self.actor_id = actor_id
+        self.conn = conn
+        self.num_envs = num_envs
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.conn.send(message)
+
+
+class DistributedLearner:
+    def __init__(self, port, chunks_per_update, n_steps, log_dir, models_dir, max_episodes, max_updates=None, bind="127.0.0.1",
+                 actor_timeout=ACTOR_TIMEOUT):
+        if bind not in LOCAL_ADDRESSES and AUTHKEY_VAR not in os.environ:
+            raise ValueError(f"Binding the learner to {bind} needs a secret key in {AUTHKEY_VAR}")
+        self.chunks_per_update = chunks_per_update
+        self.n_steps = n_steps
+        self.log_dir = log_dir
+        self.models_dir = models_dir
+        self.max_episodes = max_episodes
+        self.max_updates = max_updates
+        self.actor_timeout = actor_timeout
+
+        # this env only provides the spaces, it is never reset
+        spec_env = SumoEnv(sim_config=CONFIG_4WAY_160M, log_folder=log_dir, rank="learner", **ENV_KWARGS)
+        self.model = PPO("MlpPolicy", spec_env, n_steps=n_steps, device="auto")
+        self.model.set_logger(configure(log_dir, ["stdout", "csv", "tensorboard"]))
+
+        self.listener = Listener((bind, port), authkey=AUTHKEY)
+        self.actors = {}
+        self.actors_lock = threading.Lock()
+        self.chunks = queue.Queue()
+        self.next_actor_id = 0
+        self.next_episode_block = 0
+        self.no_actors_since = time.perf_counter()
+        self.version = 0
+        self.episodes_done = 0
+        self.throughput = []
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_actor, args=(conn,), daemon=True).start()
+
+    def _register_actor(self, conn, hello):
+        with self.actors_lock:
+            actor_id = self.next_actor_id
+            self.next_actor_id += 1
+            # blocks are never reused, so episode ids stay disjoint across actors and reconnects
+            first_block = self.next_episode_block
+            check_actor_ids(first_block, hello["num_envs"])
+            self.next_episode_block += hello["num_envs"]
+
+            actor = ActorConnection(actor_id, conn, hello["num_envs"])
+            self.actors[actor_id] = actor
+            self.no_actors_since = None
+
+        offsets = [actor_offset(first_block + i) for i in range(hello["num_envs"])]
+        actor.send(("config", {
+            "actor_id": actor_id,
+            "episode_offsets": offsets,
+            "env_kwargs": ENV_KWARGS,
+            "log_dir": self.log_dir,
+            "n_steps": self.n_steps,
+            "gamma": self.model.gamma,
+            "gae_lambda": self.model.gae_lambda,
+            "policy_kwargs": self.model.policy_kwargs,
+        }))
+        actor.send(("weights", self.version, _serialize_weights(self.model.policy)))
+        print(f"[Learner] Actor {actor_id} connected from {hello['host']} with {hello['num_envs']} envs")
+        return actor
+
+    def _serve_actor(self, conn):
+        actor = None
+        try:
+            message = conn.recv()
+            actor = self._register_actor(conn, message[1])
+            while True:
+                message = conn.recv()
+                if message[0] == "chunk":
+                    self.chunks.put((actor.actor_id,) + message[1:])
+        except (EOFError, ConnectionError, OSError):
+            pass
+        finally:
+            if actor is not None:
+                with self.actors_lock:
+                    self.actors.pop(actor.actor_id, None)
+                    if not self.actors:
+                        self.no_actors_since = time.perf_counter()
+                print(f"[Learner] Actor {actor.actor_id} disconnected")
+            conn.close()
+
+    def _broadcast(self, message):
+        with self.actors_lock:
+            actors = list(self.actors.values())
+        for actor in actors:
+            try:
+                actor.send(message)
+            except (EOFError, ConnectionError, OSError):
+                pass # removed by its serving thread
+
+    def _gather_chunks(self):
+        gathered, stats = [], []
+        while len(gathered) < self.chunks_per_update:
+            try:
+                actor_id, version, chunk, chunk_stats = self.chunks.get(timeout=5)
+            except queue.Empty:
+                with self.actors_lock:
+                    idle = None if self.no_actors_since is None else time.perf_counter() - self.no_actors_since
+                if idle is not None and idle > self.actor_timeout:
+                    raise RuntimeError(f"No actor connected for {idle:.0f} s, stopping the learner") from None
+                continue
+            if version != self.version:
+                continue # stale: collected with older weights
+            gathered.append(chunk)
+            stats.append(chunk_stats)
+        return gathered, stats
+
+    def _train_on(self, gathered):
+        n_envs = sum(chunk["rewards"].shape[1] for chunk in gathered)
+        buffer = RolloutBuffer(self.n_steps, self.model.observation_space, self.model.action_space, device=self.model.device,
+                               gamma=self.model.gamma, gae_lambda=self.model.gae_lambda, n_envs=n_envs)
+        for field in BUFFER_FIELDS:
+            setattr(buffer, field, np.concatenate([chunk[field] for chunk in gathered], axis=1))
+        buffer.pos = self.n_steps
+        buffer.full = True
+
+        self.model.rollout_buffer = buffer
+        self.model.num_timesteps += self.n_steps * n_envs
+        self.model._update_current_progress_remaining(self.model.num_timesteps, TIMESTEPS)
+        self.model.train()
+
+    def run(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"[Learner] Listening on {self.listener.address}, {self.chunks_per_update} chunks per update")
+
+        try:
+            return self._run()
+        finally:
+            self._broadcast(("stop",))
+            self.listener.close()
+            self.model.save(os.path.join(self.models_dir, "PPO_distributed"))
+
+    def _run(self):
+        updates = 0
+        round_start = time.perf_counter()
+        while self.episodes_done < self.max_episodes and (self.max_updates is None or updates < self.max_updates):
+            gathered, stats = self._gather_chunks()
+            collected = time.perf_counter()
+            self._train_on(gathered)
+
+            self.version += 1
+            self._broadcast(("weights", self.version, _serialize_weights(self.model.policy)))
+            updates += 1
+
+            env_steps = sum(s["env_steps"] for s in stats)
+            rewards = [r for s in stats for r in s["episode_rewards"]]
+            self.episodes_done += len(rewards)
+            elapsed = time.perf_counter() - round_start
+            round_start = time.perf_counter()
+
+            with self.actors_lock:
+                num_actors = len(self.actors)
+            self.throughput.append((num_actors, env_steps / elapsed))
+
+            self.model.logger.record("distributed/actors", num_actors)
+            self.model.logger.record("distributed/env_steps_per_sec", env_steps / elapsed)
+            self.model.logger.record("distributed/update_time", time.perf_counter() - collected)
+            self.model.logger.record("distributed/episodes", self.episodes_done)
+            if rewards:
+                self.model.logger.record("rollout/ep_rew_mean", float(np.mean(rewards)))
+            self.model.logger.dump(step=self.model.num_timesteps)
+        return self.throughput
+
+
+# ------------------------------------------------------------------ scaling report
+
+def run_scaling(actor_counts, num_envs, updates, port, n_steps):
+    rows = []
+    for num_actors in actor_counts:
+        models_dir, log_dir, train_id = setup_run_directories()
+        learner = DistributedLearner(port, num_actors, n_steps, log_dir, models_dir, max_episodes=float("inf"), max_updates=updates)
+
+        actors = [subprocess.Popen([sys.executable, __file__, "actor", "--host", "127.0.0.1", "--port", str(port), "--num-envs", str(num_envs)])
+                  for _ in range(num_actors)]
+        try:
+            throughput = learner.run()
+        finally:
+            for actor in actors:
+                actor.wait(timeout=120)
+
+        # the first update includes the actors start-up
+        steady = [steps_per_sec for _, steps_per_sec in throughput[1:]] or [throughput[0][1]]
+        rows.append((num_actors, num_actors * num_envs, float(np.mean(steady))))
+        port += 1
+
+    print(f"{'actors':>7} {'envs':>6} {'env steps/s':>12} {'scaling':>8}")
+    for num_actors, total_envs, steps_per_sec in rows:
+        print(f"{num_actors:>7} {total_envs:>6} {steps_per_sec:>12.1f} {steps_per_sec / rows[0][2]:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed rollout collection with a central PPO learner")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    learner_parser = subparsers.add_parser("learner")
+    learner_parser.add_argument("--port", type=int, default=6000)
+    learner_parser.add_argument("--bind", type=str, default="127.0.0.1", help=f"Listening address; a non-local one (e.g. 0.0.0.0) needs {AUTHKEY_VAR}")
+    learner_parser.add_argument("--chunks-per-update", type=int, default=4, help="Trajectory chunks gathered for each PPO update")
+    learner_parser.add_argument("--n-steps", type=int, default=256, help="Steps per env in a chunk")
+    learner_parser.add_argument("--max-episodes", type=int, default=5000)
+    learner_parser.add_argument("--actor-timeout", type=float, default=ACTOR_TIMEOUT, help="Seconds without connected actors before the learner stops")
+
+    actor_parser = subparsers.add_parser("actor")
+    actor_parser.add_argument("--host", type=str, default="127.0.0.1")
+    actor_parser.add_argument("--port", type=int, default=6000)
+    actor_parser.add_argument("--num-envs", type=int, default=4)
+
+    scaling_parser = subparsers.add_parser("scaling")
+    scaling_parser.add_argument("--actors", type=int, nargs="+", default=[1, 2, 4])
+    scaling_parser.add_argument("--num-envs", type=int, default=2, help="Envs per actor")
+    scaling_parser.add_argument("--updates", type=int, default=5)
+    scaling_parser.add_argument("--n-steps", type=int, default=64)
+    scaling_parser.add_argument("--port", type=int, default=6100)
+
+    args = parser.parse_args()
+
+    if args.role == "learner":
+        models_dir, log_dir, train_id = setup_run_directories()
+        DistributedLearner(args.port, args.chunks_per_update, args.n_steps, log_dir, models_dir, args.max_episodes, bind=args.bind, actor_timeout=args.actor_timeout).run()
+    elif args.role == "actor":
+        RolloutActor(args.host, args.port, args.num_envs).run()
+    else:
+        run_scaling(args.actors, args.num_envs, args.updates, args.port, args.n_steps)
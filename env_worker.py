@@ -0,0 +1,82 @@
+import os
+import time
+import cloudpickle
+
+# Env worker of FastSubprocVecEnv. This module is what the worker process imports first, so it
+# must stay light: no stable-baselines3, no torch. The env factory arrives as cloudpickle bytes
+# and only pulls in the modules the env needs (already loaded when preloaded by the forkserver).
+# The command protocol is the one of the SB3 SubprocVecEnv worker.
+
+
+def _is_wrapped(env, wrapper_class):
+    while hasattr(env, "env"):
+        if isinstance(env, wrapper_class):
+            return True
+        env = env.env
+    return False
+
+
+def worker(remote, parent_remote, env_fn_bytes, launch_time):
+    started = time.time()
+    parent_remote.close()
+
+    env_fn = cloudpickle.loads(env_fn_bytes)
+    loaded = time.time()
+    env = env_fn()
+    created = time.time()
+
+    first_reset = getattr(env.unwrapped, "last_reset_time", None)
+    remote.send({
+        "pid": os.getpid(),
+        "spawn_s": started - launch_time,
+        "import_s": loaded - started,
+        "create_s": created - loaded - (first_reset or 0.0),
+        "first_reset_s": first_reset,
+        "ready_s": created - launch_time,
+        "episode_id": getattr(env.unwrapped, "episode_id", None),
+        "episode_count": getattr(env.unwrapped, "episode_count", None),
+    })
+
+    reset_info = {}
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                observation, reward, terminated, truncated, info = env.step(data)
+                done = terminated or truncated
+                info["TimeLimit.truncated"] = truncated and not terminated
+                if done:
+                    info["terminal_observation"] = observation
+                    observation, reset_info = env.reset()
+                remote.send((observation, reward, done, info, reset_info))
+            elif cmd == "reset":
+                maybe_options = {"options": data[1]} if data[1] else {}
+                observation, reset_info = env.reset(seed=data[0], **maybe_options)
+                remote.send((observation, reset_info))
+            elif cmd == "render":
+                remote.send(env.render())
+            elif cmd == "close":
+                env.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "env_method":
+                method = env.get_wrapper_attr(data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(env.get_wrapper_attr(data))
+            elif cmd == "has_attr":
+                try:
+                    env.get_wrapper_attr(data)
+                    remote.send(True)
+                except AttributeError:
+                    remote.send(False)
+            elif cmd == "set_attr":
+                remote.send(setattr(env.unwrapped, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(_is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
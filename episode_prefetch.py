@@ -0,0 +1,71 @@
+import os
+import sys
+import pickle
+import subprocess
+
+# Next-episode generation in a child process. The vehicle generation is pure Python and holds
+# the GIL: in a thread of the env process it runs interleaved with the libsumo step loop
+# instead of next to it, and the reset time it saves moves into step(). The child is a plain
+# subprocess because the env workers are daemonic multiprocessing processes, which cannot
+# start multiprocessing children. Requests and episodes travel pickled over its stdin/stdout;
+# the child exits when its stdin closes (env closed or env process gone). It has its own global
+# RNGs, so the generations never interleave with the ones of the env process.
+
+
+class EpisodePrefetcher:
+    def __init__(self, sim_config):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._send(sim_config)
+        self.pending = None  # (episode id, sim step) being generated
+
+    def _send(self, message):
+        pickle.dump(message, self.process.stdin)
+        self.process.stdin.flush()
+
+    def submit(self, episode_id, sim_step):
+        self._send((episode_id, sim_step))
+        self.pending = (episode_id, sim_step)
+
+    def result(self):
+        # (vehicle list, vehicle count, scenario, vtypes xml) of the pending request
+        self.pending = None
+        return pickle.load(self.process.stdout)
+
+    def close(self):
+        try:
+            # a reply still in flight is dropped: the child sees a broken pipe or the end of stdin
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+def _serve():
+    from traffic_generator import TrafficGenerator
+    from vehicle_generator import vehicle_types_xml
+
+    # the protocol owns the real stdout, prints of the generation go to stderr
+    requests = sys.stdin.buffer
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    traffic_gen = TrafficGenerator(pickle.load(requests), 0.5)
+    while True:
+        try:
+            episode_id, sim_step = pickle.load(requests)
+        except EOFError:
+            break
+        traffic_gen.simulation_step = sim_step
+        vehicle_list, vehicle_num, scenario = traffic_gen.generate_traffic(episode_id)
+        try:
+            pickle.dump((vehicle_list, vehicle_num, scenario, vehicle_types_xml(vehicle_list)), replies, protocol=pickle.HIGHEST_PROTOCOL)
+            replies.flush()
+        except BrokenPipeError:
+            # the env closed with this request in flight (shutdown, worker restart); no flush at exit,
+            # the rest of the reply is still buffered
+            os._exit(0)
+
+
+if __name__ == "__main__":
+    _serve()
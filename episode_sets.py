@@ -0,0 +1,80 @@
+# Episode ids used for evaluation, shared by the test and report scripts
+
+EPISODE_TEST_IDS = [64578, # Low 743
+                    64579, # Low 376
+                    64581, # Medium 1415
+                    64582, # Medium 1209
+                    64607, # High 1720
+                    64585, # High 2087
+                    64580, # Wave 1774
+                    64587, # Wave 2183
+                    64589, # Unbalanced 1902
+                    64598] # Unbalanced 2143
+
+# Model selection (hyperparameter sweeps): disjoint from the training ids and from the test
+# episodes
+EPISODE_VALIDATION_IDS = list(range(80001, 80007))
+
+# Large pool for the adaptive evaluation (adaptive_eval.py), stratified by scenario: disjoint
+# from the training, validation and test ids
+EPISODE_POOL_IDS = list(range(100001, 104001))
+
+EVALUATION_SETS = [("test", EPISODE_TEST_IDS), ("validation", EPISODE_VALIDATION_IDS), ("pool", EPISODE_POOL_IDS)]
+EVALUATION_IDS = set(EPISODE_TEST_IDS) | set(EPISODE_VALIDATION_IDS) | set(EPISODE_POOL_IDS)
+
+# Training ids of the train.py workers: rank r plays TRAINING_ID_BASE + r * TRAINING_IDS_PER_RANK + n.
+# The base is above every evaluation set, the span of a rank above any run length.
+TRAINING_ID_BASE = 1_000_000
+TRAINING_IDS_PER_RANK = 100_000
+
+# Offline STL dataset (offline_dataset.py record): episodes from DATASET_ID_BASE + 1, below
+# the training ids
+DATASET_ID_BASE = 500_000
+
+# Envs of the distributed actors (distributed.py): block b plays ACTOR_ID_BASE + b * ACTOR_IDS_PER_ENV + n,
+# above the training ids of up to 990 train.py workers
+ACTOR_ID_BASE = 100_000_000
+ACTOR_IDS_PER_ENV = 10_000
+
+# ranges owned by the episode producers, first and last id (the ids seed numpy: below 2**32)
+PRODUCER_RANGES = {
+    "dataset": (DATASET_ID_BASE + 1, TRAINING_ID_BASE - 1),
+    "training": (TRAINING_ID_BASE, ACTOR_ID_BASE - 1),
+    "actors": (ACTOR_ID_BASE, 2**32 - 1),
+}
+
+
+def training_offset(rank):
+    return TRAINING_ID_BASE + rank * TRAINING_IDS_PER_RANK
+
+
+def actor_offset(block):
+    return ACTOR_ID_BASE + block * ACTOR_IDS_PER_ENV
+
+
+def check_episode_range(first, last, owner):
+    # ids first-last of a producer must not reach the evaluation episodes nor another producer
+    for name, ids in EVALUATION_SETS:
+        if any(first <= episode_id <= last for episode_id in ids):
+            raise ValueError(f"{owner.capitalize()} ids {first}-{last} overlap the {name} episodes")
+    for name, (start, end) in PRODUCER_RANGES.items():
+        if name != owner and start <= last and first <= end:
+            raise ValueError(f"{owner.capitalize()} ids {first}-{last} overlap the {name} ids")
+
+
+def check_not_evaluation(episode_ids, owner):
+    # an explicit episode list (e.g. a catalog split) used for training
+    for name, ids in EVALUATION_SETS:
+        overlap = sorted(set(episode_ids) & set(ids))
+        if overlap:
+            raise ValueError(f"{owner} holds {len(overlap)} {name} episodes (e.g. {overlap[0]})")
+
+
+def check_training_ids(num_envs):
+    # the training ranges of num_envs workers
+    check_episode_range(training_offset(0), training_offset(num_envs) - 1, "training")
+
+
+def check_actor_ids(first_block, num_blocks):
+    # the ranges of num_blocks actor envs from block first_block
+    check_episode_range(actor_offset(first_block), actor_offset(first_block + num_blocks) - 1, "actors")
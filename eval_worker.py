@@ -0,0 +1,34 @@
+import time
+import numpy as np
+
+# Evaluation process of AsyncEvalCallback. Like env_worker it must stay light (no
+# stable-baselines3, no torch): the policy snapshots arrive as actor arrays and run through
+# NumpyPolicy. Every snapshot plays the same episodes, in the same order, in a SUMO workspace
+# of its own.
+
+
+def evaluator(snapshots, results, env_kwargs, episodes, cpu_set=None):
+    from sumo_env import SumoEnv
+    from policy_export import NumpyPolicy
+    from evaluation import run_policy_episode, KPI_KEYS
+    from resource_manager import pin_current_process
+
+    if cpu_set:
+        pin_current_process(cpu_set)
+    env = SumoEnv(episode_list=episodes, enable_measure=True, rank="eval", **env_kwargs)
+    try:
+        while True:
+            snapshot = snapshots.get()
+            if snapshot is None:
+                break
+            timesteps, arrays = snapshot
+            policy = NumpyPolicy.from_arrays(arrays)
+
+            start = time.perf_counter()
+            env.episode_count = 0
+            rows = [run_policy_episode(env, policy.predict) for _ in episodes]
+            kpis = {key: float(np.mean([r[key] for r in rows])) for key in KPI_KEYS}
+            kpis["reward"] = float(np.mean([r["reward"] for r in rows]))
+            results.put((timesteps, kpis, time.perf_counter() - start))
+    finally:
+        env.close()
@@ -0,0 +1,44 @@
+import time
+import numpy as np
+from gymnasium import spaces
+from detectors import detector_obs_size
+
+# Runs a full evaluation episode of a policy on a SumoEnv created with enable_measure=True.
+
+KPI_KEYS = ["totalTravelTime", "totalWaitingTime", "totalCO2Emissions"]
+
+
+def model_env_modes(model, sim_config):
+    # action mode and observation source a trained model expects from SumoEnv:
+    # models trained with green durations have a MultiDiscrete action space
+    action_mode = "duration" if isinstance(model.action_space, spaces.MultiDiscrete) else "fixed"
+    obs_source = "detectors" if model.observation_space.shape[0] == detector_obs_size(sim_config) + 3 else "dtse"
+    return action_mode, obs_source
+
+
+def run_policy_episode(env, predict):
+    # predict: obs -> action
+    start = time.perf_counter()
+    obs, _ = env.reset()
+
+    done = False
+    truncated = False
+    episode_reward = 0.0
+    decisions = 0
+    while not (done or truncated):
+        obs, reward, done, truncated, info = env.step(predict(obs))
+        episode_reward += reward
+        decisions += 1
+
+    wall_time = time.perf_counter() - start
+    measures = env.get_measures()
+
+    result = {
+        "episode_id": env.episode_id,
+        "decisions": decisions,
+        "reward": episode_reward,
+        "wall_time": wall_time,
+    }
+    for key in KPI_KEYS:
+        result[key] = float(np.mean([m[key] for m in measures]))
+    return result
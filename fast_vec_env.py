@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import contextlib
+import multiprocessing as mp
+import cloudpickle
+from stable_baselines3.common.vec_env import SubprocVecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+import env_worker
+
+# SubprocVecEnv with a light worker bootstrap:
+#  - the workers run env_worker.worker, which does not import stable-baselines3/torch
+#  - the parent __main__ (train.py, ...) is not re-imported by the workers
+#  - the forkserver preloads only the env modules, every worker forks with them loaded
+# All workers are started before waiting for any of them; their startup profile (spawn,
+# import, env construction and first reset times) is kept in startup_profile.
+
+# libsumo first: sumo_env then finds it loaded instead of creating a lazy module
+FORKSERVER_PRELOAD = ["env_worker", "numpy", "gymnasium", "libsumo", "yaml", "sumo_env", "resource_manager"]
+
+
+@contextlib.contextmanager
+def _main_module_hidden():
+    # multiprocessing re-runs the parent main module in spawn/forkserver children when it
+    # knows its file or module name
+    main = sys.modules["__main__"]
+    saved = {name: getattr(main, name) for name in ("__file__", "__spec__") if hasattr(main, name)}
+    main.__spec__ = None
+    if "__file__" in saved:
+        del main.__file__
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(main, name, value)
+
+
+class FastSubprocVecEnv(SubprocVecEnv):
+    def __init__(self, env_fns, start_method="forkserver", preload=FORKSERVER_PRELOAD):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        if start_method == "forkserver":
+            # only effective before the forkserver process is started
+            mp.set_forkserver_preload(preload)
+        ctx = mp.get_context(start_method)
+
+        self.ctx = ctx
+        self.remotes = []
+        self.processes = []
+        launch_time = time.time()
+        for env_fn in env_fns:
+            remote, process = self._start_worker(env_fn, launch_time)
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.startup_profile = []
+        for rank, remote in enumerate(self.remotes):
+            profile = remote.recv()
+            profile["rank"] = rank
+            self.startup_profile.append(profile)
+        self.startup_time = time.time() - launch_time
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+    def _start_worker(self, env_fn, launch_time):
+        # the worker sends its startup profile once its env is built
+        remote, work_remote = self.ctx.Pipe()
+        with _main_module_hidden():
+            args = (work_remote, remote, cloudpickle.dumps(env_fn), launch_time)
+            process = self.ctx.Process(target=env_worker.worker, args=args, daemon=True)
+            process.start()
+        work_remote.close()
+        return remote, process
+
+
+def log_startup_profile(vec_env, log_dir=None):
+    profile = vec_env.startup_profile
+    print(f"--- Env workers startup ({len(profile)} workers, {vec_env.startup_time:.2f} s) ---")
+    print(f"{'rank':>5} {'spawn':>8} {'import':>8} {'create':>8} {'reset':>8} {'ready':>8}")
+    for p in profile:
+        first_reset = p["first_reset_s"] if p["first_reset_s"] is not None else float("nan")
+        print(f"{p['rank']:>5} {p['spawn_s']:>8.2f} {p['import_s']:>8.2f} {p['create_s']:>8.2f} {first_reset:>8.2f} {p['ready_s']:>8.2f}")
+    print(f"--------------------------")
+
+    if log_dir is not None:
+        with open(os.path.join(log_dir, "startup_profile.json"), 'w') as f:
+            json.dump({"startup_time": vec_env.startup_time, "workers": profile}, f, indent=2)
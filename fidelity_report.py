@@ -0,0 +1,76 @@
+import os
+import csv
+import argparse
+import numpy as np
+from stable_baselines3 import PPO
+from sumo_env import SumoEnv, FIDELITY_LEVELS
+from sim_config import CONFIG_4WAY_160M
+from episode_sets import EPISODE_TEST_IDS
+from evaluation import run_policy_episode, KPI_KEYS
+
+# Speedup of the reduced fidelity levels and quality of the policies on the test episodes.
+# Every model runs the test episodes at every level: wall time is compared to the micro run
+# of the same model, KPIs show how far the cheap levels are from the full simulation and,
+# at micro level, how good models trained with different fidelity schedules are.
+
+def evaluate(model, fidelity, episodes, log_dir):
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=log_dir,
+                  rank=f"fidelity_{fidelity}",
+                  episode_list=episodes,
+                  enable_measure=True,
+                  fidelity=fidelity)
+
+    results = []
+    try:
+        for _ in episodes:
+            result = run_policy_episode(env, lambda obs: model.predict(obs, deterministic=True)[0])
+            print(f"[{fidelity}] episode {result['episode_id']}: {result['wall_time']:.1f} s, reward {result['reward']:.2f}")
+            results.append(result)
+    finally:
+        env.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speedup vs policy quality of the simulation fidelity levels")
+    parser.add_argument("--ids", type=int, nargs="+", required=True, help="Training IDs of the models to evaluate")
+    parser.add_argument("--fidelity", type=str, nargs="+", default=list(FIDELITY_LEVELS), choices=list(FIDELITY_LEVELS))
+    parser.add_argument("--episodes", type=int, nargs="+", default=EPISODE_TEST_IDS, help="Episode IDs (default: test episodes)")
+    args = parser.parse_args()
+
+    log_dir = os.path.join("logs", "fidelity_report")
+    os.makedirs(log_dir, exist_ok=True)
+
+    rows = []
+    for train_id in args.ids:
+        model_path = os.path.join("models", "ppo", f"train_id_{train_id}", f"PPO_{train_id}.zip")
+        model = PPO.load(model_path)
+
+        per_level = {}
+        for fidelity in args.fidelity:
+            results = evaluate(model, fidelity, args.episodes, log_dir)
+            per_level[fidelity] = {key: float(np.mean([r[key] for r in results])) for key in ["wall_time", "reward"] + KPI_KEYS}
+
+        reference = per_level.get("micro")
+        for fidelity, means in per_level.items():
+            row = {"model": f"PPO_{train_id}", "fidelity": fidelity, **means}
+            row["speedup"] = reference["wall_time"] / means["wall_time"] if reference else float("nan")
+            for key in KPI_KEYS:
+                row[f"{key}_error"] = (means[key] - reference[key]) / reference[key] if reference else float("nan")
+            rows.append(row)
+
+    report_file = os.path.join(log_dir, "fidelity_report.csv")
+    with open(report_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"{'model':>10} {'fidelity':>12} {'time (s)':>9} {'speedup':>8} {'reward':>9} {'travel':>8} {'waiting':>8} {'CO2 (mg)':>10} {'travel err':>11}")
+    for row in rows:
+        print(f"{row['model']:>10} {row['fidelity']:>12} {row['wall_time']:>9.1f} {row['speedup']:>8.2f} {row['reward']:>9.2f} "
+              f"{row['totalTravelTime']:>8.1f} {row['totalWaitingTime']:>8.1f} {row['totalCO2Emissions']:>10.0f} {row['totalTravelTime_error']:>+11.1%}")
+    print(f"Report saved in {report_file}")
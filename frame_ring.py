@@ -0,0 +1,42 @@
+import numpy as np
+
+
+# Preallocated circular buffer holding the last num_frames observations.
+# Every frame is stored twice (slot i and slot i + num_frames), so the most recent
+# num_frames frames are always one contiguous slice of the buffer and can be handed
+# out as a view: pushing a frame never allocates.
+class FrameRing:
+    def __init__(self, num_frames, frame_size, dtype=np.float32):
+        if num_frames < 1:
+            raise ValueError(f"num_frames must be >= 1, got {num_frames}")
+
+        self.num_frames = num_frames
+        self.frame_size = frame_size
+        self._buffer = np.zeros((2 * num_frames, frame_size), dtype=dtype)
+        self._head = 0
+        self._empty = True
+
+    def clear(self):
+        self._head = 0
+        self._empty = True
+
+    def next_slot(self):
+        # writable view, the producer fills it in place and then calls push()
+        return self._buffer[self._head]
+
+    def push(self):
+        if self._empty:
+            # first frame after a reset: the whole history is padded with it
+            first_frame = self._buffer[self._head].copy()
+            self._buffer[:] = first_frame
+            self._empty = False
+        else:
+            self._buffer[self._head + self.num_frames] = self._buffer[self._head]
+
+        self._head = (self._head + 1) % self.num_frames
+
+    def latest(self, copy=False):
+        # frames ordered from the oldest to the newest, flattened.
+        # Without copy the returned view is only valid until the next push().
+        window = self._buffer[self._head:self._head + self.num_frames].reshape(-1)
+        return window.copy() if copy else window
@@ -0,0 +1,68 @@
+from collections import deque
+from lazy_imports import lazy_import
+
+libsumo = lazy_import("libsumo")
+
+# Gridlock detection for runs without teleporting. Arrivals are counted every simulation step,
+# speed and insertion backlog are sampled every sample_interval seconds. The network is in
+# gridlock when, over the whole sliding window, enough vehicles are inside, their mean speed
+# stays below speed_threshold, no vehicle arrives and the insertion backlog does not shrink.
+
+
+class GridlockDetector:
+    def __init__(self, window=300.0, sample_interval=10.0, min_vehicles=10, speed_threshold=0.1, max_arrivals=0):
+        self.window = window
+        self.sample_interval = sample_interval
+        self.min_vehicles = min_vehicles
+        self.speed_threshold = speed_threshold
+        self.max_arrivals = max_arrivals
+        self.reset()
+
+    def reset(self):
+        self.samples = deque() # (time, vehicles, mean speed, arrivals since last sample, pending)
+        self._arrivals = 0
+        self._next_sample = self.sample_interval
+        self.gridlocked = False
+        self.detected_at = None
+        self.vehicles_at_detection = 0
+
+    def update(self):
+        # called after every simulationStep
+        if self.gridlocked:
+            return True
+
+        self._arrivals += libsumo.simulation.getArrivedNumber()
+        now = libsumo.simulation.getTime()
+        if now < self._next_sample:
+            return False
+        self._next_sample = now + self.sample_interval
+
+        vehicle_ids = libsumo.vehicle.getIDList()
+        mean_speed = sum(libsumo.vehicle.getSpeed(v) for v in vehicle_ids) / len(vehicle_ids) if vehicle_ids else 0.0
+        pending = len(libsumo.simulation.getPendingVehicles())
+        self.samples.append((now, len(vehicle_ids), mean_speed, self._arrivals, pending))
+        self._arrivals = 0
+
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+        if self.samples[-1][0] - self.samples[0][0] < self.window - self.sample_interval:
+            return False # window not full yet
+
+        first, last = self.samples[0], self.samples[-1]
+        if (min(s[1] for s in self.samples) >= self.min_vehicles
+                and max(s[2] for s in self.samples) < self.speed_threshold
+                and sum(s[3] for s in list(self.samples)[1:]) <= self.max_arrivals
+                and last[4] >= first[4]):
+            self.gridlocked = True
+            self.detected_at = now
+            self.vehicles_at_detection = last[1]
+        return self.gridlocked
+
+    def summary(self, end_time):
+        # simulated time not run because of the early stop, up to end_time
+        return {
+            "gridlock": self.gridlocked,
+            "gridlock_time": self.detected_at,
+            "gridlock_vehicles": self.vehicles_at_detection,
+            "gridlock_time_saved": max(0.0, end_time - self.detected_at) if self.gridlocked else 0.0,
+        }
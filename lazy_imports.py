@@ -0,0 +1,20 @@
+import sys
+import importlib.util
+
+# Deferred imports for the heavy modules of the env workers: the module code runs at the
+# first attribute access. A module already imported (e.g. preloaded by the forkserver) is
+# returned as is.
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
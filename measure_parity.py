@@ -0,0 +1,75 @@
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from episode_sets import EPISODE_TEST_IDS
+
+# Parity of the tripinfo measurement engine against the polling one: the same STL runs are
+# measured with both and every per vehicle KPI is compared. The episode averages (the values
+# written in the test summaries) must agree within --tolerance.
+# Distance and mean speed have their own --distance-tolerance: tripinfo gives the whole driven
+# route (routeLength), the polling engine keeps the getDistance of the last step before the
+# arrival and misses the part of the route driven in the arrival step, up to speed * sim_step
+# (about 7 m at 0.5 s on the ~310 m routes). The tripinfo values are higher by 1-2 %.
+
+LOG_DIR = os.path.join("logs", "measure_parity")
+KEYS = ["totalTravelTime", "totalWaitingTime", "totalDistance", "meanSpeed", "totalCO2Emissions", "totalCOEmissions",
+        "totalHCEmissions", "totalPMxEmissions", "totalNOxEmissions", "totalFuelConsumption", "totalElectricityConsumption"]
+DISTANCE_KEYS = ["totalDistance", "meanSpeed"]
+
+
+def measure(measure_mode, episode_id, enhancements):
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=LOG_DIR,
+                  rank=f"parity_{measure_mode}",
+                  episode_list=[episode_id],
+                  enable_measure=True,
+                  measure_mode=measure_mode)
+    try:
+        env.reset()
+        start = time.perf_counter()
+        env.run_smart_traffic_light(enhancements)
+        measures = env.get_measures()
+        wall_time = time.perf_counter() - start
+    finally:
+        env.close()
+    return {m["vehicleID"]: m for m in measures}, wall_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the tripinfo measurement engine with the polling one")
+    parser.add_argument("--episodes", type=int, nargs="+", default=EPISODE_TEST_IDS[:3], help="Episode IDs")
+    parser.add_argument("--enhancements", type=int, nargs="*", default=[], help="STL improvements of the measured runs")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Max relative difference of the episode averages")
+    parser.add_argument("--distance-tolerance", type=float, default=0.03, help="Max relative difference of distance and mean speed (last step missed by polling)")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    failures = 0
+    for episode_id in args.episodes:
+        polled, poll_time = measure("poll", episode_id, args.enhancements)
+        tripinfo, tripinfo_time = measure("tripinfo", episode_id, args.enhancements)
+        print(f"--- Episode {episode_id}: poll {poll_time:.1f} s, tripinfo {tripinfo_time:.1f} s ({poll_time / tripinfo_time:.2f}x) ---")
+        print(f"{'key':<28} {'poll avg':>12} {'tripinfo avg':>12} {'rel diff':>9} {'max veh diff':>12}")
+
+        for key in KEYS:
+            a = np.array([polled[v][key] for v in polled])
+            b = np.array([tripinfo[v][key] for v in polled])
+            rel_diff = abs(b.mean() - a.mean()) / abs(a.mean()) if a.mean() != 0 else abs(b.mean())
+            ok = rel_diff <= (args.distance_tolerance if key in DISTANCE_KEYS else args.tolerance)
+            failures += not ok
+            print(f"{key:<28} {a.mean():>12.4f} {b.mean():>12.4f} {rel_diff:>9.2%} {np.max(np.abs(b - a)):>12.4f}{'' if ok else '  <-- over tolerance'}")
+
+        noise = [tripinfo[v]["totalNoiseEmission"] for v in tripinfo]
+        if all(math.isnan(n) for n in noise):
+            print("totalNoiseEmission: not available from tripinfo (NaN)")
+
+    print("Parity OK" if failures == 0 else f"Parity FAILED on {failures} averages")
+    sys.exit(1 if failures else 0)
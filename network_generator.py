@@ -0,0 +1,257 @@
+import os
+import json
+import shutil
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+from dataclasses import asdict
+from sim_config import SimConfig
+
+# Synthetic networks for load and scaling tests: K x K grids of signalized 4-way junctions
+# (K = 1 is a single crossing like 4way_crossing_160m), with configurable arm length and lanes
+# per edge. Nodes and edges are written as plain XML and converted with netconvert; the
+# controlled junction gets the same 6-phase program "1" used by SumoEnv and the STL.
+
+BASE_OUTPUT_DIR = "generated_networks"
+CONFIG_FILE = "sim_config.json"
+
+
+def find_sumo_tool(name):
+    # SUMO_HOME, then the eclipse-sumo wheel installed with libsumo, then PATH
+    candidates = []
+    if os.environ.get("SUMO_HOME"):
+        candidates.append(os.path.join(os.environ["SUMO_HOME"], "bin", name))
+    try:
+        import sumo
+        candidates.append(os.path.join(sumo.SUMO_HOME, "bin", name))
+    except ImportError:
+        pass
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    path = shutil.which(name)
+    if path is None:
+        raise FileNotFoundError(f"SUMO tool '{name}' not found, set SUMO_HOME")
+    return path
+
+
+def network_name(grid_size, arm_length, lanes_per_edge):
+    return f"grid{grid_size}x{grid_size}_{arm_length}m_{lanes_per_edge}l"
+
+
+class GridLayout:
+    # Row r grows towards south, column c towards east. Junctions are J{r}_{c}, fringe nodes
+    # N{c}, S{c}, W{r}, E{r}; the edge from node a to node b is "{a}to{b}".
+    def __init__(self, grid_size, arm_length):
+        self.grid_size = grid_size
+        self.arm_length = arm_length
+
+    def node(self, r, c):
+        k = self.grid_size
+        if 0 <= r < k and 0 <= c < k:
+            return f"J{r}_{c}"
+        if r == -1:
+            return f"N{c}"
+        if r == k:
+            return f"S{c}"
+        if c == -1:
+            return f"W{r}"
+        return f"E{r}"
+
+    def position(self, r, c):
+        return c * self.arm_length, -r * self.arm_length
+
+    def junctions(self):
+        return [(r, c) for r in range(self.grid_size) for c in range(self.grid_size)]
+
+    def fringe(self):
+        k = self.grid_size
+        return [(-1, c) for c in range(k)] + [(k, c) for c in range(k)] + [(r, -1) for r in range(k)] + [(r, k) for r in range(k)]
+
+    def edge(self, a, b):
+        return f"{self.node(*a)}to{self.node(*b)}"
+
+    def links(self):
+        # every pair of neighbouring nodes, both directions
+        nodes = set(self.junctions()) | set(self.fringe())
+        links = []
+        for r, c in self.junctions():
+            for dr, dc in [(-1, 0), (0, 1), (1, 0), (0, -1)]:
+                other = (r + dr, c + dc)
+                if other in nodes:
+                    links.append(((r, c), other))
+                    if other not in self.junctions():
+                        links.append((other, (r, c)))
+        return links
+
+    def center(self):
+        return self.grid_size // 2, self.grid_size // 2
+
+    def incoming_edges(self, junction):
+        # North, East, South, West: same row order as the 4-way crossing DTSE
+        r, c = junction
+        return [self.edge(other, junction) for other in [(r - 1, c), (r, c + 1), (r + 1, c), (r, c - 1)]]
+
+    def routes(self):
+        # From every fringe entry: straight across the grid, or right/left at the first junction
+        # and then straight to the fringe. Returns (group, [edges]).
+        k = self.grid_size
+        routes = []
+        for entry in self.fringe():
+            r, c = entry
+            heading = (1, 0) if r == -1 else (-1, 0) if r == k else (0, 1) if c == -1 else (0, -1)
+            axis = "NS" if heading[1] == 0 else "EW"
+            first = (r + heading[0], c + heading[1])
+            for turn, new_heading in [("Straight", heading), ("Right", (heading[1], -heading[0])), ("Left", (-heading[1], heading[0]))]:
+                path = [entry, first]
+                while path[-1] in self.junctions():
+                    last = path[-1]
+                    path.append((last[0] + new_heading[0], last[1] + new_heading[1]))
+                routes.append((f"{axis}_{turn}", [self.edge(a, b) for a, b in zip(path, path[1:])]))
+        return routes
+
+
+def _write_xml(root, path):
+    ET.indent(root)
+    ET.ElementTree(root).write(path, encoding="UTF-8", xml_declaration=True)
+
+
+def write_plain_network(layout, lanes_per_edge, speed, nod_path, edg_path):
+    nodes = ET.Element("nodes")
+    for r, c in layout.junctions():
+        x, y = layout.position(r, c)
+        ET.SubElement(nodes, "node", id=layout.node(r, c), x=f"{x:.2f}", y=f"{y:.2f}", type="traffic_light")
+    for r, c in layout.fringe():
+        x, y = layout.position(r, c)
+        ET.SubElement(nodes, "node", id=layout.node(r, c), x=f"{x:.2f}", y=f"{y:.2f}", type="priority")
+    _write_xml(nodes, nod_path)
+
+    edges = ET.Element("edges")
+    for a, b in layout.links():
+        ET.SubElement(edges, "edge", id=layout.edge(a, b), attrib={"from": layout.node(*a), "to": layout.node(*b)},
+                      numLanes=str(lanes_per_edge), speed=f"{speed:.2f}")
+    _write_xml(edges, edg_path)
+
+
+def rl_program(net_path, tl_id):
+    # Program "1": 0 N/S green, 1 yellow, 2 all red, 3 E/W green, 4 yellow, 5 all red.
+    # Green phases last 1e6 s, SumoEnv and the STL switch them with setPhase.
+    net = ET.parse(net_path).getroot()
+    edge_from = {e.get("id"): e.get("from") for e in net.iter("edge") if e.get("function") != "internal"}
+    junctions = {j.get("id"): (float(j.get("x")), float(j.get("y"))) for j in net.iter("junction")}
+
+    links = {}
+    for connection in net.iter("connection"):
+        if connection.get("tl") != tl_id:
+            continue
+        from_x, _ = junctions[edge_from[connection.get("from")]]
+        vertical = abs(from_x - junctions[tl_id][0]) < 1e-3
+        links[int(connection.get("linkIndex"))] = (vertical, connection.get("dir"))
+
+    def state(green_vertical, color):
+        signals = []
+        for i in range(len(links)):
+            vertical, direction = links[i]
+            if color == "r" or vertical != green_vertical:
+                signals.append("r")
+            elif color == "G":
+                signals.append("g" if direction == "l" else "G")
+            else:
+                signals.append(color)
+        return "".join(signals)
+
+    program = ET.Element("tlLogic", id=tl_id, type="static", programID="1", offset="0")
+    for green_vertical in [True, False]:
+        ET.SubElement(program, "phase", duration="1000000", state=state(green_vertical, "G"))
+        ET.SubElement(program, "phase", duration="3", state=state(green_vertical, "y"))
+        ET.SubElement(program, "phase", duration="3", state=state(green_vertical, "r"))
+    return program
+
+
+def generate_network(grid_size=1, arm_length=160, lanes_per_edge=2, demand_scale=1.0, speed=13.89, output_dir=BASE_OUTPUT_DIR):
+    name = network_name(grid_size, arm_length, lanes_per_edge)
+    template_dir = os.path.join(output_dir, name)
+    net_dir = os.path.join(template_dir, name)
+    os.makedirs(net_dir, exist_ok=True)
+
+    layout = GridLayout(grid_size, arm_length)
+    nod_path = os.path.join(net_dir, f"{name}.nod.xml")
+    edg_path = os.path.join(net_dir, f"{name}.edg.xml")
+    net_path = os.path.join(net_dir, f"{name}.net.xml")
+    write_plain_network(layout, lanes_per_edge, speed, nod_path, edg_path)
+
+    subprocess.run([find_sumo_tool("netconvert"),
+                    "--node-files", nod_path,
+                    "--edge-files", edg_path,
+                    "--output-file", net_path,
+                    "--no-turnarounds", "true",
+                    "--tls.default-type", "static",
+                    "--tls.yellow.time", "3",
+                    "--tls.allred.time", "3",
+                    "--tls.left-green.time", "0",
+                    "--no-warnings", "true"],
+                   check=True, stdout=subprocess.DEVNULL)
+
+    tl_id = layout.node(*layout.center())
+    additional = ET.Element("additional")
+    additional.append(rl_program(net_path, tl_id))
+    _write_xml(additional, os.path.join(net_dir, f"{name}.add.xml"))
+
+    routes = layout.routes()
+    routes_root = ET.Element("routes")
+    routes_map = {}
+    for i, (group, edges) in enumerate(routes, start=1):
+        ET.SubElement(routes_root, "route", id=f"route{i}", edges=" ".join(edges))
+        routes_map.setdefault(group, []).append(f"route{i}")
+    _write_xml(routes_root, os.path.join(net_dir, f"{name}.rou.xml"))
+
+    configuration = ET.Element("configuration")
+    inputs = ET.SubElement(configuration, "input")
+    ET.SubElement(inputs, "net-file", value=f"{name}.net.xml")
+    ET.SubElement(inputs, "route-files", value=f"{name}.rou.xml,../vehicletypes.rou.xml")
+    ET.SubElement(inputs, "additional-files", value=f"{name}.add.xml")
+    _write_xml(configuration, os.path.join(net_dir, f"{name}.sumocfg"))
+
+    config = SimConfig(
+        name=name,
+        add_file=f"{name}.add.xml",
+        net_file=f"{name}.net.xml",
+        rou_file=f"{name}.rou.xml",
+        tl_id=tl_id,
+        tl_program="1",
+        num_edges=len(layout.links()),
+        lanes_per_edge=lanes_per_edge,
+        routes_map=routes_map,
+        description=f"Griglia {grid_size}x{grid_size} di incroci a 4 vie, bracci da {arm_length}m con {lanes_per_edge} corsie per senso di marcia",
+        obs_lanes=[f"{edge}_{lane}" for edge in layout.incoming_edges(layout.center()) for lane in range(lanes_per_edge)],
+        lane_length=arm_length,
+        demand_scale=demand_scale,
+        template_dir=template_dir,
+    )
+    save_config(config, os.path.join(template_dir, CONFIG_FILE))
+    return config
+
+
+def save_config(config, path):
+    data = asdict(config)
+    data.pop("route_ids")
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load_config(path):
+    with open(path) as f:
+        return SimConfig(**json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic grid networks with their SimConfig")
+    parser.add_argument("--grid", type=int, default=1, help="Junctions per side (1 = single crossing)")
+    parser.add_argument("--arm-length", type=int, default=160, help="Length of every edge (m)")
+    parser.add_argument("--lanes", type=int, default=2, help="Lanes per edge and direction")
+    parser.add_argument("--demand-scale", type=float, default=1.0, help="Scale of the vehicle count of every scenario")
+    args = parser.parse_args()
+
+    config = generate_network(args.grid, args.arm_length, args.lanes, args.demand_scale)
+    print(f"Network {config.name} written in {config.template_dir}")
+    print(f"Controlled junction: {config.tl_id}, observed lanes: {len(config.obs_lanes)}, routes: {len(config.route_ids)}")
@@ -0,0 +1,204 @@
+import os
+import glob
+import json
+import argparse
+import numpy as np
+from episode_sets import DATASET_ID_BASE, check_episode_range
+
+# Offline dataset of (observation, action, reward, done) transitions on the 10 s decision grid,
+# recorded during STL and PPO runs (SumoEnv dataset_writer). Transitions go to append-only
+# shards, one .npy structured array per shard opened as a memory map, and every writer keeps
+# an index file with the filled rows of its shards. The loader samples random minibatches
+# from the memory maps: only the sampled rows are read from disk.
+#
+# Every transition also stores the discounted return of the rest of its episode, the
+# target of the value head in pretrain_bc.py.
+
+SHARD_SIZE = 1 << 16
+GAMMA = 0.99
+
+# STL phase -> env action (0 N/S green, 1 E/W green): the direction served or about to be
+# served at the end of the decision interval
+PHASE_ACTIONS = [0, 1, 1, 1, 0, 0]
+
+
+def transition_dtype(obs_dim):
+    return np.dtype([("obs", np.float32, (obs_dim,)), ("action", np.int8), ("reward", np.float32),
+                     ("done", np.bool_), ("ret", np.float32)])
+
+
+class ShardWriter:
+    def __init__(self, root, obs_dim, writer_id=0, shard_size=SHARD_SIZE, gamma=GAMMA):
+        self.root = root
+        self.obs_dim = obs_dim
+        self.writer_id = writer_id
+        self.shard_size = shard_size
+        self.gamma = gamma
+        self.dtype = transition_dtype(obs_dim)
+        os.makedirs(root, exist_ok=True)
+
+        self.index_path = os.path.join(root, f"index_{writer_id}.json")
+        self.index = {"obs_dim": obs_dim, "shards": []}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+            if self.index["obs_dim"] != obs_dim:
+                raise ValueError(f"{self.index_path} holds observations of size {self.index['obs_dim']}, not {obs_dim}")
+
+        self.shard = None
+        self.episode = []
+
+    def append(self, obs, action, reward, done):
+        self.episode.append((np.array(obs, dtype=np.float32), action, reward, done))
+        if done:
+            self._write_episode()
+
+    def _write_episode(self):
+        ret = 0.0
+        returns = []
+        for _, _, reward, _ in reversed(self.episode):
+            ret = reward + self.gamma * ret
+            returns.append(ret)
+        returns.reverse()
+
+        for (obs, action, reward, done), ret in zip(self.episode, returns):
+            if self.shard is None or self.shard_count == self.shard_size:
+                self._open_shard()
+            row = self.shard[self.shard_count]
+            row["obs"] = obs
+            row["action"] = action
+            row["reward"] = reward
+            row["done"] = done
+            row["ret"] = ret
+            self.shard_count += 1
+        self.episode = []
+        self._update_index()
+
+    def _open_shard(self):
+        if self.shard is not None:
+            self.shard.flush()
+        name = f"shard_{self.writer_id}_{len(self.index['shards'])}.npy"
+        self.shard = np.lib.format.open_memmap(os.path.join(self.root, name), mode="w+", dtype=self.dtype, shape=(self.shard_size,))
+        self.shard_count = 0
+        self.index["shards"].append({"file": name, "count": 0})
+
+    def _update_index(self):
+        # only rows of complete episodes are listed in the index
+        self.shard.flush()
+        self.index["shards"][-1]["count"] = self.shard_count
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def end_episode(self):
+        # the last transition becomes terminal
+        if self.episode:
+            obs, action, reward, _ = self.episode[-1]
+            self.episode[-1] = (obs, action, reward, True)
+            self._write_episode()
+
+    def close(self):
+        # an interrupted episode is kept, closed as done
+        self.end_episode()
+        if self.shard is not None:
+            self.shard.flush()
+            self.shard = None
+
+
+class OfflineDataset:
+    def __init__(self, root):
+        self.shards = []
+        self.obs_dim = None
+        for index_path in sorted(glob.glob(os.path.join(root, "index_*.json"))):
+            with open(index_path) as f:
+                index = json.load(f)
+            if self.obs_dim is not None and index["obs_dim"] != self.obs_dim:
+                raise ValueError(f"{index_path}: observation size {index['obs_dim']} differs from {self.obs_dim}")
+            self.obs_dim = index["obs_dim"]
+            for shard in index["shards"]:
+                if shard["count"] > 0:
+                    self.shards.append((np.load(os.path.join(root, shard["file"]), mmap_mode="r"), shard["count"]))
+
+        if not self.shards:
+            raise ValueError(f"No transitions in {root}")
+        self.counts = np.array([count for _, count in self.shards])
+        self.size = int(self.counts.sum())
+
+    def sample(self, batch_size, rng):
+        # uniform over the transitions: shards are drawn by their size
+        shard_ids = rng.choice(len(self.shards), size=batch_size, p=self.counts / self.size)
+        batch = np.empty(batch_size, dtype=self.shards[0][0].dtype)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            shard, count = self.shards[shard_id]
+            rows = np.sort(rng.integers(0, count, size=int(mask.sum())))
+            batch[mask] = shard[rows]
+        return batch
+
+    def stats(self):
+        actions = np.zeros(2, dtype=np.int64)
+        rewards = 0.0
+        episodes = 0
+        for shard, count in self.shards:
+            actions += np.bincount(shard["action"][:count], minlength=2)[:2]
+            rewards += float(shard["reward"][:count].sum())
+            episodes += int(shard["done"][:count].sum())
+        return {"transitions": self.size, "episodes": episodes, "action_counts": actions.tolist(),
+                "mean_reward": rewards / self.size}
+
+
+def record(worker_id, episode_ids, variants, root, rank_prefix="dataset"):
+    from sumo_env import SumoEnv
+    from sim_config import CONFIG_4WAY_160M
+
+    log_dir = os.path.join("logs", "offline_dataset")
+    os.makedirs(log_dir, exist_ok=True)
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=log_dir,
+                  rank=f"{rank_prefix}_{worker_id}",
+                  episode_list=episode_ids)
+    writer = ShardWriter(root, env.observation_space.shape[0], writer_id=worker_id)
+    env.dataset_writer = writer
+    try:
+        for episode_id in episode_ids:
+            env.reset() # builds the population, nothing is recorded before a controller runs
+            for enhancements in variants:
+                env.run_smart_traffic_light(enhancements)
+            print(f"[Worker {worker_id}] episode {episode_id} recorded")
+    finally:
+        writer.close()
+        env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record STL transitions in an offline dataset")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Run STL episodes and append their transitions")
+    record_parser.add_argument("--root", type=str, default=os.path.join("datasets", "stl"))
+    record_parser.add_argument("--first-episode", type=int, default=DATASET_ID_BASE + 1, help="First episode ID")
+    record_parser.add_argument("--episodes", type=int, default=100, help="Number of episodes")
+    record_parser.add_argument("--variants", type=str, nargs="+", default=["12"], help="STL improvements of the recorded runs, e.g. 12 1 none")
+    record_parser.add_argument("--workers", type=int, default=1, help="Parallel recording processes")
+
+    stats_parser = subparsers.add_parser("stats", help="Print the dataset size and the action balance")
+    stats_parser.add_argument("--root", type=str, default=os.path.join("datasets", "stl"))
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        import multiprocessing as mp
+        variants = [[] if v == "none" else [int(c) for c in v] for v in args.variants]
+        episodes = list(range(args.first_episode, args.first_episode + args.episodes))
+        check_episode_range(episodes[0], episodes[-1], "dataset")
+        # new writer ids after the ones already in the dataset: shards are never overwritten
+        first_writer = len(glob.glob(os.path.join(args.root, "index_*.json")))
+        jobs = [(first_writer + w, episodes[w::args.workers], variants, args.root) for w in range(args.workers)]
+        with mp.get_context("spawn").Pool(args.workers) as pool:
+            pool.starmap(record, jobs)
+
+    print(json.dumps(OfflineDataset(args.root).stats(), indent=2))
@@ -0,0 +1,134 @@
+import os
+import time
+import argparse
+import numpy as np
+
+# Only numpy is needed to run an exported policy: stable-baselines3 and torch are
+# imported lazily by the export and benchmark functions.
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0.0),
+}
+
+
+def actor_arrays(model):
+    # Arrays of the actor of a PPO MlpPolicy (policy_net + action_net)
+    import torch.nn as nn
+
+    policy = model.policy
+    activation_names = {nn.Tanh: "tanh", nn.ReLU: "relu"}
+    if policy.activation_fn not in activation_names:
+        raise ValueError(f"Unsupported activation function: {policy.activation_fn}")
+
+    arrays = {}
+    linear_layers = [m for m in policy.mlp_extractor.policy_net if isinstance(m, nn.Linear)]
+    linear_layers.append(policy.action_net)
+    for i, layer in enumerate(linear_layers):
+        arrays[f"weight_{i}"] = layer.weight.detach().cpu().numpy().astype(np.float32)
+        arrays[f"bias_{i}"] = layer.bias.detach().cpu().numpy().astype(np.float32)
+
+    nvec = getattr(model.action_space, "nvec", None)
+    arrays["action_nvec"] = np.array(nvec if nvec is not None else [model.action_space.n], dtype=np.int64)
+    arrays["activation"] = np.array(activation_names[policy.activation_fn])
+    arrays["n_layers"] = np.array(len(linear_layers))
+    return arrays
+
+
+def export_policy(model, output_path):
+    # Writes the actor of a PPO MlpPolicy to a .npz file
+    np.savez(output_path, **actor_arrays(model))
+
+
+class NumpyPolicy:
+    def __init__(self, weights, biases, activation, action_nvec):
+        self.weights = weights
+        self.biases = biases
+        self.activation = ACTIVATIONS[activation]
+        self.action_nvec = list(action_nvec)
+        self.obs_dim = weights[0].shape[0] # weights are stored (inputs, outputs)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            return NumpyPolicy.from_arrays(data)
+
+    @staticmethod
+    def from_arrays(data):
+        # data: the .npz content or the dict of actor_arrays
+        n_layers = int(data["n_layers"])
+        # pre-transposed so the forward pass is obs @ W
+        weights = [np.ascontiguousarray(data[f"weight_{i}"].T) for i in range(n_layers)]
+        biases = [np.asarray(data[f"bias_{i}"]) for i in range(n_layers)]
+        return NumpyPolicy(weights, biases, str(data["activation"]), data["action_nvec"])
+
+    def logits(self, obs):
+        x = np.asarray(obs, dtype=np.float32)
+        for w, b in zip(self.weights[:-1], self.biases[:-1]):
+            x = self.activation(x @ w + b)
+        return x @ self.weights[-1] + self.biases[-1]
+
+    def predict(self, obs):
+        # Deterministic action, same as model.predict(obs, deterministic=True).
+        # Accepts a single observation or a batch with shape (n, obs_dim).
+        obs = np.asarray(obs, dtype=np.float32)
+        single = obs.ndim == 1
+        logits = self.logits(obs.reshape(-1, self.obs_dim))
+
+        if len(self.action_nvec) == 1:
+            actions = np.argmax(logits, axis=1)
+        else:
+            splits = np.cumsum(self.action_nvec)[:-1]
+            actions = np.stack([np.argmax(chunk, axis=1) for chunk in np.split(logits, splits, axis=1)], axis=1)
+
+        return actions[0] if single else actions
+
+
+def _time_call(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(model, numpy_policy, batch_sizes, repeats):
+    rng = np.random.default_rng(0)
+    space = model.observation_space
+
+    print(f"{'batch':>8} {'sb3 predict (ms)':>18} {'numpy (ms)':>12} {'speedup':>9} {'mismatches':>11}")
+    for batch in batch_sizes:
+        obs = rng.uniform(space.low, space.high, size=(batch,) + space.shape).astype(np.float32)
+        if batch == 1:
+            obs = obs[0]
+
+        sb3_actions, _ = model.predict(obs, deterministic=True)
+        np_actions = numpy_policy.predict(obs)
+        mismatches = int(np.sum(np.asarray(sb3_actions) != np.asarray(np_actions)))
+
+        sb3_time = _time_call(lambda: model.predict(obs, deterministic=True), repeats)
+        np_time = _time_call(lambda: numpy_policy.predict(obs), repeats)
+
+        print(f"{batch:>8} {sb3_time * 1000:>18.4f} {np_time * 1000:>12.4f} {sb3_time / np_time:>8.1f}x {mismatches:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained PPO policy for numpy-only inference")
+    parser.add_argument("--id", type=int, required=True, help="Training ID")
+    parser.add_argument("--benchmark", action="store_true", required=False, help="Compare latency against SB3 predict")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 256, 4096], help="Batch sizes used by the benchmark")
+    parser.add_argument("--repeats", type=int, default=1000, help="Calls per batch size in the benchmark")
+    args = parser.parse_args()
+
+    from stable_baselines3 import PPO
+
+    model_run = f"train_id_{args.id}"
+    models_dir = os.path.join("models", "ppo", model_run)
+    model_path = os.path.join(models_dir, f"PPO_{args.id}.zip")
+    export_path = os.path.join(models_dir, f"PPO_{args.id}_actor.npz")
+
+    model = PPO.load(model_path, device="cpu")
+    export_policy(model, export_path)
+    print(f"Actor exported to {export_path} ({os.path.getsize(export_path) / 1024:.1f} KiB)")
+
+    if args.benchmark:
+        benchmark(model, NumpyPolicy.load(export_path), args.batch_sizes, args.repeats)
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from stable_baselines3 import PPO
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from offline_dataset import OfflineDataset
+from train import setup_run_directories
+
+# Behaviour cloning pretraining of the PPO MlpPolicy on an offline dataset (offline_dataset.py):
+# the actor maximizes the log-likelihood of the recorded actions, the value head regresses the
+# recorded discounted returns. The model is saved like a training run and can start an
+# on-policy training with: python train.py --init-model models/ppo/train_id_N/PPO_N.zip
+
+
+def action_accuracy(policy, obs, actions):
+    with torch.no_grad():
+        probs = policy.get_distribution(obs).distribution.probs
+    return float((probs.argmax(dim=1) == actions).float().mean())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Behaviour cloning pretraining of PPO on recorded transitions")
+    parser.add_argument("--root", type=str, default=os.path.join("datasets", "stl"), help="Offline dataset folder")
+    parser.add_argument("--steps", type=int, default=20000, help="Gradient steps")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--lr", type=float, default=3e-4)
+    parser.add_argument("--vf-coef", type=float, default=0.5, help="Weight of the value regression")
+    parser.add_argument("--ent-coef", type=float, default=0.0, help="Entropy bonus, keeps the cloned policy stochastic")
+    parser.add_argument("--log-every", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = OfflineDataset(args.root)
+    print(f"Dataset: {json.dumps(dataset.stats())}")
+
+    models_dir, log_dir, train_id = setup_run_directories()
+
+    # the env only provides the spaces, SUMO is never started here
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=log_dir,
+                  rank="bc")
+    if env.observation_space.shape[0] != dataset.obs_dim:
+        raise ValueError(f"Dataset observations have size {dataset.obs_dim}, the env expects {env.observation_space.shape[0]}")
+
+    model = PPO("MlpPolicy", env, tensorboard_log=log_dir, device="auto", seed=args.seed)
+    policy = model.policy
+    policy.set_training_mode(True)
+    optimizer = torch.optim.Adam(policy.parameters(), lr=args.lr)
+    rng = np.random.default_rng(args.seed)
+
+    def to_tensors(batch):
+        # the fields of the packed records are strided views: torch needs contiguous copies
+        obs = torch.as_tensor(np.ascontiguousarray(batch["obs"]), device=policy.device)
+        actions = torch.as_tensor(batch["action"].astype(np.int64), device=policy.device)
+        returns = torch.as_tensor(np.ascontiguousarray(batch["ret"]), device=policy.device)
+        return obs, actions, returns
+
+    # a fixed batch to follow the fit
+    eval_obs, eval_actions, eval_returns = to_tensors(dataset.sample(min(8192, dataset.size), rng))
+
+    history = []
+    start_time = time.perf_counter()
+    for step in range(1, args.steps + 1):
+        obs, actions, returns = to_tensors(dataset.sample(args.batch_size, rng))
+        values, log_prob, entropy = policy.evaluate_actions(obs, actions)
+        policy_loss = -log_prob.mean()
+        value_loss = F.mse_loss(values.flatten(), returns)
+        loss = policy_loss + args.vf_coef * value_loss - args.ent_coef * entropy.mean()
+
+        optimizer.zero_grad()
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(policy.parameters(), model.max_grad_norm)
+        optimizer.step()
+
+        if step % args.log_every == 0 or step == args.steps:
+            with torch.no_grad():
+                eval_values, _, _ = policy.evaluate_actions(eval_obs, eval_actions)
+            entry = {
+                "step": step,
+                "policy_loss": policy_loss.item(),
+                "value_loss": value_loss.item(),
+                "accuracy": action_accuracy(policy, eval_obs, eval_actions),
+                "value_mse": float(F.mse_loss(eval_values.flatten(), eval_returns)),
+            }
+            history.append(entry)
+            print(f"step {step:>7}: policy loss {entry['policy_loss']:.4f}, value loss {entry['value_loss']:.4f}, "
+                  f"action accuracy {entry['accuracy']:.3f}")
+
+    print(f"Pretraining completed in {time.perf_counter() - start_time:.0f} s")
+    with open(os.path.join(log_dir, "bc_log.json"), 'w') as f:
+        json.dump({"dataset": args.root, "args": vars(args), "history": history}, f, indent=2)
+
+    model.save(f"{models_dir}/PPO_{train_id}")
+    print(f"BC-pretrained model saved as PPO_{train_id}, check it with: python test.py --id {train_id}")
+    print(f"Fine-tune it with: python train.py --init-model {models_dir}/PPO_{train_id}.zip")
@@ -0,0 +1,133 @@
+import os
+import sys
+import argparse
+import sim_config
+from sumo_env import SumoEnv
+from decision_trace import read_trace, trace_path, RECORD
+from network_generator import load_config
+from lazy_imports import lazy_import
+
+libsumo = lazy_import("libsumo")
+
+# Replay of a decision trace: the episode is regenerated from its id, the recorded decisions are
+# applied again and the new trace is compared with the original one. No policy is loaded (no
+# torch, no SB3), so it doubles as a regression check of SUMO and of the traffic generator.
+
+LOG_DIR = os.path.join("logs", "replay")
+WORKSPACE = os.path.join("sumo_workspace", "replay")
+RECORD_FIELDS = ["time", "phase", "action", "reward", "waiting_time", "co2", "max_waiting_time", "penalty"]
+
+
+class TracePlayer:
+    # stands in for TrafficLight: sets the recorded phases at the recorded times
+    def __init__(self, tl_id, records, trace=None):
+        self.tl_id = tl_id
+        self.records = records
+        self.next = 0
+        self.trace = trace
+
+    def performStep(self):
+        now = libsumo.simulation.getTime()
+        while self.next < len(self.records) and self.records[self.next][0] == now:
+            new_phase = self.records[self.next][2]
+            if self.trace is not None:
+                self.trace.record(now, libsumo.trafficlight.getPhase(self.tl_id), new_phase)
+            libsumo.trafficlight.setPhase(self.tl_id, new_phase)
+            self.next += 1
+
+
+def find_config(name, config_path=None):
+    if config_path is not None:
+        return load_config(config_path)
+    for value in vars(sim_config).values():
+        if isinstance(value, sim_config.SimConfig) and value.name == name:
+            return value
+    raise ValueError(f"Unknown sim config {name}, pass its JSON with --sim-config")
+
+
+def replay(path, out_folder, config_path=None, gui=False):
+    header, records, footer = read_trace(path)
+    config = find_config(header["config_name"], config_path)
+    controller = header["controller"]
+    output_path = trace_path(out_folder, header["episode_id"], controller, header["enhancements"])
+    if os.path.abspath(output_path) == os.path.abspath(path):
+        raise ValueError(f"The replay would overwrite {path}, choose another --out folder")
+    os.makedirs(out_folder, exist_ok=True)
+
+    env = SumoEnv(sim_config=config,
+                  sim_step=header["base_sim_step"],
+                  action_step=header["action_step"],
+                  episode_duration=header["episode_duration"],
+                  log_folder=LOG_DIR,
+                  gui=gui,
+                  episode_list=[header["episode_id"]],
+                  enable_measure=header["measures"],
+                  fidelity=header["fidelity"],
+                  reward_scale=header["reward_scale"],
+                  workspace_root=WORKSPACE,
+                  gridlock_detection=header["gridlock_detection"],
+                  action_mode="duration" if header["duration_actions"] else "fixed",
+                  demand_profile=header["demand_profile"],
+                  injection_window=header["injection_window"],
+                  obs_source=header["obs_source"],
+                  trace_folder=out_folder if controller == "rl" else None)
+    if env.sim_step != header["sim_step"]:
+        raise ValueError(f"Step length {env.sim_step} differs from the recorded {header['sim_step']}")
+
+    try:
+        env.reset()
+        if controller == "rl":
+            for record in records:
+                action = [record[2] % 2, record[2] // 2] if header["duration_actions"] else record[2]
+                _, _, terminated, truncated, _ = env.step(action)
+                if terminated or truncated:
+                    break
+        else:
+            env.trace_folder = out_folder
+            env.run_smart_traffic_light(header["enhancements"], tl_factory=lambda tl_id, enhancements, trace: TracePlayer(tl_id, records, trace))
+    finally:
+        # a run whose trace has no end is closed as aborted, like the original
+        env.close()
+
+    return output_path
+
+
+def compare(reference_path, replay_path):
+    with open(reference_path, 'rb') as f:
+        reference_bytes = f.read()
+    with open(replay_path, 'rb') as f:
+        replay_bytes = f.read()
+    if reference_bytes == replay_bytes:
+        return True, None
+
+    ref_header, ref_records, ref_footer = read_trace(reference_path)
+    new_header, new_records, new_footer = read_trace(replay_path)
+    if ref_header != new_header:
+        return False, f"header differs: {ref_header} != {new_header}"
+    for i, (ref, new) in enumerate(zip(ref_records, new_records)):
+        if RECORD.pack(*ref) != RECORD.pack(*new):
+            fields = [f"{name} {a!r} -> {b!r}" for name, a, b in zip(RECORD_FIELDS, ref, new) if a != b]
+            return False, f"record {i} (t={ref[0]:.1f} s) differs: " + ", ".join(fields)
+    if len(ref_records) != len(new_records):
+        return False, f"{len(ref_records)} recorded decisions, {len(new_records)} replayed"
+    return False, f"outcome differs: {ref_footer} != {new_footer}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay decision traces and check that the outcome is bit-identical")
+    parser.add_argument("traces", type=str, nargs="+", help="Trace files (.trace)")
+    parser.add_argument("--sim-config", type=str, required=False, help="SimConfig JSON of a generated network")
+    parser.add_argument("--out", type=str, default=os.path.join(LOG_DIR, "traces"), help="Folder of the replayed traces")
+    parser.add_argument("--gui", action="store_true", required=False, help="Run SUMO with the GUI")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    failures = 0
+    for path in args.traces:
+        replay_path = replay(path, args.out, args.sim_config, args.gui)
+        identical, reason = compare(path, replay_path)
+        print(f"{'OK  ' if identical else 'DIFF'} {path}" + ("" if identical else f": {reason}"))
+        failures += not identical
+
+    print(f"{len(args.traces) - failures}/{len(args.traces)} traces replayed bit-identical")
+    sys.exit(1 if failures else 0)
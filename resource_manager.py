@@ -0,0 +1,203 @@
+import os
+import re
+import glob
+import json
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict
+
+# CPU topology detection and placement of the SUMO env workers and of the PPO learner on
+# disjoint core sets, with thread budgets for torch and the BLAS libraries.
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+TRAINING_LAYOUTS = os.path.join("logs", "training", "*", "resource_layout.json")
+
+
+@dataclass
+class CpuTopology:
+    cpus: List[int]
+    numa_nodes: Dict[int, List[int]]
+    physical_cores: List[List[int]] # hyperthread siblings grouped together, ordered by NUMA node
+
+
+@dataclass
+class ResourceLayout:
+    learner_cpus: List[int]
+    env_cpus: List[List[int]]
+    torch_threads: int
+    numa_nodes: Dict[int, List[int]] = field(default_factory=dict)
+    probe: Dict[int, float] = field(default_factory=dict) # env count -> measured env steps/s
+    eval_cpus: List[int] = field(default_factory=list)     # background evaluation process, empty: unpinned
+
+    @property
+    def num_envs(self):
+        return len(self.env_cpus)
+
+
+def _parse_cpulist(text):
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def detect_topology():
+    available = sorted(os.sched_getaffinity(0))
+
+    numa_nodes = {}
+    for path in glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"):
+        node = int(re.search(r"node(\d+)/cpulist$", path).group(1))
+        node_cpus = [c for c in _parse_cpulist(_read(path)) if c in available]
+        if node_cpus:
+            numa_nodes[node] = node_cpus
+    if not numa_nodes:
+        numa_nodes = {0: available}
+
+    cpu_to_node = {c: node for node, node_cpus in numa_nodes.items() for c in node_cpus}
+
+    physical_cores, seen = [], set()
+    for cpu in available:
+        if cpu in seen:
+            continue
+        siblings_path = f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list"
+        siblings = _parse_cpulist(_read(siblings_path)) if os.path.exists(siblings_path) else [cpu]
+        siblings = [c for c in siblings if c in available]
+        seen.update(siblings)
+        physical_cores.append(siblings)
+
+    physical_cores.sort(key=lambda core: (cpu_to_node.get(core[0], 0), core[0]))
+    return CpuTopology(available, numa_nodes, physical_cores)
+
+
+def plan_layout(topology, num_envs=None, learner_cores=2, eval_cores=0):
+    # The learner takes the first physical cores, every env worker gets a physical core of
+    # its own (cores are shared round-robin only when there are more envs than cores).
+    # With eval_cores the next cores go to the background evaluation process, as long as one
+    # core is left to the env workers; otherwise the evaluator runs unpinned.
+    cores = topology.physical_cores
+    learner_cores = min(learner_cores, max(1, len(cores) - 1))
+    learner = cores[:learner_cores]
+    eval_cores = min(eval_cores, max(0, len(cores) - learner_cores - 1))
+    evaluator = cores[learner_cores:learner_cores + eval_cores]
+    remaining = cores[learner_cores + eval_cores:] or cores
+
+    # interleave NUMA nodes so the env workers are spread over the memory controllers
+    cpu_to_node = {c: node for node, node_cpus in topology.numa_nodes.items() for c in node_cpus}
+    by_node = {}
+    for core in remaining:
+        by_node.setdefault(cpu_to_node.get(core[0], 0), []).append(core)
+    interleaved = []
+    while any(by_node.values()):
+        for node in sorted(by_node):
+            if by_node[node]:
+                interleaved.append(by_node[node].pop(0))
+
+    if num_envs is None:
+        num_envs = len(interleaved)
+    env_cpus = [interleaved[i % len(interleaved)] for i in range(num_envs)]
+
+    learner_cpus = [c for core in learner for c in core]
+    eval_cpus = [c for core in evaluator for c in core]
+    return ResourceLayout(learner_cpus, env_cpus, torch_threads=len(learner), numa_nodes=topology.numa_nodes, eval_cpus=eval_cpus)
+
+
+def pin_current_process(cpus):
+    os.sched_setaffinity(0, cpus)
+
+
+def limit_worker_threads():
+    # inherited by the env workers started afterwards: SUMO and numpy need one thread each
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = "1"
+
+
+def apply_learner_layout(layout):
+    if layout.learner_cpus:
+        pin_current_process(layout.learner_cpus)
+
+    import torch
+    torch.set_num_threads(layout.torch_threads)
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(layout.torch_threads)
+    except ImportError:
+        pass
+
+
+def probe_num_envs(make_vec_env, topology, candidates, learner_cores, steps=20, eval_cores=0):
+    # Short run of each candidate env count with random actions, returns env steps/s
+    results = {}
+    for num_envs in candidates:
+        layout = plan_layout(topology, num_envs, learner_cores, eval_cores)
+        vec_env = make_vec_env(layout)
+        try:
+            vec_env.reset()
+            start = time.perf_counter()
+            for _ in range(steps):
+                vec_env.step([vec_env.action_space.sample() for _ in range(num_envs)])
+            results[num_envs] = num_envs * steps / (time.perf_counter() - start)
+        finally:
+            vec_env.close()
+        print(f"[Resources] probe {num_envs} envs: {results[num_envs]:.1f} env steps/s")
+    return results
+
+
+def log_layout(layout, log_dir):
+    data = asdict(layout)
+    data["num_envs"] = layout.num_envs
+    data["pid"] = os.getpid() # tells the evaluation processes whether the layout is still in use
+    with open(os.path.join(log_dir, "resource_layout.json"), 'w') as f:
+        json.dump(data, f, indent=2)
+
+    print(f"--- Resource layout ---")
+    print(f"NUMA nodes: {len(layout.numa_nodes)}")
+    print(f"Learner CPUs: {layout.learner_cpus} (torch threads: {layout.torch_threads})")
+    if layout.eval_cpus:
+        print(f"Evaluation CPUs: {layout.eval_cpus}")
+    print(f"Env workers: {layout.num_envs}")
+    for rank, cpus in enumerate(layout.env_cpus):
+        print(f"  env {rank}: CPUs {cpus}")
+    print(f"--------------------------")
+
+
+def busy_cpus(pattern=TRAINING_LAYOUTS):
+    # CPUs of the layouts whose training process is still running
+    cpus = set()
+    for path in glob.glob(pattern):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if "pid" not in data or not os.path.exists(f"/proc/{data['pid']}"):
+            continue
+        cpus.update(data["learner_cpus"], data.get("eval_cpus", []))
+        for env_cpus in data["env_cpus"]:
+            cpus.update(env_cpus)
+    return cpus
+
+
+def configure_evaluation_process(log_dir):
+    # single env + single observation inference: one physical core, one torch thread. The core
+    # is one left free by the running trainings, without one the process stays unpinned.
+    topology = detect_topology()
+    busy = busy_cpus()
+    free_cores = [core for core in topology.physical_cores if not busy.intersection(core)]
+    if not free_cores:
+        print("[Resources] every core is used by a running training: evaluation not pinned")
+    layout = ResourceLayout(free_cores[0] if free_cores else [], [], torch_threads=1, numa_nodes=topology.numa_nodes)
+    apply_learner_layout(layout)
+    log_layout(layout, log_dir)
+    return layout
@@ -0,0 +1,209 @@
+import os
+import re
+import sqlite3
+import datetime
+import argparse
+import numpy as np
+
+# SQLite store for the results of the evaluation runs (test.py), with indexed per-scenario
+# aggregation over any set of runs.
+
+DEFAULT_DB = os.path.join("logs", "results.db")
+
+MEASURE_KEYS = ["totalDistance", "totalTravelTime", "totalWaitingTime", "meanSpeed", "totalCO2Emissions", "totalCOEmissions",
+                "totalHCEmissions", "totalPMxEmissions", "totalNOxEmissions", "totalFuelConsumption",
+                "totalElectricityConsumption", "totalNoiseEmission"]
+SUMMARY_KEYS = ["totalTravelTime", "totalWaitingTime", "totalCO2Emissions"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    train_id INTEGER,
+    source TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS controllers (
+    controller_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    episode_id INTEGER PRIMARY KEY,
+    scenario TEXT,
+    vehicle_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS measures (
+    run_id INTEGER NOT NULL,
+    controller_id INTEGER NOT NULL,
+    episode_id INTEGER NOT NULL,
+    vehicleID TEXT NOT NULL,
+    {", ".join(f"{key} REAL" for key in MEASURE_KEYS)},
+    PRIMARY KEY (run_id, controller_id, episode_id, vehicleID)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_runs_model ON runs(model);
+CREATE INDEX IF NOT EXISTS idx_episodes_scenario ON episodes(scenario);
+CREATE INDEX IF NOT EXISTS idx_measures_controller_episode ON measures(controller_id, episode_id, run_id);
+CREATE INDEX IF NOT EXISTS idx_measures_episode ON measures(episode_id);
+"""
+
+
+def scenario_name(scenario):
+    # Scenario enum, its value or the "Scenario.HIGH" form written in episode_info files
+    value = getattr(scenario, "value", scenario)
+    return str(value).split(".")[-1].lower()
+
+
+class ResultsStore:
+    def __init__(self, path=DEFAULT_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._controllers = {}
+
+    def close(self):
+        self.conn.close()
+
+    def add_run(self, model, train_id=None, source=None):
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO runs (model, train_id, source, created_at) VALUES (?, ?, ?, ?)",
+                                       (model, train_id, source, datetime.datetime.now().isoformat(timespec="seconds")))
+        return cursor.lastrowid
+
+    def controller_id(self, name):
+        if name not in self._controllers:
+            with self.conn:
+                self.conn.execute("INSERT OR IGNORE INTO controllers (name) VALUES (?)", (name,))
+            row = self.conn.execute("SELECT controller_id FROM controllers WHERE name = ?", (name,)).fetchone()
+            self._controllers[name] = row[0]
+        return self._controllers[name]
+
+    def add_episode(self, episode_id, scenario, vehicle_count):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO episodes (episode_id, scenario, vehicle_count) VALUES (?, ?, ?)",
+                              (episode_id, scenario_name(scenario), vehicle_count))
+
+    def add_measures(self, run_id, controller, episode_id, measures):
+        controller_id = self.controller_id(controller)
+        rows = ((run_id, controller_id, episode_id, m["vehicleID"], *(m[key] for key in MEASURE_KEYS)) for m in measures)
+        placeholders = ", ".join("?" * (4 + len(MEASURE_KEYS)))
+
+        # one transaction per bulk insert
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO measures (run_id, controller_id, episode_id, vehicleID, {', '.join(MEASURE_KEYS)}) "
+                                  f"VALUES ({placeholders})", rows)
+
+    def find_runs(self, models=None):
+        if not models:
+            return [row[0] for row in self.conn.execute("SELECT run_id FROM runs")]
+        placeholders = ", ".join("?" * len(models))
+        return [row[0] for row in self.conn.execute(f"SELECT run_id FROM runs WHERE model IN ({placeholders})", models)]
+
+    def scenario_summary(self, run_ids, controllers=None, percentiles=(50, 90, 95), keys=SUMMARY_KEYS):
+        # Per (model, controller, scenario): vehicle count, mean and percentiles of every key
+        if not run_ids:
+            return []
+
+        run_filter = f"m.run_id IN ({', '.join('?' * len(run_ids))})"
+        params = list(run_ids)
+        controller_filter = ""
+        if controllers:
+            controller_filter = f" AND c.name IN ({', '.join('?' * len(controllers))})"
+            params += list(controllers)
+
+        groups = self.conn.execute(
+            f"SELECT r.model, c.name, c.controller_id, e.scenario, COUNT(*), {', '.join(f'AVG(m.{key})' for key in keys)} "
+            f"FROM measures m JOIN runs r ON r.run_id = m.run_id JOIN controllers c ON c.controller_id = m.controller_id "
+            f"JOIN episodes e ON e.episode_id = m.episode_id "
+            f"WHERE {run_filter}{controller_filter} "
+            f"GROUP BY r.model, c.controller_id, e.scenario ORDER BY r.model, c.name, e.scenario", params).fetchall()
+
+        runs_by_model = {}
+        for run_id, model in self.conn.execute(f"SELECT run_id, model FROM runs WHERE run_id IN ({', '.join('?' * len(run_ids))})", list(run_ids)):
+            runs_by_model.setdefault(model, []).append(run_id)
+
+        summary = []
+        for model, controller, controller_id, scenario, count, *means in groups:
+            model_runs = runs_by_model[model]
+            cursor = self.conn.execute(
+                f"SELECT {', '.join(f'm.{key}' for key in keys)} FROM measures m JOIN episodes e ON e.episode_id = m.episode_id "
+                f"WHERE m.controller_id = ? AND e.scenario = ? AND m.run_id IN ({', '.join('?' * len(model_runs))})",
+                [controller_id, scenario] + model_runs)
+            values = np.fromiter(cursor, dtype=np.dtype((np.float64, len(keys))), count=count)
+
+            row = {"model": model, "controller": controller, "scenario": scenario, "vehicles": count}
+            for i, key in enumerate(keys):
+                row[f"{key}_mean"] = means[i]
+                for p, value in zip(percentiles, np.percentile(values[:, i], percentiles)):
+                    row[f"{key}_p{p}"] = float(value)
+            summary.append(row)
+        return summary
+
+    def ingest_test_dir(self, log_dir, model, train_id=None):
+        # Loads the files written by test.py (episode_info_ep*.txt and *_measures_ep*.txt)
+        run_id = self.add_run(model, train_id, source=log_dir)
+
+        for file_name in sorted(os.listdir(log_dir)):
+            match = re.fullmatch(r"episode_info_ep(\d+)\.txt", file_name)
+            if match:
+                with open(os.path.join(log_dir, file_name)) as f:
+                    text = f.read()
+                scenario = re.search(r"Scenario Type\s*:\s*(\S+)", text).group(1)
+                vehicles = int(re.search(r"Total Vehicles\s*:\s*(\d+)", text).group(1))
+                self.add_episode(int(match.group(1)), scenario, vehicles)
+
+        for file_name in sorted(os.listdir(log_dir)):
+            match = re.fullmatch(r"(\w+?)_measures_ep(\d+)\.txt", file_name)
+            if match:
+                self.add_measures(run_id, match.group(1), int(match.group(2)), read_measures_file(os.path.join(log_dir, file_name)))
+
+        return run_id
+
+
+def read_measures_file(path):
+    with open(path) as f:
+        keys = f.readline().rstrip("\n").rstrip(";").split(";")
+        measures = []
+        for line in f:
+            values = line.rstrip("\n").rstrip(";").split(";")
+            if len(values) != len(keys):
+                continue
+            measure = {"vehicleID": values[0]}
+            measure.update({k: float(v) for k, v in zip(keys[1:], values[1:])})
+            measures.append(measure)
+    return measures
+
+
+def print_summary(summary, keys=SUMMARY_KEYS):
+    for row in summary:
+        print(f"--- {row['model']} / {row['controller']} / {row['scenario']} ({row['vehicles']} vehicles) ---")
+        for key in keys:
+            stats = ", ".join(f"{name.split('_')[-1]}={value:.2f}" for name, value in row.items() if name.startswith(key + "_"))
+            print(f"{key}: {stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Results database of the evaluation runs")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB, help="SQLite database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Load the files of a test.py run")
+    ingest_parser.add_argument("--id", type=int, required=True, help="Training ID of the tested model")
+
+    summary_parser = subparsers.add_parser("summary", help="Per-scenario means and percentiles")
+    summary_parser.add_argument("--models", type=str, nargs="*", help="Models to include (default: all runs)")
+    summary_parser.add_argument("--controllers", type=str, nargs="*", help="Controllers to include, e.g. ppo stl12")
+    summary_parser.add_argument("--percentiles", type=int, nargs="+", default=[50, 90, 95])
+
+    args = parser.parse_args()
+    store = ResultsStore(args.db)
+
+    if args.command == "ingest":
+        log_dir = os.path.join("logs", "tests", f"train_id_{args.id}")
+        run_id = store.ingest_test_dir(log_dir, f"PPO_{args.id}", args.id)
+        print(f"Run {run_id} loaded from {log_dir}")
+    else:
+        print_summary(store.scenario_summary(store.find_runs(args.models), args.controllers, args.percentiles))
+
+    store.close()
@@ -0,0 +1,224 @@
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import dataclasses
+import numpy as np
+from sim_config import CONFIG_4WAY_160M
+from traffic_generator import TrafficGenerator, GENERATOR_VERSION
+from episode_sets import EVALUATION_IDS
+
+# SQLite catalog of episode ids: scenario, vehicle count and route mix of every episode,
+# from TrafficGenerator.generate_demand (the vehicles are not built). Large id ranges are
+# described in parallel, in chunks. Episodes are then picked by query and assigned to named
+# splits; an episode belongs to one split at most, so the splits are disjoint. The fixed
+# evaluation sets of episode_sets (test, validation, pool) are never assigned.
+#
+#   ns_share    share of the vehicles on the N-S routes
+#   imbalance   |N-S - E-W| / vehicles, 0 balanced, 1 one axis only
+#   left_share  share of the left turns
+
+DEFAULT_CATALOG = os.path.join("cache", "scenario_catalog.db")
+CHUNK_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    episode_id INTEGER PRIMARY KEY,
+    scenario TEXT NOT NULL,
+    vehicle_count INTEGER NOT NULL,
+    ns_share REAL NOT NULL,
+    imbalance REAL NOT NULL,
+    left_share REAL NOT NULL,
+    split TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_scenario_vehicles ON episodes(scenario, vehicle_count);
+CREATE INDEX IF NOT EXISTS idx_catalog_imbalance ON episodes(imbalance);
+CREATE INDEX IF NOT EXISTS idx_catalog_split ON episodes(split);
+"""
+
+
+def generator_fingerprint(sim_config):
+    # the catalog is valid for one generator version and one demand configuration
+    config = json.dumps(dataclasses.asdict(sim_config), sort_keys=True)
+    return hashlib.sha1(f"{GENERATOR_VERSION}:{config}".encode()).hexdigest()
+
+
+def describe_episodes(episode_ids, sim_step=0.5):
+    # runs in the pool workers
+    traffic_gen = TrafficGenerator(CONFIG_4WAY_160M, sim_step)
+    groups = {route: group for group, routes in CONFIG_4WAY_160M.routes_map.items() for route in routes}
+    ns_routes = np.array([groups[r].startswith("NS") for r in CONFIG_4WAY_160M.route_ids])
+    left_routes = np.array([groups[r].endswith("Left") for r in CONFIG_4WAY_160M.route_ids])
+    route_index = {r: i for i, r in enumerate(CONFIG_4WAY_160M.route_ids)}
+
+    rows = []
+    for episode_id in episode_ids:
+        scenario, n_vehicles, _, routes = traffic_gen.generate_demand(episode_id)
+        counts = np.bincount([route_index[r] for r in routes], minlength=len(route_index))
+        n = max(1, n_vehicles)
+        ns = counts[ns_routes].sum() / n
+        rows.append((episode_id, scenario.value, n_vehicles, float(ns), float(abs(2 * ns - 1)), float(counts[left_routes].sum() / n)))
+    return rows
+
+
+class ScenarioCatalog:
+    def __init__(self, path=DEFAULT_CATALOG, sim_config=CONFIG_4WAY_160M):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+        fingerprint = generator_fingerprint(sim_config)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'generator'").fetchone()
+        if row is None:
+            with self.conn:
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('generator', ?)", (fingerprint,))
+        elif row[0] != fingerprint:
+            raise ValueError(f"{path} was built with another traffic generator or configuration: delete it and rebuild")
+
+    def close(self):
+        self.conn.close()
+
+    def missing(self, first, last):
+        known = {row[0] for row in self.conn.execute("SELECT episode_id FROM episodes WHERE episode_id BETWEEN ? AND ?", (first, last))}
+        return [episode_id for episode_id in range(first, last + 1) if episode_id not in known]
+
+    def build(self, first, last, workers=1, chunk_size=CHUNK_SIZE):
+        # only the ids not already in the catalog are described
+        episode_ids = self.missing(first, last)
+        chunks = [episode_ids[i:i + chunk_size] for i in range(0, len(episode_ids), chunk_size)]
+        if workers > 1:
+            import multiprocessing as mp
+            with mp.get_context("spawn").Pool(workers) as pool:
+                for rows in pool.imap_unordered(describe_episodes, chunks):
+                    self._insert(rows)
+        else:
+            for chunk in chunks:
+                self._insert(describe_episodes(chunk))
+        return len(episode_ids)
+
+    def _insert(self, rows):
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO episodes (episode_id, scenario, vehicle_count, ns_share, imbalance, left_share) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def _filter(self, scenarios=None, min_vehicles=None, max_vehicles=None, min_imbalance=None, max_imbalance=None,
+                first=None, last=None, split=None):
+        # split: a split name, "none" for the unassigned episodes, None for any
+        clauses, params = [], []
+        if scenarios:
+            clauses.append(f"scenario IN ({', '.join('?' * len(scenarios))})")
+            params += list(scenarios)
+        for column, op, value in [("vehicle_count", ">=", min_vehicles), ("vehicle_count", "<=", max_vehicles),
+                                  ("imbalance", ">=", min_imbalance), ("imbalance", "<=", max_imbalance),
+                                  ("episode_id", ">=", first), ("episode_id", "<=", last)]:
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if split == "none":
+            clauses.append("split IS NULL")
+        elif split is not None:
+            clauses.append("split = ?")
+            params.append(split)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit=None, **filters):
+        where, params = self._filter(**filters)
+        sql = f"SELECT episode_id, scenario, vehicle_count, ns_share, imbalance, left_share, split FROM episodes{where} ORDER BY episode_id"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return self.conn.execute(sql, params).fetchall()
+
+    def assign(self, split, count=None, seed=0, **filters):
+        # count episodes drawn among the unassigned ones matching the filters (all of them without count)
+        if split == "none":
+            raise ValueError("'none' is reserved for the unassigned episodes")
+        where, params = self._filter(split="none", **filters)
+        candidates = [row[0] for row in self.conn.execute(f"SELECT episode_id FROM episodes{where}", params) if row[0] not in EVALUATION_IDS]
+        if count is not None and count < len(candidates):
+            candidates = sorted(np.random.default_rng(seed).choice(candidates, size=count, replace=False).tolist())
+        with self.conn:
+            self.conn.executemany("UPDATE episodes SET split = ? WHERE episode_id = ?", [(split, e) for e in candidates])
+        return candidates
+
+    def split_ids(self, split):
+        return [row[0] for row in self.conn.execute("SELECT episode_id FROM episodes WHERE split = ? ORDER BY episode_id", (split,))]
+
+    def summary(self):
+        return self.conn.execute("SELECT COALESCE(split, 'none'), scenario, COUNT(*), AVG(vehicle_count), AVG(imbalance) "
+                                 "FROM episodes GROUP BY split, scenario ORDER BY split, scenario").fetchall()
+
+
+def split_ids(split, path=DEFAULT_CATALOG):
+    catalog = ScenarioCatalog(path)
+    try:
+        episode_ids = catalog.split_ids(split)
+    finally:
+        catalog.close()
+    if not episode_ids:
+        raise ValueError(f"Split {split} is empty or missing in {path}")
+    return episode_ids
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--scenario", type=str, nargs="+", help="Scenarios (low, medium, high, unbalanced, wave)")
+    parser.add_argument("--min-vehicles", type=int)
+    parser.add_argument("--max-vehicles", type=int)
+    parser.add_argument("--min-imbalance", type=float)
+    parser.add_argument("--max-imbalance", type=float)
+    parser.add_argument("--first", type=int, help="First episode ID")
+    parser.add_argument("--last", type=int, help="Last episode ID")
+
+
+def filter_kwargs(args):
+    return {"scenarios": args.scenario, "min_vehicles": args.min_vehicles, "max_vehicles": args.max_vehicles,
+            "min_imbalance": args.min_imbalance, "max_imbalance": args.max_imbalance, "first": args.first, "last": args.last}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog of episode ids by scenario, vehicle count and route mix")
+    parser.add_argument("--catalog", type=str, default=DEFAULT_CATALOG)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Describe an episode id range")
+    build_parser.add_argument("--first", type=int, required=True)
+    build_parser.add_argument("--last", type=int, required=True)
+    build_parser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    query_parser = subparsers.add_parser("query", help="List the matching episodes")
+    add_filter_arguments(query_parser)
+    query_parser.add_argument("--split", type=str, help="Split name, or none for the unassigned episodes")
+    query_parser.add_argument("--limit", type=int, default=50)
+
+    assign_parser = subparsers.add_parser("assign", help="Assign unassigned matching episodes to a split")
+    assign_parser.add_argument("split", type=str)
+    add_filter_arguments(assign_parser)
+    assign_parser.add_argument("--count", type=int, help="Episodes drawn at random (default: all matching)")
+    assign_parser.add_argument("--seed", type=int, default=0)
+
+    subparsers.add_parser("summary", help="Episodes per split and scenario")
+
+    args = parser.parse_args()
+    catalog = ScenarioCatalog(args.catalog)
+    try:
+        if args.command == "build":
+            n = catalog.build(args.first, args.last, args.workers)
+            print(f"{n} episodes described")
+        elif args.command == "query":
+            print(f"{'episode':>9} {'scenario':>11} {'vehicles':>9} {'NS':>6} {'imbal.':>7} {'left':>6} {'split':>10}")
+            for episode_id, scenario, vehicles, ns, imbalance, left, split in catalog.query(limit=args.limit, split=args.split, **filter_kwargs(args)):
+                print(f"{episode_id:>9} {scenario:>11} {vehicles:>9} {ns:>6.2f} {imbalance:>7.2f} {left:>6.2f} {split or '':>10}")
+        elif args.command == "assign":
+            assigned = catalog.assign(args.split, count=args.count, seed=args.seed, **filter_kwargs(args))
+            print(f"{len(assigned)} episodes assigned to {args.split}")
+        elif args.command == "summary":
+            print(f"{'split':>10} {'scenario':>11} {'episodes':>9} {'vehicles':>9} {'imbal.':>7}")
+            for split, scenario, count, vehicles, imbalance in catalog.summary():
+                print(f"{split:>10} {scenario:>11} {count:>9} {vehicles:>9.0f} {imbalance:>7.2f}")
+    finally:
+        catalog.close()
@@ -14,6 +14,10 @@ class SimConfig:
     route_ids: List[str] = field(init=False)
     routes_map: Dict[str, List[str]]
     description: str = ""
+    obs_lanes: List[str] = field(default_factory=list) # incoming lanes of tl_id, rows of the DTSE grid
+    lane_length: float = 160                           # observed length of every incoming lane (m)
+    demand_scale: float = 1.0                          # multiplies the vehicle count of every scenario
+    template_dir: str = "sumo_xml_template_files"      # folder holding the <name> network folder
 
     def __post_init__(self):
         all_lists = self.routes_map.values()
@@ -40,5 +44,14 @@ CONFIG_4WAY_160M = SimConfig(
         "EW_Left":     ["route3", "route8"]
     },
 
-    description="Incrocio a 4 vie. Ogni braccio è lungo 160m ed ha due corsie per senso di marcia"
+    description="Incrocio a 4 vie. Ogni braccio è lungo 160m ed ha due corsie per senso di marcia",
+
+    # TO BE FIXED: hardcoded lane order
+    obs_lanes=[
+        "E4_0", "E4_1", # Nord (Incoming)
+        "E3_0", "E3_1", # Est
+        "E2_0", "E2_1", # Sud
+        "E1_0", "E1_1"  # Ovest
+    ],
+    lane_length=160
 )
\ No newline at end of file
@@ -0,0 +1,45 @@
+import numpy as np
+from stable_baselines3.common.buffers import RolloutBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Semi-MDP support for the duration action mode of SumoEnv: decisions cover a variable time,
+# so the discount between two decisions is gamma ** (duration / reference_duration), with
+# gamma the discount of one reference_duration (the action_step of the fixed mode).
+# The duration of every decision comes from info["duration"].
+
+
+class SMDPRolloutBuffer(RolloutBuffer):
+    def __init__(self, *args, reference_duration=10.0, **kwargs):
+        self.reference_duration = reference_duration
+        super().__init__(*args, **kwargs)
+
+    def reset(self):
+        self.durations = np.full((self.buffer_size, self.n_envs), self.reference_duration, dtype=np.float32)
+        super().reset()
+
+    def compute_returns_and_advantage(self, last_values, dones):
+        # GAE of RolloutBuffer with a per decision discount
+        last_values = last_values.clone().cpu().numpy().flatten()
+
+        last_gae_lam = 0
+        for step in reversed(range(self.buffer_size)):
+            if step == self.buffer_size - 1:
+                next_non_terminal = 1.0 - dones.astype(np.float32)
+                next_values = last_values
+            else:
+                next_non_terminal = 1.0 - self.episode_starts[step + 1]
+                next_values = self.values[step + 1]
+            discount = self.gamma ** (self.durations[step] / self.reference_duration)
+            delta = self.rewards[step] + discount * next_values * next_non_terminal - self.values[step]
+            last_gae_lam = delta + discount * self.gae_lambda * next_non_terminal * last_gae_lam
+            self.advantages[step] = last_gae_lam
+        self.returns = self.advantages + self.values
+
+
+class SMDPDurations(BaseCallback):
+    # on_step runs before PPO adds the transition, buffer.pos is the row being filled
+    def _on_step(self):
+        buffer = self.model.rollout_buffer
+        if isinstance(buffer, SMDPRolloutBuffer) and buffer.pos < buffer.buffer_size:
+            buffer.durations[buffer.pos] = [info.get("duration", buffer.reference_duration) for info in self.locals["infos"]]
+        return True
@@ -1,83 +1,271 @@
 import gymnasium as gym
 import numpy as np
-import libsumo
 import os
+import math
+import time
 import shutil
+import pickle
 from traffic_generator import TrafficGenerator
-from xml.dom import minidom
 from gymnasium import spaces
 from sim_config import *
 from traffic_light import TrafficLight
-
+from frame_ring import FrameRing
+from gridlock import GridlockDetector
+from decision_trace import DecisionTraceWriter, trace_path
+from tripinfo_reader import TripinfoReader, apply_tripinfo, EMISSION_KEYS
+from offline_dataset import PHASE_ACTIONS
+from demand_stream import DemandStream
+from episode_prefetch import EpisodePrefetcher
+from detectors import DetectorObserver, write_detector_additional
+from vehicle_generator import VehicleList, vehicle_types_xml
+from lazy_imports import lazy_import
+
+# libsumo is loaded at the first call (or comes preloaded from the worker forkserver)
+libsumo = lazy_import("libsumo")
+
+
+# Simulation fidelity levels. sim_step None keeps the step given to the env.
+# Mesoscopic runs model the signalized junction with junction control and one queue per lane.
+FIDELITY_LEVELS = {
+    "micro":       {"mesosim": False, "sim_step": None},
+    "meso":        {"mesosim": True,  "sim_step": 1.0},
+    "meso_coarse": {"mesosim": True,  "sim_step": 2.0},
+}
+# rows of the DTSE grid of the default scenario
+OBS_LANES = CONFIG_4WAY_160M.obs_lanes
+
+# Measurement engines with enable_measure:
+#  poll      per vehicle libsumo queries every step (Vehicle.doMeasures)
+#  tripinfo  SUMO tripinfo output with the emissions device, read while the episode runs.
+#            Start/stop vehicles are still polled, only while stopped, to remove the idle
+#            emissions a start/stop engine does not produce. No per vehicle noise (NaN).
+MEASURE_MODES = ["poll", "tripinfo"]
+TRIPINFO_POLL_INTERVAL = 60 # simulated seconds between two reads of the tripinfo output
+STARTSTOP_SPEED = 0.3       # below this speed a start/stop engine is off
+
+# Observation and reward sources:
+#  dtse       per vehicle DTSE grid, reward on the waiting time of every vehicle
+#  detectors  induction loops and lane-area detectors (detectors.py), reward on the queue
+#             (halting vehicles) of the observed lanes. No starvation penalty: the waiting
+#             time of single vehicles is not known to the detectors.
+OBS_SOURCES = ["dtse", "detectors"]
+
+# route file of the vehicle types in streaming mode: the types are created through libsumo
+EMPTY_ROUTES_XML = '<?xml version="1.0" ?>\n<routes/>\n'
+
+# Action modes:
+#  fixed     Discrete(2), the chosen green is held for action_step seconds
+#  duration  MultiDiscrete([2, len(GREEN_DURATIONS)]), the policy also picks how long the green
+#            is held (semi-MDP). MIN_GREEN and MAX_GREEN are enforced on every decision.
+ACTION_MODES = ["fixed", "duration"]
+GREEN_DURATIONS = [5, 10, 15, 20, 30, 45, 60]
+MIN_GREEN = 10   # s, a new green is held at least this long
+MAX_GREEN = 180  # s, a green held this long is switched whatever the policy asks
+
+MESO_OPTIONS = [
+    "--mesosim", "true",
+    "--meso-junction-control", "true",
+    "--meso-lane-queue", "true",
+    "--meso-edgelength", "40",
+]
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
 
 class SumoEnv(gym.Env):
-    def __init__(self, sim_config, sim_step, action_step, episode_duration, log_folder, rank = 0, episode_offset = 0, enable_measure = False, gui=False, episode_list = []):
+    def __init__(self, sim_config, sim_step, action_step, episode_duration, log_folder, rank = 0, episode_offset = 0, episode_count = 0, enable_measure = False, gui=False, episode_list = [], obs_stack = 1, zero_copy_obs = False, prefetch = False, fidelity = "micro", reward_scale = 10000, workspace_root = "sumo_workspace", gridlock_detection = True, trace_folder = None, measure_mode = "poll", dataset_writer = None, action_mode = "fixed", demand_profile = None, injection_window = 60, obs_source = "dtse"):
         super(SumoEnv, self).__init__()
         self.sim_config = sim_config
         self.gui = gui
         self.rank = rank
 
-        self.template_xml_path = "sumo_xml_template_files"
-        self.workspace_path = os.path.join("sumo_workspace", f"env_{self.rank}")
+        self.template_xml_path = sim_config.template_dir
+        self.workspace_path = os.path.join(workspace_root, f"env_{self.rank}")
         self.sumo_config_path = os.path.join(
             self.workspace_path, 
-            CONFIG_4WAY_160M.name, 
-            CONFIG_4WAY_160M.name + ".sumocfg"
+            sim_config.name, 
+            sim_config.name + ".sumocfg"
         )
 
         self._setup_workspace()
+        if obs_source not in OBS_SOURCES:
+            raise ValueError(f"Unknown observation source: {obs_source}")
+        self.obs_source = obs_source
+        write_detector_additional(sim_config, self.workspace_path, lane_area=obs_source == "detectors")
+        self.detectors = DetectorObserver(sim_config) if obs_source == "detectors" else None
         self.episode_list = episode_list
         self.episode_list_mode = len(self.episode_list)
-        self.episode_count = 0
+        self.episode_count = episode_count # list mode: position of the next episode in episode_list
         self.episode_id = episode_offset
+        self.reward_scale = reward_scale
 
         self.measure_enabled = enable_measure
+        if measure_mode not in MEASURE_MODES:
+            raise ValueError(f"Unknown measure mode: {measure_mode}")
+        self.measure_mode = measure_mode
+        self._tripinfo_reader = None
+
+        # Streaming demand (demand_stream.py): vehicles are added to SUMO only injection_window
+        # seconds before their departure and dropped from Python when they arrive
+        if demand_profile is not None and enable_measure and measure_mode == "tripinfo":
+            raise ValueError("The tripinfo measures need the whole population, use measure_mode='poll' with a demand profile")
+        self.demand_profile = demand_profile
+        self.injection_window = injection_window
+        self._stream = None
+        self._stream_vehicles = {}
+        self._finished_measures = []
         self.active_vehicles = set()
         self.vehicle_list = []
-        self.obs_history = []
         
-        self.sim_step = sim_step
+        self.base_sim_step = sim_step
         self.action_step = action_step
         self.episode_duration = episode_duration
 
-        self.steps_per_action = int(action_step / sim_step)
         self.traffic_gen = TrafficGenerator(self.sim_config, sim_step)
+        self._pending_fidelity = None
+        self._set_fidelity_now(fidelity)
 
         self.log_folder = log_folder
 
+        # Background generation of the next episode population while the current one runs, in
+        # a child process (episode_prefetch.py); at most one prefetched episode in flight.
+        self.prefetch = prefetch and demand_profile is None # a demand stream is built while it runs
+        self._prefetcher = EpisodePrefetcher(sim_config) if self.prefetch else None
+
         # Action 0: N/S Green
         # Action 1: E/W Green
         self.action_space = spaces.Discrete(2)
+        if action_mode not in ACTION_MODES:
+            raise ValueError(f"Unknown action mode: {action_mode}")
+        self.action_mode = action_mode
+        if action_mode == "duration":
+            # plus the index of the green duration in GREEN_DURATIONS
+            self.action_space = spaces.MultiDiscrete([2, len(GREEN_DURATIONS)])
         
         # Discrete Traffic State Encoding DTSE
-        self.num_lanes = 8 
-        self.lane_length = 160 
+        self.num_lanes = len(sim_config.obs_lanes) 
+        self.lane_length = sim_config.lane_length 
         self.cell_length = 5 
         self.num_cells = int(self.lane_length / self.cell_length) 
         
-        # Matrix (8 * 32) + phase (2 one-hot) + duration (1 float)
+        # Matrix (lanes * cells, 8 * 32 on the 4-way crossing) + phase (2 one-hot) + duration (1 float)
         input_dims = (self.num_lanes * self.num_cells) + 3 
+        if self.detectors is not None:
+            input_dims = self.detectors.obs_size + 3
+
+        # Temporal stacking: the last obs_stack frames are kept in a preallocated ring buffer.
+        # With zero_copy_obs the returned observation is a view, valid until the next step.
+        self.obs_stack = obs_stack
+        self.zero_copy_obs = zero_copy_obs
+        self.obs_history = FrameRing(obs_stack, input_dims)
         
         self.observation_space = spaces.Box(
-            low=-1, high=1, shape=(input_dims,), dtype=np.float32
+            low=-1, high=1, shape=(input_dims * obs_stack,), dtype=np.float32
         )
 
         self.lane_ids_list = []
 
+        # teleports are disabled: a deadlocked network ends the episode (RL and STL runs)
+        self.gridlock = GridlockDetector() if gridlock_detection else None
+        self.last_gridlock = None
+
+        # one decision trace per controller run, see decision_trace.py
+        self.trace_folder = trace_folder
+        self.trace = None
+        if trace_folder is not None:
+            os.makedirs(trace_folder, exist_ok=True)
+
+        # transitions of the STL and PPO runs for offline learning, see offline_dataset.py
+        self.dataset_writer = dataset_writer
+        self._dataset_obs = None
+
     def _reset_vehicles_measures(self):
         for v in self.vehicle_list:
             v.resetMeasures()
     
-    def run_smart_traffic_light(self, improvments):
+    def run_smart_traffic_light(self, improvments, tl_factory=TrafficLight):
+        self._open_trace("stl", improvments)
         self._reset_vehicles_measures()
         self._startSumo(self.sumo_config_path, self.sim_step, self.log_folder, self.episode_id)
-        self._addVehiclesToSimulation(self.vehicle_list)
+        self._add_demand()
         libsumo.trafficlight.setProgram(self.sim_config.tl_id, self.sim_config.tl_program)
-        tl = TrafficLight(self.sim_config.tl_id, improvments)
-        while libsumo.simulation.getMinExpectedNumber() > 0:
+        tl = tl_factory(self.sim_config.tl_id, improvments, trace=self.trace)
+        if self.gridlock is not None:
+            self.gridlock.reset()
+        # a gridlock of the PPO run or of an earlier STL variant is not this run's
+        self.last_gridlock = None
+        end_reason = "terminated"
+        if self.dataset_writer is not None:
+            self._start_stl_recording()
+        while self._traffic_left():
             self._simulation_step()
             tl.performStep()
+            if self.dataset_writer is not None:
+                self._stl_recording_step()
+            if self.gridlock is not None and self.gridlock.gridlocked:
+                # no natural end time in a deadlock: time saved is counted up to episode_duration
+                self._log_gridlock(f"stl{''.join(map(str, improvments))}")
+                end_reason = "gridlock"
+                break
+        if self.dataset_writer is not None:
+            self._finish_stl_recording()
+        self._close_trace(end_reason)
+
+    def _start_stl_recording(self):
+        # the STL decisions are sampled on the RL decision grid (every action_step seconds)
+        self.obs_history.clear()
+        self._dataset_obs = np.array(self._observe())
+        self._next_decision = libsumo.simulation.getTime() + self.action_step
+        self._decision_waiting_time = 0.0
+        self._decision_max_waiting_time = 0.0
+
+    def _stl_recording_step(self):
+        step_weight = self.sim_step / self.base_sim_step
+        _, waiting_time, max_waiting_time = self._step_costs(libsumo.simulation.getDeltaT(), step_weight)
+        self._decision_waiting_time += waiting_time
+        self._decision_max_waiting_time = max(self._decision_max_waiting_time, max_waiting_time)
+
+        if libsumo.simulation.getTime() >= self._next_decision:
+            action = PHASE_ACTIONS[libsumo.trafficlight.getPhase(self.sim_config.tl_id)]
+            reward, _ = self._reward(self._decision_waiting_time, self._decision_max_waiting_time)
+            self.dataset_writer.append(self._dataset_obs, action, reward, False)
+            self._dataset_obs = np.array(self._observe())
+            self._next_decision += self.action_step
+            self._decision_waiting_time = 0.0
+            self._decision_max_waiting_time = 0.0
+
+    def _finish_stl_recording(self):
+        # the steps after the last decision are dropped, the last transition is terminal
+        self.dataset_writer.end_episode()
+
+    def set_fidelity(self, fidelity):
+        # applied at the next reset
+        if fidelity not in FIDELITY_LEVELS:
+            raise ValueError(f"Unknown fidelity level: {fidelity}")
+        self._pending_fidelity = fidelity
+
+    def _set_fidelity_now(self, fidelity):
+        if fidelity not in FIDELITY_LEVELS:
+            raise ValueError(f"Unknown fidelity level: {fidelity}")
+        level = FIDELITY_LEVELS[fidelity]
+        self.fidelity = fidelity
+        self.mesosim = level["mesosim"]
+        self.sim_step = level["sim_step"] or self.base_sim_step
+        self.steps_per_action = int(self.action_step / self.sim_step)
+        self.traffic_gen.simulation_step = self.sim_step
+
+    def _apply_pending_fidelity(self):
+        if self._pending_fidelity is None:
+            return
+
+        # an episode prefetched with the old step length is regenerated by _take_episode
+        self._set_fidelity_now(self._pending_fidelity)
+        self._pending_fidelity = None
 
     def _startSumo(self, config_file_path, simulation_step, log_folder, episode_index):
         try:
@@ -86,7 +274,7 @@ class SumoEnv(gym.Env):
             pass
 
         sumo_log_file = os.path.join(log_folder, f"sumo_output_ep{episode_index}.txt")
-        libsumo.start([
+        sumo_cmd = [
             "sumo", 
             "-c", config_file_path, 
             "--waiting-time-memory", "3600", 
@@ -96,39 +284,191 @@ class SumoEnv(gym.Env):
             "--step-length", str(simulation_step),
             "--log", sumo_log_file,
             "--time-to-teleport", "-1" # disable teleport
-            ])
+            ]
+        if self.mesosim:
+            sumo_cmd += MESO_OPTIONS
+        tripinfo_path = os.path.join(self.workspace_path, "tripinfo.xml")
+        if self.measure_enabled and self.measure_mode == "tripinfo":
+            sumo_cmd += [
+                "--tripinfo-output", tripinfo_path,
+                "--tripinfo-output.write-unfinished", "true",
+                "--device.emissions.probability", "1",
+            ]
+        libsumo.start(sumo_cmd)
+        if self.detectors is not None:
+            self.detectors.subscribe()
+        if self.measure_enabled and self.measure_mode == "tripinfo":
+            self._start_tripinfo(tripinfo_path)
+
+    def _start_tripinfo(self, tripinfo_path):
+        self._tripinfo_reader = TripinfoReader(tripinfo_path)
+        self._tripinfo_done = False
+        self._next_tripinfo_poll = TRIPINFO_POLL_INTERVAL
+        self._vehicle_index = {v.vehicleID: v for v in self.vehicle_list}
+        self._startstop_ids = {v.vehicleID for v in self.vehicle_list if v.hasStartStop}
+        self._idle_emissions = {}
+
+    def _measure_startstop_idle(self):
+        delta_t = libsumo.simulation.getDeltaT()
+        for vehicle_id in self.active_vehicles & self._startstop_ids:
+            if libsumo.vehicle.getSpeed(vehicle_id) >= STARTSTOP_SPEED:
+                continue
+            idle = self._idle_emissions.setdefault(vehicle_id, dict.fromkeys(EMISSION_KEYS, 0.0))
+            idle["totalCO2Emissions"] += (libsumo.vehicle.getCO2Emission(vehicle_id) * delta_t) / 1000
+            idle["totalCOEmissions"] += (libsumo.vehicle.getCOEmission(vehicle_id) * delta_t) / 1000
+            idle["totalHCEmissions"] += (libsumo.vehicle.getHCEmission(vehicle_id) * delta_t) / 1000
+            idle["totalPMxEmissions"] += (libsumo.vehicle.getPMxEmission(vehicle_id) * delta_t) / 1000
+            idle["totalNOxEmissions"] += (libsumo.vehicle.getNOxEmission(vehicle_id) * delta_t) / 1000
+            idle["totalFuelConsumption"] += (libsumo.vehicle.getFuelConsumption(vehicle_id) * delta_t) / 1000
+
+    def _read_tripinfo(self):
+        for trip in self._tripinfo_reader.poll():
+            vehicle = self._vehicle_index.get(trip["id"])
+            if vehicle is not None:
+                apply_tripinfo(vehicle, trip, self._idle_emissions.pop(trip["id"], None))
+
+    def _finish_tripinfo(self):
+        # SUMO flushes the output (and writes the unfinished trips) only when the simulation
+        # is closed: after the measures are read the simulation has to be started again
+        if self._tripinfo_reader is None or self._tripinfo_done:
+            return
+        libsumo.close()
+        self._read_tripinfo()
+        self._tripinfo_done = True
+
+    def _add_demand(self):
+        if self.demand_profile is None:
+            self._addVehiclesToSimulation(self.vehicle_list)
+            return
+
+        # every SUMO start replays the stream of the episode from its beginning
+        self._stream = DemandStream(self.traffic_gen, self.episode_id, self.demand_profile)
+        self._stream_vehicles = {}
+        self._finished_measures = []
+        self.active_vehicles = set()
+        self.vehicle_num = 0
+        self._inject_window()
+
+    def _inject_window(self):
+        vehicles = self._stream.take_until(libsumo.simulation.getTime() + self.injection_window)
+        for v in vehicles:
+            self._addVehicleType(v)
+            self._stream_vehicles[v.vehicleID] = v
+        self._addVehiclesToSimulation(vehicles)
+        self.vehicle_num += len(vehicles)
+
+    def _drop_arrived(self, arrived_ids):
+        for vehicle_id in arrived_ids:
+            vehicle = self._stream_vehicles.pop(vehicle_id, None)
+            if vehicle is not None and self.measure_enabled:
+                self._finished_measures.append(self._vehicle_measures(vehicle))
+
+    def _traffic_left(self):
+        return libsumo.simulation.getMinExpectedNumber() > 0 or (self._stream is not None and not self._stream.exhausted)
+
+    def _addVehicleType(self, v):
+        # same attributes as _buildVehicleTypesXML
+        type_id = 'vtype-' + v.vehicleID
+        libsumo.vehicletype.copy("DEFAULT_VEHTYPE", type_id)
+        libsumo.vehicletype.setVehicleClass(type_id, str(v.vClass))
+        libsumo.vehicletype.setLength(type_id, v.length)
+        libsumo.vehicletype.setMass(type_id, v.weight)
+        libsumo.vehicletype.setMaxSpeed(type_id, v.maxSpeed)
+        libsumo.vehicletype.setAccel(type_id, v.acceleration)
+        libsumo.vehicletype.setDecel(type_id, v.brakingAcceleration)
+        libsumo.vehicletype.setEmergencyDecel(type_id, v.fullBrakingAcceleration)
+        libsumo.vehicletype.setMinGap(type_id, v.minGap)
+        libsumo.vehicletype.setTau(type_id, v.driverProfile.tau)
+        libsumo.vehicletype.setImperfection(type_id, v.driverProfile.sigma)
+        libsumo.vehicletype.setSpeedFactor(type_id, v.driverProfile.speedLimitComplianceFactor)
+        libsumo.vehicletype.setEmissionClass(type_id, str(v.emissionClass))
+        libsumo.vehicletype.setColor(type_id, tuple(int(v.color[i:i+2], 16) for i in (1, 3, 5)) + (255,))
+        libsumo.vehicletype.setShapeClass(type_id, str(v.shape))
 
     def _addVehiclesToSimulation(self, vehicleList):
         for v in vehicleList:
             libsumo.vehicle.add(vehID=v.vehicleID, routeID=v.routeID, typeID='vtype-'+v.vehicleID, depart=v.depart, departSpeed=v.initialSpeed, departLane=v.departLane)
 
     def _generateVehicleTypesXML(self, vehicleList, output_folder):
-        rootXML = minidom.Document()
-        routes = rootXML.createElement('routes')
-        rootXML.appendChild(routes)
-
-        for v in vehicleList:
-            vtype = rootXML.createElement('vType')
-            vtype.setAttribute('id', 'vtype-'+v.vehicleID)
-            vtype.setAttribute('length', str(v.length))
-            vtype.setAttribute('mass', str(v.weight))
-            vtype.setAttribute('maxSpeed', str(v.maxSpeed))
-            vtype.setAttribute('accel', str(v.acceleration))
-            vtype.setAttribute('decel', str(v.brakingAcceleration))
-            vtype.setAttribute('emergencyDecel', str(v.fullBrakingAcceleration))
-            vtype.setAttribute('minGap', str(v.minGap))
-            vtype.setAttribute('tau', str(v.driverProfile.tau))
-            vtype.setAttribute('sigma', str(v.driverProfile.sigma))
-            vtype.setAttribute('speedFactor', str(v.driverProfile.speedLimitComplianceFactor))
-            vtype.setAttribute('vClass', str(v.vClass))
-            vtype.setAttribute('emissionClass', str(v.emissionClass))
-            vtype.setAttribute('color', str(v.color))
-            vtype.setAttribute('guiShape', str(v.shape))
-            routes.appendChild(vtype)
+        self._writeVehicleTypesXML(self._buildVehicleTypesXML(vehicleList), output_folder)
 
+    def _writeVehicleTypesXML(self, xml_text, output_folder):
         output_path = os.path.join(output_folder, "vehicletypes.rou.xml")
-        with open(output_path, 'w') as fd:
-            fd.write(rootXML.toprettyxml(indent="    "))
+        # written aside and renamed: the workspace may hold hardlinks to the template files
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, 'w') as fd:
+            fd.write(xml_text)
+        os.replace(tmp_path, output_path)
+
+    def _buildVehicleTypesXML(self, vehicleList):
+        return vehicle_types_xml(vehicleList)
+
+    def _prepare_episode(self, episode_id):
+        vehicle_list, vehicle_num, scenario = self.traffic_gen.generate_traffic(episode_id)
+        return vehicle_list, vehicle_num, scenario, self._buildVehicleTypesXML(vehicle_list)
+
+    def _next_episode_id(self):
+        if self.episode_list_mode:
+            return self.episode_list[self.episode_count % len(self.episode_list)]
+        return self.episode_id + 1
+
+    def _take_episode(self, episode_id):
+        # Returns the prepared episode and whether it came from the prefetch stage
+        if self._prefetcher is not None and self._prefetcher.pending is not None:
+            # read even on a mismatch (episode_id or step changed from outside): one request in flight
+            requested = self._prefetcher.pending
+            try:
+                episode = self._prefetcher.result()
+            except (EOFError, OSError, pickle.UnpicklingError):
+                print(f"[Env {self.rank}] prefetch process lost, generating in the env process")
+                self._prefetcher.close()
+                self._prefetcher = None
+            else:
+                if requested == (episode_id, self.sim_step):
+                    return episode, True
+
+        return self._prepare_episode(episode_id), False
+
+    def _start_prefetch(self):
+        if self._prefetcher is not None:
+            try:
+                self._prefetcher.submit(self._next_episode_id(), self.sim_step)
+            except OSError:
+                print(f"[Env {self.rank}] prefetch process lost, generating in the env process")
+                self._prefetcher.close()
+                self._prefetcher = None
+
+    def _log_gridlock(self, controller):
+        self.last_gridlock = self.gridlock.summary(self.episode_duration)
+        self.last_gridlock["controller"] = controller
+        message = (f"Episode {self.episode_id} ({controller}): gridlock at t={self.gridlock.detected_at:.0f} s "
+                   f"with {self.gridlock.vehicles_at_detection} vehicles, "
+                   f"{self.last_gridlock['gridlock_time_saved']:.0f} s of simulated time saved")
+        print(f"[Env {self.rank}] {message}")
+        with open(os.path.join(self.log_folder, "gridlock_log.txt"), 'a') as f:
+            print(message, file=f)
+
+    def _open_trace(self, controller, enhancements=[]):
+        self._close_trace("aborted")
+        if self.trace_folder is None:
+            return
+        self.trace = DecisionTraceWriter(trace_path(self.trace_folder, self.episode_id, controller, enhancements),
+                                         controller, self.episode_id, self.sim_step, self.base_sim_step, self.action_step,
+                                         self.episode_duration, self.reward_scale, self.sim_config.name, self.fidelity,
+                                         enhancements=enhancements, measures=self.measure_enabled,
+                                         gridlock_detection=self.gridlock is not None,
+                                         duration_actions=self.action_mode == "duration",
+                                         demand_profile=self.demand_profile, injection_window=self.injection_window,
+                                         obs_source=self.obs_source)
+
+    def _close_trace(self, reason):
+        if self.trace is None:
+            return
+        end_time = libsumo.simulation.getTime()
+        # with measures enabled the per vehicle results are part of the outcome digest
+        outcome = repr(self.get_measures()).encode() if self.measure_enabled and reason != "aborted" else b""
+        self.trace.close(end_time, reason, outcome)
+        self.trace = None
 
     def _log_scenario(self, log_folder, episode_index, vehicle_num, scenario):
         episode_info_file = os.path.join(log_folder, f"episode_info_ep{episode_index}.txt")
@@ -150,71 +490,125 @@ class SumoEnv(gym.Env):
         if os.path.exists(self.workspace_path):
             shutil.rmtree(self.workspace_path, ignore_errors=True)
         
-        shutil.copytree(self.template_xml_path, self.workspace_path)
+        # the template files are never modified in the workspace, hardlinks are enough
+        shutil.copytree(self.template_xml_path, self.workspace_path, copy_function=_link_or_copy)
         
         print(f"[Env {self.rank}] Workspace created in: {self.workspace_path}")
 
     def _simulation_step(self):
         libsumo.simulationStep()
+        if self.gridlock is not None:
+            self.gridlock.update()
 
         if self.measure_enabled:
             self.active_vehicles.update(libsumo.simulation.getDepartedIDList())
             self.active_vehicles.difference_update(libsumo.simulation.getArrivedIDList())
 
-            for vehicle in self.active_vehicles:
-                self.vehicle_list.getVehicle(vehicle).doMeasures()
+            if self.measure_mode == "poll":
+                for vehicle in self.active_vehicles:
+                    if self._stream is not None:
+                        self._stream_vehicles[vehicle].doMeasures()
+                    else:
+                        self.vehicle_list.getVehicle(vehicle).doMeasures()
+            else:
+                self._measure_startstop_idle()
+                if libsumo.simulation.getTime() >= self._next_tripinfo_poll:
+                    self._next_tripinfo_poll += TRIPINFO_POLL_INTERVAL
+                    self._read_tripinfo()
+
+        if self._stream is not None:
+            self._drop_arrived(libsumo.simulation.getArrivedIDList())
+            self._inject_window()
 
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
-        self.obs_history = []
-        if self.episode_list_mode:
-            list_index = self.episode_count % len(self.episode_list)
-            self.episode_id = self.episode_list[list_index]
-        else:
-            self.episode_id = self.episode_id + 1
-        
+        reset_start = time.perf_counter()
+        self._apply_pending_fidelity()
+        self.obs_history.clear()
+        self.episode_id = self._next_episode_id()
         self.episode_count += 1
         
         self.active_vehicles = set()
         self.vehicle_list = []
 
-        vehicle_list, vehicle_num, scenario = self.traffic_gen.generate_traffic(self.episode_id)
+        if self.demand_profile is None:
+            (vehicle_list, vehicle_num, scenario, vtypes_xml), prefetch_hit = self._take_episode(self.episode_id)
+        else:
+            # filled while the stream runs
+            vehicle_list, vehicle_num, scenario, vtypes_xml = VehicleList(), 0, f"stream:{self.demand_profile}", EMPTY_ROUTES_XML
+            prefetch_hit = False
         self.vehicle_list = vehicle_list
-        self._generateVehicleTypesXML(self.vehicle_list, output_folder=self.workspace_path)
+        self.vehicle_num = vehicle_num
+        self.scenario = scenario
+        self._writeVehicleTypesXML(vtypes_xml, output_folder=self.workspace_path)
 
         self._log_scenario(self.log_folder, self.episode_id, vehicle_num, scenario)
 
         self._startSumo(self.sumo_config_path, self.sim_step, self.log_folder, self.episode_id)
-        self._addVehiclesToSimulation(self.vehicle_list)
+        self._add_demand()
         libsumo.trafficlight.setProgram(self.sim_config.tl_id, self.sim_config.tl_program)
+        # start of the current green: setPhase restarts the SUMO phase timer even when the green is held
+        self._green_since = libsumo.simulation.getTime()
 
         if not self.lane_ids_list:
             lanes = sorted(list(set(libsumo.trafficlight.getControlledLanes(self.sim_config.tl_id))))
             self.lane_ids_list = lanes[:8] if len(lanes) >= 8 else lanes
 
-        obs = self._compute_observation()
+        if self.gridlock is not None:
+            self.gridlock.reset()
+        self.last_gridlock = None
+        self._open_trace("rl")
+
+        obs = self._observe()
         self.episode_co2_total = 0.0
-        return obs, {}
+        if self.dataset_writer is not None:
+            # an episode cut by a reset is closed
+            self.dataset_writer.end_episode()
+            self._dataset_obs = np.array(obs)
+
+        if self.prefetch:
+            self._start_prefetch()
+
+        self.last_reset_time = time.perf_counter() - reset_start
+        info = {
+            "reset_time": self.last_reset_time,
+            "prefetch_hit": prefetch_hit,
+            "episode_id": self.episode_id,
+            "episode_count": self.episode_count
+        }
+        return obs, info
     
     def get_measures(self):
-        mesaured_vehicle_data = []
-        for v in self.vehicle_list:
-            data = {"vehicleID": v.vehicleID, "totalDistance": v.totalDistance, "totalTravelTime": v.totalTravelTime, "totalWaitingTime": v.totalWaitingTime, "meanSpeed": v.meanSpeed, "totalCO2Emissions": v.totalCO2Emissions, "totalCOEmissions": v.totalCOEmissions, "totalHCEmissions": v.totalHCEmissions, "totalPMxEmissions": v.totalPMxEmissions, "totalNOxEmissions": v.totalNOxEmissions, "totalFuelConsumption": v.totalFuelConsumption, "totalElectricityConsumption": v.totalElectricityConsumption, "totalNoiseEmission": v.totalNoiseEmission}
-            mesaured_vehicle_data.append(data)
-        return mesaured_vehicle_data
+        if self.measure_enabled and self.measure_mode == "tripinfo":
+            self._finish_tripinfo()
+        vehicles = self.vehicle_list if self._stream is None else self._stream_vehicles.values()
+        return self._finished_measures + [self._vehicle_measures(v) for v in vehicles]
+
+    def _vehicle_measures(self, v):
+        return {"vehicleID": v.vehicleID, "totalDistance": v.totalDistance, "totalTravelTime": v.totalTravelTime, "totalWaitingTime": v.totalWaitingTime, "meanSpeed": v.meanSpeed, "totalCO2Emissions": v.totalCO2Emissions, "totalCOEmissions": v.totalCOEmissions, "totalHCEmissions": v.totalHCEmissions, "totalPMxEmissions": v.totalPMxEmissions, "totalNOxEmissions": v.totalNOxEmissions, "totalFuelConsumption": v.totalFuelConsumption, "totalElectricityConsumption": v.totalElectricityConsumption, "totalNoiseEmission": v.totalNoiseEmission}
     
     def dump_vehicle_population(self, filename):
         self.vehicle_list.dump(filename)
     
     def step(self, action):
-        action = int(action)
-        target_phase = action * 3
-
         current_phase = libsumo.trafficlight.getPhase(self.sim_config.tl_id)
+        decision_time = libsumo.simulation.getTime()
+
+        if self.action_mode == "duration":
+            action, duration_index = int(action[0]), int(action[1])
+            action_code = action + 2 * duration_index # as recorded in the decision trace
+            action, green_steps = self._safe_green(action, GREEN_DURATIONS[duration_index], current_phase)
+        else:
+            action = int(action)
+            action_code = action
+            green_steps = self.steps_per_action
+        target_phase = action * 3
         
         total_co2 = 0.0
         total_waiting_time = 0.0
         delta_t = libsumo.simulation.getDeltaT()
+        # waiting times are summed every step: coarser steps are weighted to keep the reward scale
+        step_weight = self.sim_step / self.base_sim_step
 
         # Green->Yellow and Yellow->Red transition management
         if current_phase != target_phase:
@@ -222,76 +616,158 @@ class SumoEnv(gym.Env):
             while next_phase != target_phase:
                 libsumo.trafficlight.setPhase(self.sim_config.tl_id, next_phase)
                 duration = libsumo.trafficlight.getPhaseDuration(self.sim_config.tl_id)
-                steps = int(duration / self.sim_step)
+                steps = math.ceil(duration / self.sim_step)
                 for _ in range(steps): 
                     self._simulation_step()
-                    ids = libsumo.vehicle.getIDList()
-                    for v in ids:
-                        total_co2 += (libsumo.vehicle.getCO2Emission(v) * delta_t) / 1000 # um: g
-                        total_waiting_time += libsumo.vehicle.getWaitingTime(v)
+                    co2, waiting_time, _ = self._step_costs(delta_t, step_weight)
+                    total_co2 += co2
+                    total_waiting_time += waiting_time
 
                 next_phase = (next_phase + 1) % 6
 
         # Green execution
+        if current_phase != target_phase:
+            self._green_since = libsumo.simulation.getTime()
         libsumo.trafficlight.setPhase(self.sim_config.tl_id, target_phase)
 
         max_waiting_time = 0.0
-        for _ in range(self.steps_per_action): # steps per action -> min green time
+        for _ in range(green_steps): # steps per action -> min green time
             self._simulation_step()
-            ids = libsumo.vehicle.getIDList()
-            for v in ids:
-                total_co2 += (libsumo.vehicle.getCO2Emission(v) * delta_t) / 1000 # um: g
-                total_waiting_time += libsumo.vehicle.getWaitingTime(v)
-                max_waiting_time = max(max_waiting_time, libsumo.vehicle.getWaitingTime(v))
+            co2, waiting_time, step_max_waiting_time = self._step_costs(delta_t, step_weight)
+            total_co2 += co2
+            total_waiting_time += waiting_time
+            max_waiting_time = max(max_waiting_time, step_max_waiting_time)
 
         # --- Reward computation ---
         self.episode_co2_total += total_co2
         co2_grams = total_co2
-        w_waiting_time = 1
-
-        r_waiting_time = w_waiting_time * total_waiting_time
-        reward = -(r_waiting_time)/10000
-
-        # Anti-Starvation
-        penalty = 0.0
-        if max_waiting_time > 180: # max phase duration in Denny's code
-            penalty = (max_waiting_time - 180) * 0.5
-            reward -= (penalty / 10000)
+        reward, penalty = self._reward(total_waiting_time, max_waiting_time)
         
         current_time = libsumo.simulation.getTime()
-        terminated = libsumo.simulation.getMinExpectedNumber() == 0
+        terminated = not self._traffic_left()
         truncated = current_time >= self.episode_duration
 
-        obs = self._compute_observation()
+        obs = self._observe()
         info = {
             "co2": total_co2,
             "waiting_time": total_waiting_time,
-            "max_waiting_time": max_waiting_time
+            "max_waiting_time": max_waiting_time,
+            "duration": current_time - decision_time # seconds covered by the decision (semi-MDP discount)
         }
 
+        if self.gridlock is not None and self.gridlock.gridlocked and not terminated:
+            truncated = True
+            if self.last_gridlock is None:
+                self._log_gridlock("rl")
+            info.update(self.last_gridlock)
+
+        if self.trace is not None:
+            self.trace.record(decision_time, current_phase, action_code, reward, total_waiting_time, total_co2, max_waiting_time, penalty)
+            if terminated or truncated:
+                self._close_trace("terminated" if terminated else ("gridlock" if self.last_gridlock is not None else "truncated"))
+
+        if self.dataset_writer is not None:
+            self.dataset_writer.append(self._dataset_obs, action, reward, terminated or truncated)
+            self._dataset_obs = np.array(obs)
+
         if terminated or truncated:
-            info["episode_avgco2"] = self.episode_co2_total / len(self.vehicle_list)
+            info["episode_avgco2"] = self.episode_co2_total / self.vehicle_num
 
         return obs, reward, terminated, truncated, info
     
+    def _step_costs(self, delta_t, step_weight):
+        # CO2 (g), weighted waiting time and max waiting time of the last simulation step
+        if self.detectors is not None:
+            # O(edges + detectors): CO2 of the edges, waiting times of the detector queues
+            co2 = sum(libsumo.edge.getCO2Emission(e) for e in libsumo.edge.getIDList()) * delta_t / 1000
+            waiting, max_waiting_time = self.detectors.waiting(libsumo.simulation.getTime(), delta_t)
+            return co2, waiting * step_weight, max_waiting_time
+
+        co2 = 0.0
+        waiting = 0.0
+        max_waiting_time = 0.0
+        for v in libsumo.vehicle.getIDList():
+            co2 += (libsumo.vehicle.getCO2Emission(v) * delta_t) / 1000 # um: g
+            waiting_time = libsumo.vehicle.getWaitingTime(v)
+            waiting += waiting_time * step_weight
+            max_waiting_time = max(max_waiting_time, waiting_time)
+        return co2, waiting, max_waiting_time
+
+    def _safe_green(self, action, green_time, current_phase):
+        # min/max green limits of the duration action mode, returns the applied action and green steps
+        spent = libsumo.simulation.getTime() - self._green_since
+        if current_phase == action * 3:
+            if spent >= MAX_GREEN:
+                action = 1 - action
+                green_time = max(green_time, MIN_GREEN)
+            else:
+                green_time = min(green_time, MAX_GREEN - spent)
+        else:
+            green_time = max(green_time, MIN_GREEN)
+        return action, max(1, int(round(green_time / self.sim_step)))
+
+    def _reward(self, total_waiting_time, max_waiting_time):
+        w_waiting_time = 1
+
+        r_waiting_time = w_waiting_time * total_waiting_time
+        reward = -(r_waiting_time)/self.reward_scale
+
+        # Anti-Starvation
+        penalty = 0.0
+        if max_waiting_time > 180: # max phase duration in Denny's code
+            penalty = (max_waiting_time - 180) * 0.5
+            reward -= (penalty / self.reward_scale)
+        return reward, penalty
+
     def close(self):
-        libsumo.close()
+        self._close_trace("aborted")
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+        # already closed when the tripinfo measures were read
+        if self._tripinfo_reader is None or not self._tripinfo_done:
+            libsumo.close()
+
+    def _observe(self):
+        # the DTSE builder writes straight into the next ring slot
+        frame = self.obs_history.next_slot()
+        self._compute_observation(out=frame)
+        self.obs_history.push()
+        return self.obs_history.latest(copy=not self.zero_copy_obs)
+
+    def current_observation(self):
+        # last observation, without stepping: a restarted worker of SupervisedSubprocVecEnv
+        # hands over the observation of the reset done at construction
+        return self.obs_history.latest(copy=True)
+
+    def _lane_vehicles(self, ordered_lanes):
+        if not self.mesosim:
+            return [libsumo.lane.getLastStepVehicleIDs(lane_id) for lane_id in ordered_lanes]
+
+        # mesoscopic lanes hold no vehicles, the lane is taken from the vehicle itself
+        rows = {lane_id: i for i, lane_id in enumerate(ordered_lanes)}
+        lane_vehicles = [[] for _ in ordered_lanes]
+        for edge_id in dict.fromkeys(lane_id.rsplit("_", 1)[0] for lane_id in ordered_lanes):
+            for veh_id in libsumo.edge.getLastStepVehicleIDs(edge_id):
+                row = rows.get(f"{edge_id}_{libsumo.vehicle.getLaneIndex(veh_id)}")
+                if row is not None:
+                    lane_vehicles[row].append(veh_id)
+        return lane_vehicles
+
+    def _compute_observation(self, out=None):
+        if out is None:
+            out = np.empty(self.obs_history.frame_size, dtype=np.float32)
+
+        if self.detectors is not None:
+            self.detectors.observe(out)
+            self._phase_features(out[self.detectors.obs_size:])
+            return out
 
-    def _compute_observation(self):
         # -1 empty cell, 0 stopped vehicle, >0 normalized speed
-        traffic_grid = np.full((self.num_lanes, self.num_cells), -1.0, dtype=np.float32)
-
-        # TO BE FIXED: hardcoded lane order        
-        ordered_lanes = [
-            "E4_0", "E4_1", # Nord (Incoming)
-            "E3_0", "E3_1", # Est
-            "E2_0", "E2_1", # Sud
-            "E1_0", "E1_1"  # Ovest
-        ]
-        
-        for i, lane_id in enumerate(ordered_lanes):
-            vehicle_ids = libsumo.lane.getLastStepVehicleIDs(lane_id)
-            
+        grid_size = self.num_lanes * self.num_cells
+        traffic_grid = out[:grid_size].reshape(self.num_lanes, self.num_cells)
+        traffic_grid.fill(-1.0)
+
+        for i, vehicle_ids in enumerate(self._lane_vehicles(self.sim_config.obs_lanes)):
             for veh_id in vehicle_ids:
                 pos = libsumo.vehicle.getLanePosition(veh_id)
                 speed = libsumo.vehicle.getSpeed(veh_id)
@@ -309,17 +785,15 @@ class SumoEnv(gym.Env):
                 else:
                     norm_speed = 0.0
                     
-                traffic_grid[i][cell_idx] = norm_speed
-
-        flat_grid = traffic_grid.flatten()
+                traffic_grid[i, cell_idx] = norm_speed
         
+        self._phase_features(out[grid_size:])
+        return out
+
+    def _phase_features(self, phase_info):
         phase = libsumo.trafficlight.getPhase(self.sim_config.tl_id)
         duration = libsumo.trafficlight.getSpentDuration(self.sim_config.tl_id)
         
-        phase_info = np.array([
-            1.0 if phase == 0 else 0.0,
-            1.0 if phase == 3 else 0.0,
-            min(1.0, duration / 120.0)
-        ], dtype=np.float32)
-        
-        return np.concatenate((flat_grid, phase_info))
\ No newline at end of file
+        phase_info[0] = 1.0 if phase == 0 else 0.0
+        phase_info[1] = 1.0 if phase == 3 else 0.0
+        phase_info[2] = min(1.0, duration / 120.0)
\ No newline at end of file
@@ -0,0 +1,233 @@
+import time
+import numpy as np
+from multiprocessing.connection import wait
+from stable_baselines3.common.callbacks import BaseCallback
+from fast_vec_env import FastSubprocVecEnv
+
+# FastSubprocVecEnv whose workers are supervised: a SUMO error or a libsumo crash ends one
+# worker, not the training run.
+#  - crash / hang   a worker whose pipe breaks, or that does not answer a step within
+#                   step_timeout, is killed and restarted on the episode following the lost
+#                   one; its transition is returned as truncated (reward 0, last observation
+#                   as terminal observation, info["worker_restart"] with the reason)
+#  - memory         at every episode end the worker RSS is read from /proc; above max_rss_mb,
+#                   or more than rss_growth_mb above its RSS after the first episode (memory
+#                   left behind by the libsumo close/start cycles), the worker is recycled:
+#                   replaced by a fresh one that starts the same next episode (the transition
+#                   is kept, info["worker_restart"] is "recycled")
+# Restarted workers are built by respawn_fn(rank, episode_offset, episode_count), an env
+# factory like the ones in env_fns whose first reset plays episode episode_offset + 1, or in
+# list mode (SumoEnv episode_list) the one at position episode_count. A replacement that does
+# not start within step_timeout is killed and tried again, max_start_attempts times in all.
+
+KB_PER_MB = 1024
+
+
+def read_rss_mb(pid):
+    # resident set size of a process, None where /proc is not available
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / KB_PER_MB
+    except OSError:
+        pass
+    return None
+
+
+# The observation space of SumoEnv is a flat Box: the observations are stacked with np.stack,
+# no private SB3 helper (renamed across releases) is needed.
+class SupervisedSubprocVecEnv(FastSubprocVecEnv):
+    def __init__(self, env_fns, respawn_fn, max_rss_mb=4096, rss_growth_mb=1024, step_timeout=300, max_start_attempts=3, **kwargs):
+        super().__init__(env_fns, **kwargs)
+        self.respawn_fn = respawn_fn
+        self.max_rss_mb = max_rss_mb
+        self.rss_growth_mb = rss_growth_mb
+        self.step_timeout = step_timeout
+        self.max_start_attempts = max_start_attempts
+
+        self.episode_ids = [p["episode_id"] for p in self.startup_profile]
+        self.episode_counts = [p["episode_count"] for p in self.startup_profile]
+        self.base_rss_mb = [None] * self.num_envs
+        self.rss_mb = [read_rss_mb(p.pid) for p in self.processes]
+        self.step_latency = np.zeros(self.num_envs)
+        self.alive = [True] * self.num_envs
+        self.restarts = [0] * self.num_envs
+        self.recycles = [0] * self.num_envs
+        self.last_obs = [None] * self.num_envs
+
+    def _send(self, i, message):
+        try:
+            self.remotes[i].send(message)
+        except (BrokenPipeError, ConnectionResetError, EOFError):
+            self.alive[i] = False
+
+    def _collect(self, sent_at):
+        # answers of the live workers; a dead or silent worker gets None
+        results = [None] * self.num_envs
+        pending = {self.remotes[i]: i for i in range(self.num_envs) if self.alive[i]}
+        deadline = sent_at + self.step_timeout
+        while pending:
+            ready = wait(list(pending), timeout=max(0.0, deadline - time.perf_counter()))
+            if not ready:
+                for i in pending.values():
+                    self.alive[i] = False
+                break
+            now = time.perf_counter()
+            for remote in ready:
+                i = pending.pop(remote)
+                try:
+                    results[i] = remote.recv()
+                    self.step_latency[i] = now - sent_at
+                except (EOFError, ConnectionResetError):
+                    self.alive[i] = False
+        return results
+
+    def _recv(self, i):
+        # answer of worker i within step_timeout, None if it dies or stays silent
+        try:
+            if self.remotes[i].poll(self.step_timeout):
+                return self.remotes[i].recv()
+        except (EOFError, ConnectionResetError, BrokenPipeError):
+            pass
+        return None
+
+    def _kill_worker(self, i):
+        process = self.processes[i]
+        if process.is_alive():
+            process.kill()
+        process.join()
+        self.remotes[i].close()
+
+    def _replace_worker(self, i, episode_offset, episode_count):
+        self._kill_worker(i)
+        for attempt in range(1, self.max_start_attempts + 1):
+            self.remotes[i], self.processes[i] = self._start_worker(self.respawn_fn(i, episode_offset, episode_count), time.time())
+            profile = self._recv(i)
+            observation = None
+            if profile is not None:
+                self._send(i, ("env_method", ("current_observation", [], {})))
+                observation = self._recv(i)
+            if observation is not None:
+                break
+            print(f"Env worker {i}: replacement did not start (attempt {attempt}/{self.max_start_attempts})")
+            self._kill_worker(i)
+        else:
+            raise RuntimeError(f"Env worker {i} could not be restarted in {self.max_start_attempts} attempts")
+
+        profile["rank"] = i
+        self.startup_profile[i] = profile
+        self.episode_ids[i] = profile["episode_id"]
+        self.episode_counts[i] = profile["episode_count"]
+        self.base_rss_mb[i] = None
+        self.rss_mb[i] = read_rss_mb(self.processes[i].pid)
+        self.alive[i] = True
+        return observation
+
+    def _restart(self, i, reason):
+        # the episode in progress is lost, the new worker starts the following one
+        print(f"Env worker {i} {reason} in episode {self.episode_ids[i]}: restarting")
+        self.restarts[i] += 1
+        observation = self._replace_worker(i, self.episode_ids[i], self.episode_counts[i])
+        info = {"terminal_observation": self.last_obs[i], "TimeLimit.truncated": True, "worker_restart": reason}
+        reset_info = {"episode_id": self.episode_ids[i], "episode_count": self.episode_counts[i]}
+        return observation, 0.0, True, info, reset_info
+
+    def _check_memory(self, i):
+        # at an episode end: the worker already reset on the next episode, a new worker replays it
+        rss = read_rss_mb(self.processes[i].pid)
+        self.rss_mb[i] = rss
+        if rss is None:
+            return None
+        if self.base_rss_mb[i] is None:
+            self.base_rss_mb[i] = rss
+            return None
+        if rss > self.max_rss_mb or rss - self.base_rss_mb[i] > self.rss_growth_mb:
+            print(f"Env worker {i}: RSS {rss:.0f} MB (first episode {self.base_rss_mb[i]:.0f} MB), recycling")
+            self.recycles[i] += 1
+            self._send(i, ("close", None))
+            self.processes[i].join(self.step_timeout)
+            return self._replace_worker(i, self.episode_ids[i] - 1, self.episode_counts[i] - 1)
+        return None
+
+    def step_async(self, actions):
+        self._sent_at = time.perf_counter()
+        for i, action in enumerate(actions):
+            self._send(i, ("step", action))
+        self.waiting = True
+
+    def step_wait(self):
+        results = self._collect(self._sent_at)
+        self.waiting = False
+
+        for i in range(self.num_envs):
+            if results[i] is None:
+                # a killed worker closes its pipe before it is reaped: wait for it before asking
+                self.processes[i].join(1)
+                reason = "hung" if self.processes[i].is_alive() else "crashed"
+                results[i] = self._restart(i, reason)
+                continue
+            observation, reward, done, info, reset_info = results[i]
+            if done:
+                self.episode_ids[i] = reset_info.get("episode_id", self.episode_ids[i] + 1)
+                self.episode_counts[i] = reset_info.get("episode_count", self.episode_counts[i] + 1)
+                new_observation = self._check_memory(i)
+                if new_observation is not None:
+                    info["worker_restart"] = "recycled"
+                    results[i] = (new_observation, reward, done, info, reset_info)
+
+        obs, rews, dones, infos, self.reset_infos = zip(*results)
+        self.last_obs = list(obs)
+        return np.stack(obs), np.stack(rews), np.stack(dones), infos
+
+    def reset(self):
+        sent_at = time.perf_counter()
+        for i in range(self.num_envs):
+            self._send(i, ("reset", (self._seeds[i], self._options[i])))
+        results = self._collect(sent_at)
+
+        for i in range(self.num_envs):
+            if results[i] is None:
+                # the new worker was reset at construction
+                observation, _, _, _, reset_info = self._restart(i, "crashed on reset")
+                results[i] = (observation, reset_info)
+            self.episode_ids[i] = results[i][1].get("episode_id", self.episode_ids[i])
+            self.episode_counts[i] = results[i][1].get("episode_count", self.episode_counts[i])
+
+        obs, self.reset_infos = zip(*results)
+        self.last_obs = list(obs)
+        self._reset_seeds()
+        self._reset_options()
+        return np.stack(obs)
+
+    def health(self):
+        self.rss_mb = [read_rss_mb(p.pid) for p in self.processes]
+        return {
+            "rss_mb": list(self.rss_mb),
+            "base_rss_mb": list(self.base_rss_mb),
+            "step_latency_s": self.step_latency.tolist(),
+            "restarts": list(self.restarts),
+            "recycles": list(self.recycles),
+        }
+
+
+class WorkerHealth(BaseCallback):
+    # restarts, recycles, RSS and step latency of the supervised workers, once per rollout
+    def _on_rollout_end(self):
+        vec_env = self.training_env.unwrapped
+        if not isinstance(vec_env, SupervisedSubprocVecEnv):
+            return
+        health = vec_env.health()
+        self.logger.record("workers/restarts", sum(health["restarts"]))
+        self.logger.record("workers/recycles", sum(health["recycles"]))
+        self.logger.record("workers/step_latency_max_ms", max(health["step_latency_s"]) * 1000)
+        rss = [r for r in health["rss_mb"] if r is not None]
+        if rss:
+            self.logger.record("workers/rss_mean_mb", float(np.mean(rss)))
+            self.logger.record("workers/rss_max_mb", max(rss))
+        for i, (r, base) in enumerate(zip(health["rss_mb"], health["base_rss_mb"])):
+            if r is not None and base is not None:
+                self.logger.record(f"workers/rss_growth_mb/worker_{i}", r - base)
+
+    def _on_step(self):
+        return True
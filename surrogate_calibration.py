@@ -0,0 +1,127 @@
+import os
+import argparse
+import itertools
+import numpy as np
+from sumo_env import SumoEnv
+from sim_config import CONFIG_4WAY_160M
+from surrogate_sim import SurrogateSim, SurrogateParams, save_params
+
+# Fits the SurrogateSim parameters to SUMO rollouts. SUMO runs a fixed action sequence on a set
+# of episodes; the surrogate replays the same sequences with every candidate parameter set in
+# a single batch and the candidate whose per-decision waiting time and queues are closest wins.
+
+LOG_DIR = os.path.join("logs", "surrogate_calibration")
+
+GRID = {
+    "vmax_cells": [2, 3],
+    "p_slow": [0.0, 0.1, 0.2, 0.3],
+    "p_turn_hold": [0.0, 0.3, 0.6],
+    "p_left_yield": [0.2, 0.5, 0.8],
+}
+
+
+def action_sequence(rng, decisions, keep_prob=0.7):
+    # random phases held for a few decisions, like a policy does
+    actions = [int(rng.integers(2))]
+    for _ in range(decisions - 1):
+        actions.append(actions[-1] if rng.random() < keep_prob else 1 - actions[-1])
+    return np.array(actions)
+
+
+def queue_lengths(obs, num_lanes=8, num_cells=32):
+    # stopped vehicles per DTSE row (cell value 0)
+    grid = obs[..., :num_lanes * num_cells].reshape(obs.shape[:-1] + (num_lanes, num_cells))
+    return (grid == 0).sum(axis=-1)
+
+
+def sumo_rollouts(episodes, decisions, seed):
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=0.5,
+                  action_step=10,
+                  episode_duration=3600,
+                  log_folder=LOG_DIR,
+                  rank="calibration",
+                  episode_list=episodes)
+    rng = np.random.default_rng(seed)
+
+    actions = np.zeros((len(episodes), decisions), dtype=np.int64)
+    waiting = np.full((len(episodes), decisions), np.nan)
+    queues = np.full((len(episodes), decisions, 8), np.nan)
+    try:
+        for i, episode_id in enumerate(episodes):
+            env.reset()
+            actions[i] = action_sequence(rng, decisions)
+            for k in range(decisions):
+                obs, _, terminated, truncated, info = env.step(actions[i, k])
+                waiting[i, k] = info["waiting_time"]
+                queues[i, k] = queue_lengths(obs)
+                if terminated or truncated:
+                    break
+            print(f"SUMO episode {episode_id}: {k + 1} decisions")
+    finally:
+        env.close()
+    return actions, waiting, queues
+
+
+def surrogate_rollouts(candidates, episodes, actions, seed):
+    # batch layout: candidate-major, one env per (candidate, episode)
+    num_envs = len(candidates) * len(episodes)
+    sim = SurrogateSim(CONFIG_4WAY_160M, num_envs, seed=seed)
+    for c, params in enumerate(candidates):
+        sim.set_params(params, slice(c * len(episodes), (c + 1) * len(episodes)))
+    sim.reset(np.arange(num_envs), list(episodes) * len(candidates))
+
+    decisions = actions.shape[1]
+    waiting = np.zeros((num_envs, decisions))
+    queues = np.zeros((num_envs, decisions, 8))
+    batch_actions = np.tile(actions, (len(candidates), 1))
+    for k in range(decisions):
+        _, _, _, total_waiting, _ = sim.step(batch_actions[:, k])
+        waiting[:, k] = total_waiting
+        queues[:, k] = queue_lengths(sim.observe())
+
+    shape = (len(candidates), len(episodes), decisions)
+    return waiting.reshape(shape), queues.reshape(shape + (8,))
+
+
+def calibration_loss(sumo_waiting, sumo_queues, waiting, queues):
+    # relative error of the waiting time (the reward) plus queue error in vehicles, over the
+    # decisions SUMO actually ran
+    valid = ~np.isnan(sumo_waiting)
+    scale = np.nanmean(sumo_waiting) + 1e-9
+    waiting_error = np.where(valid, (waiting - sumo_waiting) / scale, 0) ** 2
+    queue_error = np.where(valid[..., None], queues - sumo_queues, 0) ** 2
+    return waiting_error.sum(axis=(1, 2)) / valid.sum() + queue_error.sum(axis=(1, 2, 3)) / (valid.sum() * 8)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the surrogate parameters to SUMO rollouts")
+    parser.add_argument("--episodes", type=int, nargs="+", default=list(range(90001, 90009)), help="Episode IDs used for the fit")
+    parser.add_argument("--decisions", type=int, default=200, help="Decisions per episode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default="surrogate_params.json")
+    args = parser.parse_args()
+
+    os.makedirs(LOG_DIR, exist_ok=True)
+    rollouts_file = os.path.join(LOG_DIR, f"sumo_rollouts_{args.seed}_{args.decisions}.npz")
+    data = np.load(rollouts_file) if os.path.exists(rollouts_file) else None
+
+    if data is None or list(data["episodes"]) != args.episodes:
+        actions, sumo_waiting, sumo_queues = sumo_rollouts(args.episodes, args.decisions, args.seed)
+        np.savez(rollouts_file, episodes=args.episodes, actions=actions, waiting=sumo_waiting, queues=sumo_queues)
+    else:
+        print(f"SUMO rollouts loaded from {rollouts_file}")
+        actions, sumo_waiting, sumo_queues = data["actions"], data["waiting"], data["queues"]
+
+    candidates = [SurrogateParams(*values) for values in itertools.product(*GRID.values())]
+    print(f"Evaluating {len(candidates)} parameter sets on {len(args.episodes)} episodes ({len(candidates) * len(args.episodes)} surrogate envs)")
+    waiting, queues = surrogate_rollouts(candidates, args.episodes, actions, args.seed)
+    losses = calibration_loss(sumo_waiting, sumo_queues, waiting, queues)
+
+    order = np.argsort(losses)
+    for rank, c in enumerate(order[:5]):
+        print(f"{rank + 1}. loss {losses[c]:.4f} {candidates[c]}")
+
+    best = candidates[order[0]]
+    save_params(best, args.output)
+    print(f"Best parameters saved in {args.output}")
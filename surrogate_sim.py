@@ -0,0 +1,402 @@
+import os
+import json
+import time
+import argparse
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, asdict
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+from traffic_generator import TrafficGenerator
+from sumo_env import OBS_LANES, FIDELITY_LEVELS
+from sim_config import CONFIG_4WAY_160M
+
+# Vectorized surrogate of the 4-way crossing: a cellular automaton (Nagel-Schreckenberg rules)
+# on the 8 incoming lanes, stepped for a whole batch of independent intersections with array
+# operations. Demand comes from TrafficGenerator, observation and reward follow SumoEnv, so
+# policies pretrained here can be run unchanged on SUMO.
+
+STRAIGHT, RIGHT, LEFT = 0, 1, 2
+TURNS = {"Straight": STRAIGHT, "Right": RIGHT, "Left": LEFT}
+
+# TL program "1": green phases and the DTSE rows they serve (N/S rows 0,1,4,5 - E/W rows 2,3,6,7)
+NS_GREEN, EW_GREEN = 0, 3
+NUM_PHASES = 6
+TRANSITION_DURATION = 3 # yellow and red phases
+
+
+@dataclass
+class SurrogateParams:
+    vmax_cells: int = 3         # max speed in cells per second (5 m cells)
+    p_slow: float = 0.1         # random slowdown probability
+    p_turn_hold: float = 0.3    # a right-turning vehicle at the stop line waits one more second
+    p_left_yield: float = 0.5   # a left-turning vehicle yields to the opposing flow
+
+
+def save_params(params, path):
+    with open(path, 'w') as f:
+        json.dump(asdict(params), f, indent=2)
+
+
+def load_params(path):
+    with open(path) as f:
+        return SurrogateParams(**json.load(f))
+
+
+def route_movements(sim_config):
+    # route id -> (DTSE row of the approach lane pair, turn), from the routes template and routes_map
+    rou_path = os.path.join(sim_config.template_dir, sim_config.name, sim_config.rou_file)
+    incoming = {route.get("id"): route.get("edges").split()[0] for route in ET.parse(rou_path).getroot().iter("route")}
+    approach_rows = {lane.rsplit("_", 1)[0]: i for i, lane in reversed(list(enumerate(OBS_LANES)))}
+
+    movements = {}
+    for group, route_ids in sim_config.routes_map.items():
+        turn = TURNS[group.split("_")[1]]
+        for route_id in route_ids:
+            movements[route_id] = (approach_rows[incoming[route_id]], turn)
+    return movements
+
+
+class SurrogateSim:
+    def __init__(self, sim_config, num_envs, params=None, episode_duration=3600, action_step=10,
+                 base_sim_step=0.5, bin_seconds=60, lane_speed=13.89, lane_real_length=149.6, reward_scale=10000, seed=0):
+        self.sim_config = sim_config
+        self.num_envs = num_envs
+        self.episode_duration = episode_duration
+        self.action_step = action_step
+        self.reward_scale = reward_scale
+        self.dt = 1.0
+        # SumoEnv sums waiting times every base_sim_step
+        self.step_weight = self.dt / base_sim_step
+        self.bin_seconds = bin_seconds
+        self.lane_speed = lane_speed
+        self.rng = np.random.default_rng(seed)
+        self.traffic_gen = TrafficGenerator(sim_config, base_sim_step)
+        self.movements = route_movements(sim_config)
+
+        # DTSE geometry of SumoEnv: 160 m observed, 5 m cells, the stop line is 10.4 m before the end.
+        # SumoEnv puts a vehicle in cell int((lane_length - pos) / 5): lane cell k (0 at the stop
+        # line) goes to DTSE cell int((lane_length - lane_real_length + 5k) / 5), the queue head in cell 2.
+        self.num_lanes = len(OBS_LANES)
+        self.cell_length = 5
+        self.num_cells = int(sim_config.lane_length / self.cell_length)
+        self.lane_cells = int(lane_real_length / self.cell_length)
+        offset = sim_config.lane_length - lane_real_length
+        self.dtse_cells = np.minimum(((offset + self.cell_length * np.arange(self.lane_cells)) // self.cell_length).astype(np.int64),
+                                     self.num_cells - 1)
+        self.obs_dim = self.num_lanes * self.num_cells + 3
+
+        # lanes of the opposing approach for every row (N <-> S, E <-> W)
+        opposing_first = np.array([(row // 2 * 2 + 4) % self.num_lanes for row in range(self.num_lanes)])
+        self.opposing_rows = np.stack([opposing_first, opposing_first + 1], axis=1)
+        self.green_rows = np.zeros((NUM_PHASES, self.num_lanes), dtype=bool)
+        self.green_rows[NS_GREEN, [0, 1, 4, 5]] = True
+        self.green_rows[EW_GREEN, [2, 3, 6, 7]] = True
+
+        shape = (num_envs, self.num_lanes, self.lane_cells)
+        self.occupied = np.zeros(shape, dtype=bool)
+        self.speed = np.zeros(shape, dtype=np.int8)
+        self.waiting = np.zeros(shape, dtype=np.float32)
+        self.turn = np.zeros(shape, dtype=np.int8)
+        self.backlog = np.zeros((num_envs, self.num_lanes, 3), dtype=np.int32)
+        self.rates = np.zeros((num_envs, int(np.ceil(episode_duration / bin_seconds)), self.num_lanes, 3), dtype=np.float32)
+        self.demand_end = np.zeros(num_envs)
+        self.phase = np.zeros(num_envs, dtype=np.int64)
+        self.spent = np.zeros(num_envs)
+        self.time = np.zeros(num_envs)
+        self.episode_ids = np.zeros(num_envs, dtype=np.int64)
+
+        self.vmax = np.zeros(num_envs, dtype=np.int8)
+        self.p_slow = np.zeros(num_envs, dtype=np.float32)
+        self.p_turn_hold = np.zeros(num_envs, dtype=np.float32)
+        self.p_left_yield = np.zeros(num_envs, dtype=np.float32)
+        self.set_params(params or SurrogateParams())
+
+    def set_params(self, params, indices=None):
+        indices = slice(None) if indices is None else indices
+        self.vmax[indices] = params.vmax_cells
+        self.p_slow[indices] = params.p_slow
+        self.p_turn_hold[indices] = params.p_turn_hold
+        self.p_left_yield[indices] = params.p_left_yield
+
+    def demand_rates(self, episode_id):
+        # arrival rates (veh/s) per time bin, DTSE row and turn. Right turns use lane 0,
+        # left turns lane 1, straight vehicles are split between the two lanes.
+        _, _, depart_times, routes = self.traffic_gen.generate_demand(episode_id)
+        rates = np.zeros(self.rates.shape[1:], dtype=np.float32)
+        if len(routes) == 0:
+            return rates, 0.0
+
+        rows, turns = np.array([self.movements[r] for r in routes]).T
+        bins = np.minimum((depart_times // self.bin_seconds).astype(np.int64), rates.shape[0] - 1)
+        weight = 1.0 / self.bin_seconds
+
+        straight = turns == STRAIGHT
+        lanes = rows + (turns == LEFT)
+        np.add.at(rates, (bins[~straight], lanes[~straight], turns[~straight]), weight)
+        np.add.at(rates, (bins[straight], rows[straight], STRAIGHT), weight / 2)
+        np.add.at(rates, (bins[straight], rows[straight] + 1, STRAIGHT), weight / 2)
+        return rates, float(depart_times.max())
+
+    def reset(self, indices, episode_ids):
+        for i, episode_id in zip(indices, episode_ids):
+            self.rates[i], self.demand_end[i] = self.demand_rates(episode_id)
+        self.episode_ids[indices] = episode_ids
+
+        self.occupied[indices] = False
+        self.speed[indices] = 0
+        self.waiting[indices] = 0
+        self.turn[indices] = 0
+        self.backlog[indices] = 0
+        self.phase[indices] = NS_GREEN
+        self.spent[indices] = 0
+        self.time[indices] = 0
+
+    def _micro_step(self, active, green):
+        cells = np.arange(self.lane_cells)
+        vmax = self.vmax[:, None, None]
+
+        # nearest vehicle towards the stop line (cell 0): free cells in front of every vehicle
+        occupied_idx = np.where(self.occupied, cells, -1)
+        leader = np.maximum.accumulate(occupied_idx, axis=2)
+        leader = np.concatenate([np.full(leader.shape[:2] + (1,), -1), leader[..., :-1]], axis=2)
+        gap = cells - leader - 1
+
+        # The first vehicle of a lane leaves it on green, otherwise it can only reach the stop line.
+        # Turning vehicles are held back: right turns slow down, left turns yield to the opposing
+        # flow when vehicles are within 30 m of the stop line.
+        first_turn = np.take_along_axis(self.turn, self.occupied.argmax(axis=2)[..., None], axis=2)[..., 0]
+        opposing_busy = self.occupied[:, self.opposing_rows, :6].any(axis=(2, 3))
+        random_hold = self.rng.random(self.occupied.shape[:2])
+        hold = ((first_turn == RIGHT) & (random_hold < self.p_turn_hold[:, None])) | \
+               ((first_turn == LEFT) & opposing_busy & (random_hold < self.p_left_yield[:, None]))
+        can_exit = (green & ~hold)[..., None]
+        gap = np.where(leader < 0, np.where(can_exit, self.lane_cells + vmax, cells), gap)
+
+        new_speed = np.minimum(np.minimum(self.speed + 1, vmax), gap)
+        slow = self.rng.random(self.occupied.shape) < self.p_slow[:, None, None]
+        new_speed = np.where(slow & (new_speed > 0), new_speed - 1, new_speed)
+        new_speed = np.where(self.occupied & active[:, None, None], new_speed, 0).astype(np.int8)
+
+        b, l, c = np.nonzero(self.occupied)
+        new_c = c - new_speed[b, l, c]
+        stays = new_c >= 0
+        moved_speed = np.where(active[b], new_speed[b, l, c], self.speed[b, l, c])
+        moved_waiting = np.where(moved_speed == 0, self.waiting[b, l, c] + np.where(active[b], self.dt, 0), 0)
+        moved_turn = self.turn[b, l, c]
+        b, l, new_c = b[stays], l[stays], new_c[stays]
+
+        self.occupied[:] = False
+        self.occupied[b, l, new_c] = True
+        self.speed[b, l, new_c] = moved_speed[stays]
+        self.waiting[b, l, new_c] = moved_waiting[stays]
+        self.turn[b, l, new_c] = moved_turn[stays]
+
+        # Poisson arrivals of the current bin enter the backlog, one vehicle per lane and
+        # second is inserted at the lane entry when it is free
+        bins = np.minimum((self.time // self.bin_seconds).astype(np.int64), self.rates.shape[1] - 1)
+        arrivals = self.rng.poisson(self.rates[np.arange(self.num_envs), bins] * self.dt)
+        self.backlog += np.where(active[:, None, None], arrivals, 0).astype(np.int32)
+
+        backlog_total = self.backlog.sum(axis=2)
+        entry = self.lane_cells - 1
+        insert = active[:, None] & (backlog_total > 0) & ~self.occupied[..., entry]
+        if insert.any():
+            pick = self.rng.random(backlog_total.shape) * backlog_total
+            new_turn = (pick[..., None] >= np.cumsum(self.backlog, axis=2)).sum(axis=2).clip(0, 2)
+            ib, il = np.nonzero(insert)
+            self.backlog[ib, il, new_turn[ib, il]] -= 1
+
+            ahead = np.where(self.occupied[ib, il, :entry], cells[:entry], -1).max(axis=1)
+            self.occupied[ib, il, entry] = True
+            self.speed[ib, il, entry] = np.minimum(self.vmax[ib], entry - ahead - 1)
+            self.waiting[ib, il, entry] = 0
+            self.turn[ib, il, entry] = new_turn[ib, il]
+
+        self.time += np.where(active, self.dt, 0)
+        self.spent += np.where(active, self.dt, 0)
+
+        waiting = np.where(self.occupied, self.waiting, 0)
+        return waiting.sum(axis=(1, 2)) * self.step_weight, waiting.max(axis=(1, 2))
+
+    def step(self, actions):
+        # same signal logic as SumoEnv.step: yellow and red transitions, then action_step of green
+        target = np.asarray(actions, dtype=np.int64) * 3
+        change = self.phase != target
+        transition_steps = int(np.ceil(TRANSITION_DURATION / self.dt))
+        green_steps = int(self.action_step / self.dt)
+        total_steps = np.where(change, 2 * transition_steps, 0) + green_steps
+        start_phase = self.phase.copy()
+
+        total_waiting = np.zeros(self.num_envs)
+        max_waiting = np.zeros(self.num_envs)
+        for k in range(int(total_steps.max())):
+            active = k < total_steps
+            in_transition = change & (k < 2 * transition_steps)
+            phase = np.where(in_transition, (start_phase + 1 + k // transition_steps) % NUM_PHASES, target)
+            self.spent = np.where(phase != self.phase, 0, self.spent)
+            self.phase = np.where(active, phase, self.phase)
+
+            waiting_sum, waiting_max = self._micro_step(active, self.green_rows[self.phase])
+            total_waiting += np.where(active, waiting_sum, 0)
+            green_execution = active & ~in_transition
+            max_waiting = np.where(green_execution, np.maximum(max_waiting, waiting_max), max_waiting)
+
+        reward = -total_waiting / self.reward_scale
+        reward -= np.maximum(max_waiting - 180, 0) * 0.5 / self.reward_scale
+
+        empty = ~self.occupied.any(axis=(1, 2)) & (self.backlog.sum(axis=(1, 2)) == 0)
+        terminated = empty & (self.time > self.demand_end)
+        truncated = self.time >= self.episode_duration
+        return reward.astype(np.float32), terminated, truncated, total_waiting, max_waiting
+
+    def observe(self, out=None):
+        if out is None:
+            out = np.empty((self.num_envs, self.obs_dim), dtype=np.float32)
+
+        grid = out[:, :self.num_lanes * self.num_cells].reshape(self.num_envs, self.num_lanes, self.num_cells)
+        speed_ms = self.speed * (self.cell_length / self.dt)
+        # DTSE cell index is the distance to the intersection: lane cell 0 is the stop line
+        grid[...] = -1.0
+        grid[..., self.dtse_cells] = np.where(self.occupied, np.minimum(speed_ms / self.lane_speed, 1.0), -1.0)
+
+        phase_info = out[:, self.num_lanes * self.num_cells:]
+        phase_info[:, 0] = self.phase == NS_GREEN
+        phase_info[:, 1] = self.phase == EW_GREEN
+        phase_info[:, 2] = np.minimum(1.0, self.spent / 120.0)
+        return out
+
+
+class SurrogateVecEnv(VecEnv):
+    # SB3 VecEnv over one SurrogateSim batch. Episodes follow the SumoEnv numbering: every
+    # env takes the next id after episode_offset, or cycles through episode_list.
+    def __init__(self, sim_config, num_envs, params=None, episode_offset=0, episode_list=[], obs_stack=1, seed=0, **sim_kwargs):
+        self.sim = SurrogateSim(sim_config, num_envs, params=params, seed=seed, **sim_kwargs)
+        self.obs_stack = obs_stack
+        self.episode_list = episode_list
+        self.next_episode = episode_offset
+        self.episode_count = 0
+
+        observation_space = spaces.Box(low=-1, high=1, shape=(self.sim.obs_dim * obs_stack,), dtype=np.float32)
+        super().__init__(num_envs, observation_space, spaces.Discrete(2))
+        self.frames = np.zeros((num_envs, obs_stack, self.sim.obs_dim), dtype=np.float32)
+        self._actions = None
+        self.fidelity = ["micro"] * num_envs
+
+    def _next_episode_ids(self, count):
+        ids = []
+        for _ in range(count):
+            if self.episode_list:
+                ids.append(self.episode_list[self.episode_count % len(self.episode_list)])
+            else:
+                self.next_episode += 1
+                ids.append(self.next_episode)
+            self.episode_count += 1
+        return ids
+
+    def _reset_envs(self, indices):
+        self.sim.reset(indices, self._next_episode_ids(len(indices)))
+        # first frame after a reset pads the whole history, like FrameRing
+        self.frames[indices] = self.sim.observe()[indices, None, :]
+
+    def reset(self):
+        self._reset_envs(np.arange(self.num_envs))
+        return self.frames.reshape(self.num_envs, -1).copy()
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def step_wait(self):
+        rewards, terminated, truncated, total_waiting, max_waiting = self.sim.step(self._actions)
+        self.frames[:, :-1] = self.frames[:, 1:]
+        self.frames[:, -1] = self.sim.observe()
+
+        dones = terminated | truncated
+        obs = self.frames.reshape(self.num_envs, -1).copy()
+        infos = [{"waiting_time": total_waiting[i], "max_waiting_time": max_waiting[i]} for i in range(self.num_envs)]
+
+        done_idx = np.nonzero(dones)[0]
+        if len(done_idx):
+            for i in done_idx:
+                infos[i]["terminal_observation"] = obs[i].copy()
+                infos[i]["TimeLimit.truncated"] = bool(truncated[i] and not terminated[i])
+            self._reset_envs(done_idx)
+            obs[done_idx] = self.frames[done_idx].reshape(len(done_idx), -1)
+
+        return obs, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    # per-env state lives in the arrays of the batch, e.g. get_attr("episode_ids")
+    def get_attr(self, attr_name, indices=None):
+        values = getattr(self.sim, attr_name)
+        return [values[i] for i in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        getattr(self.sim, attr_name)[list(self._get_indices(indices))] = value
+
+    # the per-env methods of SumoEnv used by the training callbacks
+    def set_fidelity(self, fidelity, index):
+        # the surrogate has one resolution: the level is checked and recorded, the dynamics do not change
+        if fidelity not in FIDELITY_LEVELS:
+            raise ValueError(f"Unknown fidelity level: {fidelity}")
+        self.fidelity[index] = fidelity
+
+    def current_observation(self, index):
+        return self.frames[index].reshape(-1).copy()
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        if method_name not in ("set_fidelity", "current_observation"):
+            raise NotImplementedError(f"SurrogateVecEnv has no per-env method {method_name}")
+        method = getattr(self, method_name)
+        return [method(*method_args, index=i, **method_kwargs) for i in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
+
+
+
+def benchmark(num_envs, decisions, params):
+    env = SurrogateVecEnv(CONFIG_4WAY_160M, num_envs, params=params)
+    env.reset()
+    start = time.perf_counter()
+    for _ in range(decisions):
+        env.step(np.random.randint(0, 2, size=num_envs))
+    elapsed = time.perf_counter() - start
+    return num_envs * decisions / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorized surrogate of the 4-way crossing")
+    parser.add_argument("--params", type=str, required=False, help="Calibrated parameters (surrogate_calibration.py)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("benchmark", help="Decisions per second at several batch sizes")
+    bench_parser.add_argument("--num-envs", type=int, nargs="+", default=[1, 64, 1024, 4096])
+    bench_parser.add_argument("--decisions", type=int, default=50)
+
+    pretrain_parser = subparsers.add_parser("pretrain", help="Train PPO on the surrogate, the model can then be tested on SUMO with test.py")
+    pretrain_parser.add_argument("--num-envs", type=int, default=1024)
+    pretrain_parser.add_argument("--timesteps", type=int, default=20_000_000)
+    pretrain_parser.add_argument("--n-steps", type=int, default=64, help="PPO rollout length per env")
+    pretrain_parser.add_argument("--reward-scale", type=float, default=10000, help="Reward divisor, as reward_scale of SumoEnv")
+
+    args = parser.parse_args()
+    params = load_params(args.params) if args.params else SurrogateParams()
+
+    if args.command == "benchmark":
+        print(f"{'envs':>6} {'decisions/s':>12}")
+        for num_envs in args.num_envs:
+            print(f"{num_envs:>6} {benchmark(num_envs, args.decisions, params):>12.0f}")
+    else:
+        from stable_baselines3 import PPO
+        from stable_baselines3.common.vec_env import VecMonitor
+        from train import setup_run_directories
+
+        models_dir, log_dir, train_id = setup_run_directories()
+        env = VecMonitor(SurrogateVecEnv(CONFIG_4WAY_160M, args.num_envs, params=params, reward_scale=args.reward_scale), filename=os.path.join(log_dir, "monitor.csv"))
+        model = PPO("MlpPolicy", env, n_steps=args.n_steps, batch_size=4096, tensorboard_log=log_dir, device="auto")
+        model.learn(total_timesteps=args.timesteps)
+        model.save(f"{models_dir}/PPO_{train_id}")
+        print(f"Surrogate-pretrained model saved as PPO_{train_id}, check it on SUMO with: python test.py --id {train_id}")
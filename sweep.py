@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import math
+import time
+import signal
+import argparse
+import subprocess
+import numpy as np
+from resource_manager import CpuTopology, detect_topology, plan_layout, apply_learner_layout, limit_worker_threads
+
+# Hyperparameter sweep over PPO and env parameters. The scheduler runs every trial in its own
+# process group on a disjoint set of physical cores and scores it on the validation episodes
+# at every rung (episode budget). Trials clearly worse than their peers at a rung are stopped
+# (asynchronous successive halving or median rule). The sweep state is a JSON file rewritten
+# atomically, so an interrupted sweep is resumed from it.
+
+BASE_SWEEP_DIR = os.path.join("logs", "sweeps")
+STATE_FILE = "sweep_state.json"
+PROGRESS_FILE = "progress.json"
+
+ENV_PARAMS = ["sim_step", "action_step", "reward_scale"]
+
+DEFAULT_SPACE = {
+    "learning_rate": {"type": "loguniform", "low": 1e-5, "high": 1e-3},
+    "n_steps":       {"type": "choice", "values": [256, 512, 1024, 2048]},
+    "batch_size":    {"type": "choice", "values": [64, 128, 256]},
+    "gamma":         {"type": "choice", "values": [0.95, 0.98, 0.99, 0.995]},
+    "gae_lambda":    {"type": "uniform", "low": 0.9, "high": 1.0},
+    "ent_coef":      {"type": "loguniform", "low": 1e-4, "high": 5e-2},
+    "clip_range":    {"type": "choice", "values": [0.1, 0.2, 0.3]},
+    "n_epochs":      {"type": "choice", "values": [5, 10, 20]},
+    "action_step":   {"type": "choice", "values": [5, 10, 15]},
+    "reward_scale":  {"type": "choice", "values": [1000, 10000, 100000]},
+}
+
+
+def sample_params(space, rng):
+    params = {}
+    for name, spec in space.items():
+        if spec["type"] == "choice":
+            params[name] = spec["values"][rng.integers(len(spec["values"]))]
+        elif spec["type"] == "uniform":
+            params[name] = float(rng.uniform(spec["low"], spec["high"]))
+        elif spec["type"] == "loguniform":
+            params[name] = float(math.exp(rng.uniform(math.log(spec["low"]), math.log(spec["high"]))))
+        else:
+            raise ValueError(f"Unknown distribution for {name}: {spec['type']}")
+        if isinstance(params[name], np.generic):
+            params[name] = params[name].item()
+    return params
+
+
+def rung_budgets(min_episodes, max_episodes, eta):
+    budgets = []
+    budget = min_episodes
+    while budget < max_episodes:
+        budgets.append(budget)
+        budget *= eta
+    budgets.append(max_episodes)
+    return budgets
+
+
+def should_stop(rule, score, peer_scores, eta, min_peers=3):
+    # scores are higher-is-better; peer_scores are the other trials at the same rung
+    if len(peer_scores) < min_peers:
+        return False
+    if rule == "median":
+        return score < float(np.median(peer_scores))
+    # asha: only the top 1/eta of the rung continues
+    scores = sorted(peer_scores + [score], reverse=True)
+    keep = max(1, len(scores) // eta)
+    return score < scores[keep - 1]
+
+
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def trial_dir(sweep_dir, trial_id):
+    return os.path.join(sweep_dir, f"trial_{trial_id:03d}")
+
+
+# ---------------------------------------------------------------------------
+# Trial process
+# ---------------------------------------------------------------------------
+
+def evaluate_trial(model, env_params, log_dir, episodes):
+    from sumo_env import SumoEnv
+    from sim_config import CONFIG_4WAY_160M
+    from evaluation import run_policy_episode
+
+    env = SumoEnv(sim_config=CONFIG_4WAY_160M,
+                  sim_step=env_params["sim_step"],
+                  action_step=env_params["action_step"],
+                  episode_duration=3600,
+                  log_folder=log_dir,
+                  rank="eval",
+                  episode_list=episodes,
+                  enable_measure=True,
+                  workspace_root=os.path.join(log_dir, "workspace"))
+    try:
+        results = [run_policy_episode(env, lambda obs: model.predict(obs, deterministic=True)[0]) for _ in episodes]
+    finally:
+        env.close()
+
+    # scale-free score: the trials differ in reward_scale and action_step
+    return -float(np.mean([r["totalWaitingTime"] for r in results]))
+
+
+def run_trial(sweep_dir, trial_id, cpus):
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.vec_env import VecMonitor
+    from fast_vec_env import FastSubprocVecEnv
+    from train import make_env, StopAtMaxEpisodesVec, TIMESTEPS
+    from episode_sets import EPISODE_VALIDATION_IDS
+
+    state = read_json(os.path.join(sweep_dir, STATE_FILE))
+    trial = state["trials"][trial_id]
+    config = state["config"]
+    params = trial["params"]
+    env_params = {"sim_step": 0.5, "action_step": 10, "reward_scale": 10000}
+    env_params.update({k: v for k, v in params.items() if k in ENV_PARAMS})
+    ppo_params = {k: v for k, v in params.items() if k not in ENV_PARAMS}
+
+    log_dir = trial_dir(sweep_dir, trial_id)
+    os.makedirs(log_dir, exist_ok=True)
+    progress_path = os.path.join(log_dir, PROGRESS_FILE)
+    progress = read_json(progress_path) if os.path.exists(progress_path) else {"rungs": {}, "episodes": 0}
+
+    # the trial cores, split between one learner core and the env workers
+    topology = detect_topology()
+    cores = [core for core in topology.physical_cores if core[0] in cpus]
+    layout = plan_layout(CpuTopology(cpus, {0: cpus}, cores), config["envs_per_trial"], learner_cores=1)
+    limit_worker_threads()
+
+    workspace_root = os.path.join(log_dir, "workspace")
+    env = FastSubprocVecEnv([make_env(i, log_dir, cpu_set=env_cpus, workspace_root=workspace_root, **env_params)
+                             for i, env_cpus in enumerate(layout.env_cpus)])
+    env = VecMonitor(env, filename=os.path.join(log_dir, f"monitor_{progress['episodes']}.csv"))
+    apply_learner_layout(layout)
+
+    # a restarted trial continues from the model of its last completed rung
+    model_path = os.path.join(log_dir, "model.zip")
+    if progress["rungs"] and os.path.exists(model_path):
+        model = PPO.load(model_path, env=env, device="auto")
+    else:
+        model = PPO("MlpPolicy", env, tensorboard_log=log_dir, device="auto", seed=config["seed"] + trial_id, **ppo_params)
+
+    try:
+        for budget in config["rungs"]:
+            if str(budget) in progress["rungs"]:
+                continue
+
+            stop_callback = StopAtMaxEpisodesVec(max_episodes=budget - progress["episodes"], verbose=0)
+            model.learn(total_timesteps=TIMESTEPS, callback=stop_callback, reset_num_timesteps=False)
+            progress["episodes"] = budget
+            model.save(model_path)
+
+            score = evaluate_trial(model, env_params, log_dir, EPISODE_VALIDATION_IDS[:config["eval_episodes"]])
+            progress["rungs"][str(budget)] = score
+            write_json(progress_path, progress)
+            print(f"[Trial {trial_id}] {budget} episodes: score {score:.2f}")
+    finally:
+        env.close()
+
+
+# ---------------------------------------------------------------------------
+# Scheduler
+# ---------------------------------------------------------------------------
+
+class SweepScheduler:
+    def __init__(self, sweep_dir, config, space):
+        self.sweep_dir = sweep_dir
+        self.state_path = os.path.join(sweep_dir, STATE_FILE)
+        self.processes = {}
+
+        if os.path.exists(self.state_path):
+            self.state = read_json(self.state_path)
+            # trials interrupted together with the previous scheduler run again from their last rung
+            for trial in self.state["trials"]:
+                if trial["status"] == "running":
+                    trial["status"] = "pending"
+            print(f"Resuming sweep from {self.state_path}")
+        else:
+            rng = np.random.default_rng(config["seed"])
+            trials = [{"id": i, "params": sample_params(space, rng), "status": "pending", "rungs": {}}
+                      for i in range(config["num_trials"])]
+            self.state = {"config": config, "space": space, "trials": trials}
+        self.save()
+
+        topology = detect_topology()
+        cores_per_trial = self.state["config"]["envs_per_trial"] + 1
+        cores = topology.physical_cores
+        self.slots = [[c for core in cores[i:i + cores_per_trial] for c in core]
+                      for i in range(0, len(cores) - cores_per_trial + 1, cores_per_trial)]
+        if not self.slots:
+            self.slots = [[c for core in cores for c in core]]
+        self.free_slots = list(range(len(self.slots)))
+        print(f"{len(self.slots)} concurrent trials, {cores_per_trial} physical cores each")
+
+    def save(self):
+        write_json(self.state_path, self.state)
+
+    def _start(self, trial):
+        slot = self.free_slots.pop(0)
+        cpus = self.slots[slot]
+        log_dir = trial_dir(self.sweep_dir, trial["id"])
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, "trial_output.txt"), 'a') as output:
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "trial",
+                                        "--sweep-dir", self.sweep_dir, "--trial-id", str(trial["id"]),
+                                        "--cpus", ",".join(map(str, cpus))],
+                                       stdout=output, stderr=subprocess.STDOUT, start_new_session=True)
+        self.processes[trial["id"]] = (process, slot)
+        trial["status"] = "running"
+        trial["cpus"] = cpus
+        print(f"Trial {trial['id']} started on CPUs {cpus}: {trial['params']}")
+
+    def _stop(self, trial, status):
+        process, slot = self.processes.pop(trial["id"])
+        if process.poll() is None:
+            # the trial and its env workers
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+        self.free_slots.append(slot)
+        trial["status"] = status
+
+    def _peer_scores(self, trial, budget):
+        return [t["rungs"][budget] for t in self.state["trials"] if t["id"] != trial["id"] and budget in t["rungs"]]
+
+    def _update(self, trial):
+        progress_path = os.path.join(trial_dir(self.sweep_dir, trial["id"]), PROGRESS_FILE)
+        if os.path.exists(progress_path):
+            for budget, score in read_json(progress_path)["rungs"].items():
+                if budget in trial["rungs"]:
+                    continue
+                trial["rungs"][budget] = score
+                config = self.state["config"]
+                if int(budget) < config["rungs"][-1] and should_stop(config["rule"], score, self._peer_scores(trial, budget), config["eta"]):
+                    print(f"Trial {trial['id']} stopped at {budget} episodes (score {score:.2f})")
+                    self._stop(trial, "stopped")
+                    return
+
+        process, _ = self.processes[trial["id"]]
+        if process.poll() is not None:
+            completed = str(self.state["config"]["rungs"][-1]) in trial["rungs"]
+            self._stop(trial, "completed" if completed else "failed")
+            print(f"Trial {trial['id']} {trial['status']}")
+
+    def run(self, poll_interval=10):
+        try:
+            while True:
+                for trial in self.state["trials"]:
+                    if trial["status"] == "running":
+                        self._update(trial)
+                for trial in self.state["trials"]:
+                    if trial["status"] == "pending" and self.free_slots:
+                        self._start(trial)
+                self.save()
+
+                if not any(t["status"] in ("pending", "running") for t in self.state["trials"]):
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("\nSweep interrupted, resume it with --resume")
+            for trial in self.state["trials"]:
+                if trial["id"] in self.processes:
+                    self._stop(trial, "pending")
+            self.save()
+            raise
+
+    def leaderboard(self, top=10):
+        last_rung = str(self.state["config"]["rungs"][-1])
+        ranked = sorted((t for t in self.state["trials"] if last_rung in t["rungs"]), key=lambda t: t["rungs"][last_rung], reverse=True)
+        print(f"--- Best trials ({len(ranked)} completed) ---")
+        for trial in ranked[:top]:
+            print(f"Trial {trial['id']}: score {trial['rungs'][last_rung]:.2f} {trial['params']}")
+
+
+def next_sweep_id():
+    if not os.path.exists(BASE_SWEEP_DIR):
+        return 1
+    ids = [int(d.split("_")[1]) for d in os.listdir(BASE_SWEEP_DIR) if d.startswith("sweep_") and d.split("_")[1].isdigit()]
+    return max(ids, default=0) + 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep with early stopping")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Start or resume a sweep")
+    run_parser.add_argument("--id", type=int, required=False, help="Sweep ID (default: a new sweep)")
+    run_parser.add_argument("--resume", action="store_true", required=False, help="Resume the sweep given with --id")
+    run_parser.add_argument("--space", type=str, required=False, help="JSON file with the search space (default: DEFAULT_SPACE)")
+    run_parser.add_argument("--trials", type=int, default=24)
+    run_parser.add_argument("--envs-per-trial", type=int, default=4)
+    run_parser.add_argument("--min-episodes", type=int, default=100, help="Episode budget of the first rung")
+    run_parser.add_argument("--max-episodes", type=int, default=1000, help="Episode budget of a full trial")
+    run_parser.add_argument("--eta", type=int, default=3, help="Reduction factor between rungs")
+    run_parser.add_argument("--rule", type=str, default="asha", choices=["asha", "median"])
+    run_parser.add_argument("--eval-episodes", type=int, default=4, help="Validation episodes used to score a trial")
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    trial_parser = subparsers.add_parser("trial", help="Run a single trial (started by the scheduler)")
+    trial_parser.add_argument("--sweep-dir", type=str, required=True)
+    trial_parser.add_argument("--trial-id", type=int, required=True)
+    trial_parser.add_argument("--cpus", type=str, required=True)
+
+    args = parser.parse_args()
+
+    if args.command == "trial":
+        run_trial(args.sweep_dir, args.trial_id, [int(c) for c in args.cpus.split(",")])
+        sys.exit(0)
+
+    if args.resume and args.id is None:
+        print("ERROR: --resume requires --id")
+        sys.exit(1)
+    sweep_id = args.id if args.id is not None else next_sweep_id()
+    sweep_dir = os.path.join(BASE_SWEEP_DIR, f"sweep_{sweep_id}")
+    if os.path.exists(os.path.join(sweep_dir, STATE_FILE)) and not args.resume:
+        print(f"ERROR: sweep {sweep_id} already exists, use --resume")
+        sys.exit(1)
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    space = DEFAULT_SPACE
+    if args.space:
+        space = read_json(args.space)
+    config = {
+        "num_trials": args.trials,
+        "envs_per_trial": args.envs_per_trial,
+        "rungs": rung_budgets(args.min_episodes, args.max_episodes, args.eta),
+        "eta": args.eta,
+        "rule": args.rule,
+        "eval_episodes": args.eval_episodes,
+        "seed": args.seed,
+    }
+
+    print(f"Sweep {sweep_id}: {sweep_dir}")
+    scheduler = SweepScheduler(sweep_dir, config, space)
+    scheduler.run()
+    scheduler.leaderboard()
@@ -3,9 +3,16 @@ import sys
 import numpy as np
 import shutil
 import argparse
+import time
 from stable_baselines3 import PPO
-from sumo_env import SumoEnv
+from sumo_env import SumoEnv, MEASURE_MODES
+from evaluation import model_env_modes
 from sim_config import CONFIG_4WAY_160M 
+from resource_manager import configure_evaluation_process
+from results_store import ResultsStore
+from baseline_cache import BaselineCache
+from episode_sets import EPISODE_TEST_IDS
+from scenario_catalog import split_ids
 
 def write_measures(measures, summary_filename, measures_file_basename, ep):
     ep_measures_file_name = f"{measures_file_basename}_ep{ep}.txt"
@@ -36,9 +43,17 @@ def write_measures(measures, summary_filename, measures_file_basename, ep):
                 print(f"{m[k]}", file=f, end=";")
             print(file=f)
 
+    if results_store is not None:
+        results_store.add_measures(results_run_id, measures_file_basename.replace("_measures", ""), ep, measures)
+
 parser = argparse.ArgumentParser(description="Run tests on specific PPO model")
 parser.add_argument("--id", type=int, required=True, help="Training ID")
 parser.add_argument("--skip-stl", action="store_true", required=False, help="Skip STL tests")
+parser.add_argument("--refresh-baselines", action="store_true", required=False, help="Recompute the STL baselines even if cached")
+parser.add_argument("--trace", action="store_true", required=False, help="Record the decision traces of every run in LOG_DIR/traces")
+parser.add_argument("--measure-mode", type=str, choices=MEASURE_MODES, default="poll", help="Per vehicle KPIs from libsumo polling or from the SUMO tripinfo output")
+parser.add_argument("--results-db", type=str, required=False, help="Also store the results in this SQLite database")
+parser.add_argument("--split", type=str, required=False, help="Test on this split of the scenario catalog instead of the fixed test episodes")
 args = parser.parse_args()
 
 MODEL_RUN = f"train_id_{args.id}"
@@ -47,21 +62,25 @@ if os.path.exists(LOG_DIR):
     shutil.rmtree(LOG_DIR)
 os.makedirs(LOG_DIR)
 
+configure_evaluation_process(LOG_DIR)
+
 MODELS_DIR = os.path.join("models", "ppo", MODEL_RUN)
 
 MODEL_NAME = f"PPO_{args.id}"
 
-EPISODE_TEST_IDS = [64578, # Low 743
-                    64579, # Low 376
-                    64581, # Medium 1415
-                    64582, # Medium 1209
-                    64607, # High 1720
-                    64585, # High 2087
-                    64580, # Wave 1774
-                    64587, # Wave 2183
-                    64589, # Unbalanced 1902
-                    64598] # Unbalanced 2143
-TEST_EPISODES = len(EPISODE_TEST_IDS)
+results_store = None
+results_run_id = None
+if args.results_db:
+    results_store = ResultsStore(args.results_db)
+    results_run_id = results_store.add_run(MODEL_NAME, args.id, source=LOG_DIR)
+
+TEST_IDS = split_ids(args.split) if args.split else EPISODE_TEST_IDS
+TEST_EPISODES = len(TEST_IDS)
+
+STL_VARIANTS = [([], "stl"),       # STL without improvments
+                ([1], "stl1"),     # STL with improvment 1 (K = 5)
+                ([2], "stl2"),     # STL with improvment 2 (skip safe guard)
+                ([1,2], "stl12")]  # STL with improvments 1 and 2
 
 model_path = os.path.join(MODELS_DIR, f"{MODEL_NAME}.zip")
 
@@ -71,16 +90,25 @@ if not os.path.exists(model_path):
 
 
 print(f"Loading model from {model_path}")
+model = PPO.load(model_path)
+action_mode, obs_source = model_env_modes(model, CONFIG_4WAY_160M)
+print(f"Action mode: {action_mode}")
+print(f"Observation source: {obs_source}")
 
 env = SumoEnv(sim_config=CONFIG_4WAY_160M, 
             sim_step=0.5, 
             action_step=10, 
             episode_duration=3600, 
             log_folder=LOG_DIR,
-            episode_list=EPISODE_TEST_IDS,
-            enable_measure=True)
+            episode_list=TEST_IDS,
+            enable_measure=True,
+            measure_mode=args.measure_mode,
+            action_mode=action_mode,
+            obs_source=obs_source,
+            trace_folder=os.path.join(LOG_DIR, "traces") if args.trace else None)
 
-model = PPO.load(model_path)
+baseline_cache = BaselineCache()
+runtimes = []
 
 print(f"Running {TEST_EPISODES} test episodes.")
 
@@ -88,7 +116,9 @@ print(f"Running {TEST_EPISODES} test episodes.")
 try:
     for ep in range(1, TEST_EPISODES + 1):
         obs, _ = env.reset()
-        ep_id = EPISODE_TEST_IDS[ep-1]
+        ep_id = TEST_IDS[ep-1]
+        if results_store is not None:
+            results_store.add_episode(ep_id, env.scenario, env.vehicle_num)
 
         done = False
         truncated = False
@@ -101,13 +131,21 @@ try:
         print("---------------------------------------------------")
 
         
+        episode_start = time.perf_counter()
         while not (done or truncated):
             action, _state = model.predict(obs, deterministic=True)
             
             obs, reward, done, truncated, info = env.step(action)
             episode_reward += reward
             step_counter += 1
-            
+        wall_time = time.perf_counter() - episode_start
+        runtimes.append((step_counter, wall_time))
+        with open(os.path.join(LOG_DIR, "ppo_runtime.txt"), 'a') as f:
+            print(f"Episode {ep_id}: {step_counter} decisions, {wall_time:.1f} s", file=f)
+        print(f"PPO decisions: {step_counter}, wall time: {wall_time:.1f} s")
+
+        if env.last_gridlock is not None:
+            print(f"WARNING: PPO run of episode {ep_id} stopped by gridlock at t={env.last_gridlock['gridlock_time']:.0f} s")
         measures = env.get_measures()
         env.dump_vehicle_population(os.path.join(LOG_DIR, f"test_episode_{ep_id}_vehicle_pop.yaml"))
         print(f"Episode {ep_id} terminated.")
@@ -115,28 +153,34 @@ try:
         write_measures(measures, "ppo_summary.txt", "ppo_measures", ep_id)
 
         if not args.skip_stl:
-            # STL without improvments
-            env.run_smart_traffic_light([])
-            measures = env.get_measures()
-            write_measures(measures, "stl_summary.txt", "stl_measures", ep_id)
-
-            # STL with improvment 1 (K = 5)
-            env.run_smart_traffic_light([1])
-            measures = env.get_measures()
-            write_measures(measures, "stl1_summary.txt", "stl1_measures", ep_id)
-
-            # STL with improvment 2 (skip safe guard)
-            env.run_smart_traffic_light([2])
-            measures = env.get_measures()
-            write_measures(measures, "stl2_summary.txt", "stl2_measures", ep_id)
-
-            # STL with improvments 1 and 2
-            env.run_smart_traffic_light([1,2])
-            measures = env.get_measures()
-            write_measures(measures, "stl12_summary.txt", "stl12_measures", ep_id)
+            for enhancements, stl_name in STL_VARIANTS:
+                cache_key, cache_fields = baseline_cache.key(ep_id, enhancements, CONFIG_4WAY_160M, env.sim_step, args.measure_mode)
+                # a traced run needs the STL to play: the cache is bypassed, the new measures stored
+                measures = None if args.refresh_baselines or args.trace else baseline_cache.load(cache_key)
+
+                if measures is None:
+                    env.run_smart_traffic_light(enhancements)
+                    measures = env.get_measures()
+                    if env.last_gridlock is None:
+                        baseline_cache.store(cache_key, cache_fields, measures)
+                    else:
+                        # partial run, recomputed next time
+                        print(f"WARNING: {stl_name.upper()} run of episode {ep_id} stopped by gridlock at t={env.last_gridlock['gridlock_time']:.0f} s")
+                else:
+                    print(f"{stl_name.upper()} measures for episode {ep_id} loaded from cache")
+
+                write_measures(measures, f"{stl_name}_summary.txt", f"{stl_name}_measures", ep_id)
 
 except KeyboardInterrupt:
     print("\nUser interruption.")
 
 finally:
-    env.close()
\ No newline at end of file
+    if runtimes:
+        mean_decisions = np.mean([r[0] for r in runtimes])
+        mean_wall_time = np.mean([r[1] for r in runtimes])
+        print(f"PPO ({action_mode} actions): {mean_decisions:.1f} decisions and {mean_wall_time:.1f} s per episode on average")
+        with open(os.path.join(LOG_DIR, "ppo_runtime.txt"), 'a') as f:
+            print(f"Average ({action_mode} actions): {mean_decisions:.1f} decisions, {mean_wall_time:.1f} s", file=f)
+    env.close()
+    if results_store is not None:
+        results_store.close()
\ No newline at end of file
@@ -3,6 +3,10 @@ import numpy as np
 from enum import Enum
 from vehicle_generator import *
 
+# Bump whenever a change alters the population generated for a given episode id
+# (cached results keyed on the episode id are invalidated).
+GENERATOR_VERSION = 1
+
 class Scenario(Enum):
     LOW = "low"
     MEDIUM = "medium"
@@ -33,8 +37,9 @@ class TrafficGenerator:
             'Bus':                      0.00189
         }
 
-    def generate_traffic(self, episode_index):
-        # For reproducibility
+    def generate_demand(self, episode_index):
+        # Scenario, departs and routes of an episode, without building the vehicles.
+        # generate_traffic continues from the same RNG state, so both see the same demand.
         random.seed(episode_index)
         np.random.seed(episode_index)
 
@@ -47,6 +52,17 @@ class TrafficGenerator:
         depart_times = self._get_depart_times(n_vehicles, selected_scenario)
         routes = self._get_routes(n_vehicles, selected_scenario)
 
+        return selected_scenario, n_vehicles, depart_times, routes
+
+    def episode_scenario(self, episode_index):
+        # first draw of generate_demand, without touching the global RNGs
+        scenarios = list(self.scenario_probs.keys())
+        weights = list(self.scenario_probs.values())
+        return random.Random(episode_index).choices(scenarios, weights=weights, k=1)[0]
+
+    def generate_traffic(self, episode_index):
+        selected_scenario, n_vehicles, depart_times, routes = self.generate_demand(episode_index)
+
         vehicle_list = VehicleList()
         v_types = list(self.vehicle_distribution.keys())
         v_probs = list(self.vehicle_distribution.values())
@@ -70,6 +86,9 @@ class TrafficGenerator:
     
     # Private Methods
     def _get_vehicle_count(self, scenario: Scenario):
+        return int(self._get_base_vehicle_count(scenario) * self.sim_config.demand_scale)
+
+    def _get_base_vehicle_count(self, scenario: Scenario):
         if scenario == Scenario.LOW:
             val = np.random.normal(650, 200)
             return int(np.clip(val, 250, 1000))
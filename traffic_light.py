@@ -1,4 +1,5 @@
-import libsumo
+from lazy_imports import lazy_import
+libsumo = lazy_import("libsumo")
 
 J = 100
 K = 1
@@ -6,9 +7,10 @@ Ke = 5
 
 # Implementation of Denny Ciccia from: https://github.com/dennyciccia/sumo-simulations
 class TrafficLight:
-    def __init__(self, tlID, enhancements):
+    def __init__(self, tlID, enhancements, trace=None):
         self.__tlID = tlID
         self.__enhancements = enhancements  # list of algorithm improvements
+        self.trace = trace                  # DecisionTraceWriter, records every phase change
     
     @property
     def tlID(self):
@@ -25,9 +27,14 @@ class TrafficLight:
         elif libsumo.trafficlight.getPhase(self.tlID) in [0,1,2]: # vertical flow
             return 'VERTICAL'
 
+    def setPhase(self, phase):
+        if self.trace is not None:
+            self.trace.record(libsumo.simulation.getTime(), libsumo.trafficlight.getPhase(self.tlID), phase)
+        libsumo.trafficlight.setPhase(self.tlID, phase)
+
     # traffic light switch to change the flow of traffic
     def switchTrafficLight(self):
-        libsumo.trafficlight.setPhase(self.tlID, libsumo.trafficlight.getPhase(self.tlID)+1)
+        self.setPhase(libsumo.trafficlight.getPhase(self.tlID)+1)
 
     def getHorizontalEdges(self):
         horizontalEdges = []
@@ -81,7 +88,7 @@ class TrafficLight:
 
         # if the vehicles are stationary or there are none, proceed to the green phase
         if (self.movingFlow == 'HORIZONTAL' and (meanSpeedH < 1.0 or vehicleNumberH == 0)) or (self.movingFlow == 'VERTICAL' and (meanSpeedV < 1.0 or vehicleNumberV == 0)):
-            libsumo.trafficlight.setPhase(self.tlID, (libsumo.trafficlight.getPhase(self.tlID)+2)%6)
+            self.setPhase((libsumo.trafficlight.getPhase(self.tlID)+2)%6)
     
     # actions performed at each step of the simulation
     # Here, if we are not in improvement 2 and I am not giving the green light to a direction, nothing is done and the default action of the XML is maintained.
@@ -1,13 +1,24 @@
 import os
+import sys
 import shutil
 import time
 import datetime
+import argparse
 import numpy as np
 from stable_baselines3 import PPO
-from stable_baselines3.common.vec_env import SubprocVecEnv, VecMonitor
+from stable_baselines3.common.vec_env import VecMonitor
 from stable_baselines3.common.callbacks import BaseCallback, CallbackList
-from sumo_env import SumoEnv
+from sumo_env import SumoEnv, FIDELITY_LEVELS, ACTION_MODES, OBS_SOURCES
 from sim_config import CONFIG_4WAY_160M
+from resource_manager import detect_topology, plan_layout, probe_num_envs, apply_learner_layout, limit_worker_threads, pin_current_process, log_layout
+from fast_vec_env import log_startup_profile
+from supervised_vec_env import SupervisedSubprocVecEnv, WorkerHealth
+from async_eval import AsyncEvalCallback
+from episode_sets import EPISODE_TEST_IDS, training_offset, check_training_ids, check_not_evaluation
+from scenario_catalog import split_ids
+from checkpointing import PeriodicCheckpoint, latest_checkpoint, read_training_state, load_checkpoint, restore_training_state
+from smdp import SMDPRolloutBuffer, SMDPDurations
+from demand_stream import DEMAND_PROFILES, SEGMENT_LENGTH
 
 NUM_CPU = 16
 TIMESTEPS = 10_000_000 # very high limit, never reached for 500 episodes
@@ -38,8 +49,9 @@ def get_next_train_id(base_dir):
         
     return max(train_ids) + 1
 
-def setup_run_directories():
-    train_id = get_next_train_id(BASE_LOG_DIR)
+def setup_run_directories(train_id=None):
+    if train_id is None:
+        train_id = get_next_train_id(BASE_LOG_DIR)
     run_name = f"train_id_{train_id}"
 
     current_models_dir = os.path.join(BASE_MODELS_DIR, run_name)
@@ -66,6 +78,9 @@ class TensorboardCallback(BaseCallback):
             
             if "episode_avgco2" in info:
                 self.logger.record("episode/avg_ep_co2", info["episode_avgco2"])
+
+            if info.get("gridlock"):
+                self.logger.record("episode/gridlock_time_saved", info["gridlock_time_saved"])
                 
         return True
 
@@ -98,18 +113,76 @@ class StopAtMaxEpisodesVec(BaseCallback):
             
         return True
 
-def make_env(rank, log_dir, seed=0):
+def parse_fidelity_schedule(text):
+    # "meso_coarse:1000,meso:1000,micro" -> [("meso_coarse", 1000), ("meso", 1000), ("micro", None)]
+    schedule = []
+    for part in text.split(","):
+        level, _, episodes = part.partition(":")
+        if level not in FIDELITY_LEVELS:
+            raise ValueError(f"Unknown fidelity level: {level}")
+        schedule.append((level, int(episodes) if episodes else None))
+    return schedule
+
+def fidelity_at(schedule, episodes_done):
+    for level, episodes in schedule:
+        if episodes is None or episodes_done < episodes:
+            return level
+        episodes_done -= episodes
+    return schedule[-1][0]
+
+class FidelitySchedule(BaseCallback):
+    # Switches the simulation fidelity of every env worker after a number of completed episodes.
+    # Each worker applies the new level at its next reset.
+    def __init__(self, schedule, episode_counter, verbose=1):
+        super().__init__(verbose)
+        self.schedule = schedule
+        self.episode_counter = episode_counter
+        self.current = None
+
+    def _update(self):
+        level = fidelity_at(self.schedule, self.episode_counter.episode_count)
+        if level != self.current:
+            self.training_env.env_method("set_fidelity", level)
+            self.current = level
+            self.logger.record("train/fidelity", list(FIDELITY_LEVELS).index(level))
+            if self.verbose > 0:
+                print(f"Simulation fidelity: {level} (from episode {self.episode_counter.episode_count})")
+
+    def _on_training_start(self):
+        self._update()
+
+    def _on_step(self):
+        self._update()
+        # a restarted worker is built at the initial level, from its next reset it follows again
+        for i, info in enumerate(self.locals["infos"]):
+            if "worker_restart" in info:
+                self.training_env.env_method("set_fidelity", self.current, indices=[i])
+        return True
+
+def make_env(rank, log_dir, seed=0, cpu_set=None, fidelity="micro", sim_step=0.5, action_step=10, reward_scale=10000, workspace_root=SUMO_WORKSPACE, action_mode="fixed", demand_profile=None, obs_source="dtse", episode_offset=None, episode_count=0, episode_list=[]):
     def _init():
-        episode_offset = rank * 2000 
+        if cpu_set:
+            pin_current_process(cpu_set)
+
+        offset = training_offset(rank) if episode_offset is None else episode_offset
         
         env = SumoEnv(
             sim_config=CONFIG_4WAY_160M, 
-            sim_step=0.5, 
-            action_step=10, 
-            episode_duration=3600, 
+            sim_step=sim_step, 
+            action_step=action_step, 
+            episode_duration=3600 if demand_profile is None else len(DEMAND_PROFILES[demand_profile]) * SEGMENT_LENGTH, 
             log_folder=log_dir,
             rank=rank,          # Proc ID
-            episode_offset=episode_offset # Offset
+            episode_offset=offset, # Offset
+            episode_count=episode_count, # list mode: position in episode_list of the first episode
+            episode_list=episode_list, # catalog split: played in a loop instead of the offset range
+            prefetch=True, # next episode population built while the current one runs
+            fidelity=fidelity,
+            reward_scale=reward_scale,
+            workspace_root=workspace_root,
+            action_mode=action_mode,
+            demand_profile=demand_profile,
+            obs_source=obs_source
         )
         
         env.reset(seed=seed + rank)
@@ -118,26 +191,138 @@ def make_env(rank, log_dir, seed=0):
     return _init
 
 if __name__ == "__main__":
-    models_dir, log_dir, train_id = setup_run_directories()
+    parser = argparse.ArgumentParser(description="Train PPO on the SUMO environment")
+    parser.add_argument("--resume", action="store_true", required=False, help="Resume the run from its latest checkpoint")
+    parser.add_argument("--id", type=int, required=False, help="Training ID to resume (default: latest run)")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Rollouts between two checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=3, help="Number of checkpoints kept on disk")
+    parser.add_argument("--num-envs", type=str, default=str(NUM_CPU), help="Env workers, or 'auto' for one per free physical core")
+    parser.add_argument("--learner-cores", type=int, default=2, help="Physical cores reserved to the PPO learner")
+    parser.add_argument("--probe", action="store_true", required=False, help="Pick the env count with the best measured env steps/s")
+    parser.add_argument("--no-pinning", action="store_true", required=False, help="Do not pin the learner and the env workers to cores")
+    parser.add_argument("--action-mode", type=str, choices=ACTION_MODES, default="fixed", help="fixed: green held for 10 s, duration: the policy also picks the green duration (keep it when resuming)")
+    parser.add_argument("--obs-source", type=str, choices=OBS_SOURCES, default="dtse", help="Observation/reward from the vehicles (DTSE) or from the detectors")
+    parser.add_argument("--demand-profile", type=str, choices=list(DEMAND_PROFILES), required=False, help="Long-horizon episodes with streaming demand")
+    parser.add_argument("--init-model", type=str, required=False, help="Start from the weights of this model (e.g. pretrained by pretrain_bc.py)")
+    parser.add_argument("--max-worker-rss", type=float, default=4096, help="Env worker RSS (MB) above which it is recycled at the end of an episode")
+    parser.add_argument("--max-worker-rss-growth", type=float, default=1024, help="Env worker RSS growth (MB) since its first episode above which it is recycled")
+    parser.add_argument("--step-timeout", type=float, default=300, help="Seconds without an answer after which an env worker is restarted")
+    parser.add_argument("--train-split", type=str, required=False, help="Train on this split of the scenario catalog, shared among the workers")
+    parser.add_argument("--eval-every", type=int, default=20, help="Rollouts between two background evaluations of the policy (0: none)")
+    parser.add_argument("--eval-episodes", type=int, default=len(EPISODE_TEST_IDS), help="Test episodes played by every background evaluation")
+    parser.add_argument("--fidelity-schedule", type=str, required=False, help="Fidelity levels and their episodes, e.g. meso_coarse:1000,meso:1000,micro")
+    args = parser.parse_args()
+
+    resume_id = None
+    if args.resume:
+        resume_id = args.id if args.id is not None else get_next_train_id(BASE_LOG_DIR) - 1
+
+    models_dir, log_dir, train_id = setup_run_directories(resume_id)
+    checkpoint_dir = os.path.join(models_dir, "checkpoints")
+    os.makedirs(checkpoint_dir, exist_ok=True)
 
-    print(f"Parallel training on {NUM_CPU} processes")
+    checkpoint = latest_checkpoint(checkpoint_dir) if args.resume else None
+    if args.resume and checkpoint is None:
+        print(f"ERROR: no checkpoint found in {checkpoint_dir}")
+        sys.exit(1)
+    training_state = read_training_state(checkpoint) if checkpoint else None
+
+    # the workers start directly at the fidelity of the current schedule stage
+    fidelity_schedule = parse_fidelity_schedule(args.fidelity_schedule) if args.fidelity_schedule else None
+    initial_fidelity = "micro"
+    if fidelity_schedule:
+        initial_fidelity = fidelity_at(fidelity_schedule, training_state["episodes_done"] if training_state else 0)
+
+    topology = detect_topology()
+    probe_results = {}
+    limit_worker_threads()
+
+    train_ids = split_ids(args.train_split) if args.train_split else []
+    # a split assigned before the evaluation sets were excluded could still hold them
+    check_not_evaluation(train_ids, f"Split {args.train_split}")
+
+    def make_vec_env(layout):
+        # a restarted worker keeps the cores of its rank and starts after the given episode
+        # (with --train-split: at the given position of its list)
+        def worker_env(rank, episode_offset=None, episode_count=0):
+            episode_list = train_ids[rank::len(layout.env_cpus)]
+            if train_ids and not episode_list:
+                raise ValueError(f"Split {args.train_split} has fewer episodes than env workers")
+            return make_env(rank, log_dir, cpu_set=None if args.no_pinning else layout.env_cpus[rank], fidelity=initial_fidelity, action_mode=args.action_mode, demand_profile=args.demand_profile, obs_source=args.obs_source, episode_offset=episode_offset, episode_count=episode_count, episode_list=episode_list)
+        return SupervisedSubprocVecEnv([worker_env(i) for i in range(len(layout.env_cpus))], respawn_fn=worker_env,
+                                       max_rss_mb=args.max_worker_rss, rss_growth_mb=args.max_worker_rss_growth, step_timeout=args.step_timeout)
+
+    # the background evaluation gets a core of its own, taken from the env workers
+    eval_cores = 1 if args.eval_every > 0 else 0
+    if checkpoint is not None:
+        num_envs = training_state["num_envs"]
+    elif args.probe:
+        max_envs = max(1, len(topology.physical_cores) - args.learner_cores - eval_cores)
+        candidates = sorted({max(1, max_envs * k // 4) for k in range(1, 5)})
+        check_training_ids(max(candidates))
+        probe_results = probe_num_envs(make_vec_env, topology, candidates, args.learner_cores, eval_cores=eval_cores)
+        num_envs = max(probe_results, key=probe_results.get)
+    elif args.num_envs == "auto":
+        num_envs = None
+    else:
+        num_envs = int(args.num_envs)
+
+    layout = plan_layout(topology, num_envs, args.learner_cores, eval_cores)
+    check_training_ids(layout.num_envs)
+    layout.probe = probe_results
+    log_layout(layout, log_dir)
+    if not args.no_pinning:
+        apply_learner_layout(layout)
+
+    print(f"Parallel training on {layout.num_envs} processes")
     
-    env = SubprocVecEnv([make_env(i, log_dir) for i in range(NUM_CPU)])
+    env = make_vec_env(layout)
+    log_startup_profile(env, log_dir)
     
-    env = VecMonitor(env, filename=os.path.join(log_dir, "monitor.csv"))
+    # the monitor file of the interrupted run is kept, the resumed part goes in a new one
+    monitor_file = "monitor.csv" if checkpoint is None else f"monitor_resume_{training_state['num_timesteps']}.csv"
+    env = VecMonitor(env, filename=os.path.join(log_dir, monitor_file))
 
-    model = PPO(
-        "MlpPolicy", 
-        env, 
-        tensorboard_log=log_dir,
-        device="auto"
-    )
+    callback_max_episodes = StopAtMaxEpisodesVec(max_episodes=5000, verbose=1)
+
+    # decisions of variable duration: discount gamma per 10 s of simulated time
+    smdp_kwargs = {}
+    if args.action_mode == "duration":
+        smdp_kwargs = {"rollout_buffer_class": SMDPRolloutBuffer, "rollout_buffer_kwargs": {"reference_duration": 10.0}}
+
+    if checkpoint is None:
+        model = PPO(
+            "MlpPolicy", 
+            env, 
+            tensorboard_log=log_dir,
+            device="auto",
+            **smdp_kwargs
+        )
+        if args.init_model:
+            print(f"Initializing the policy from {args.init_model}")
+            model.set_parameters(args.init_model, exact_match=True)
+    else:
+        print(f"Resuming from {checkpoint} ({training_state['episodes_done']} episodes done)")
+        model = load_checkpoint(checkpoint, env, tensorboard_log=log_dir, device="auto")
+        restore_training_state(model, training_state, callback_max_episodes)
+
+    callback_checkpoint = PeriodicCheckpoint(checkpoint_dir, callback_max_episodes, every_rollouts=args.checkpoint_every, keep_last=args.keep_checkpoints)
 
     print(f"Start training...")
     start_time = time.perf_counter()
-    callback_max_episodes = StopAtMaxEpisodesVec(max_episodes=5000, verbose=1)
-    callbacks = CallbackList([callback_max_episodes, TensorboardCallback()])
-    model.learn(total_timesteps=TIMESTEPS, callback=callbacks)
+    callback_list = [callback_max_episodes, callback_checkpoint, TensorboardCallback(), WorkerHealth()]
+    if args.action_mode == "duration":
+        callback_list.append(SMDPDurations())
+    if args.eval_every > 0:
+        # same episodes as test.py, at full fidelity; best model in models_dir/eval
+        eval_env_kwargs = {"sim_config": CONFIG_4WAY_160M, "sim_step": 0.5, "action_step": 10, "episode_duration": 3600,
+                           "action_mode": args.action_mode, "obs_source": args.obs_source}
+        callback_list.append(AsyncEvalCallback(os.path.join(models_dir, "eval"), eval_env_kwargs, EPISODE_TEST_IDS[:args.eval_episodes],
+                                               every_rollouts=args.eval_every, cpu_set=None if args.no_pinning else layout.eval_cpus))
+    if fidelity_schedule:
+        callback_list.append(FidelitySchedule(fidelity_schedule, callback_max_episodes))
+    callbacks = CallbackList(callback_list)
+    model.learn(total_timesteps=TIMESTEPS - model.num_timesteps, callback=callbacks, reset_num_timesteps=checkpoint is None)
 
     end_time = time.perf_counter()
     elapsed = int(end_time - start_time)
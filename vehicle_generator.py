@@ -1,10 +1,13 @@
 from abc import ABC
+from xml.dom import minidom
 from random import randint
 import random
 import numpy as np
-import libsumo
-import yaml
 from driver_profile import DriverProfile
+from lazy_imports import lazy_import
+
+libsumo = lazy_import("libsumo")
+yaml = lazy_import("yaml")
 
 class VehicleList(list):
     def getVehicle(self, vehicleID):
@@ -23,6 +26,34 @@ class VehicleList(list):
         return obj
 
 
+def vehicle_types_xml(vehicleList):
+    # vType of every vehicle, content of vehicletypes.rou.xml
+    rootXML = minidom.Document()
+    routes = rootXML.createElement('routes')
+    rootXML.appendChild(routes)
+
+    for v in vehicleList:
+        vtype = rootXML.createElement('vType')
+        vtype.setAttribute('id', 'vtype-'+v.vehicleID)
+        vtype.setAttribute('length', str(v.length))
+        vtype.setAttribute('mass', str(v.weight))
+        vtype.setAttribute('maxSpeed', str(v.maxSpeed))
+        vtype.setAttribute('accel', str(v.acceleration))
+        vtype.setAttribute('decel', str(v.brakingAcceleration))
+        vtype.setAttribute('emergencyDecel', str(v.fullBrakingAcceleration))
+        vtype.setAttribute('minGap', str(v.minGap))
+        vtype.setAttribute('tau', str(v.driverProfile.tau))
+        vtype.setAttribute('sigma', str(v.driverProfile.sigma))
+        vtype.setAttribute('speedFactor', str(v.driverProfile.speedLimitComplianceFactor))
+        vtype.setAttribute('vClass', str(v.vClass))
+        vtype.setAttribute('emissionClass', str(v.emissionClass))
+        vtype.setAttribute('color', str(v.color))
+        vtype.setAttribute('guiShape', str(v.shape))
+        routes.appendChild(vtype)
+
+    return rootXML.toprettyxml(indent="    ")
+
+
 class Vehicle(ABC):
     def __init__(self, id, length, minGap, weight, maxSpeed, initialSpeed, startstop, acceleration, brakingAcceleration, fullBrakingAcceleration, driverProfile, fuel, emission, depart=-1):
         self.__vehicleID = id